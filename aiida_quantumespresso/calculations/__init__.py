@@ -1,5 +1,7 @@
 # -*- coding: utf-8 -*-
 import os
+import itertools
+import numpy
 
 from aiida.common.exceptions import InputValidationError
 from aiida.common.datastructures import CalcInfo
@@ -254,83 +256,79 @@ class BasePwCpInputGenerator(object):
         del atomic_species_card_list
 
         # ------------ ATOMIC_POSITIONS -----------
-        atomic_positions_card_list = ["ATOMIC_POSITIONS angstrom\n"]
+        # The sites are built only once (structure.sites creates them at
+        # each call), and each card is formatted with a single operation
+        sites = structure.sites
+        site_labels = [site.kind_name.ljust(6) for site in sites]
+        positions = [site.position for site in sites]
 
         # Check on validity of FIXED_COORDS
-        fixed_coords_strings = []
         fixed_coords = settings_dict.pop('FIXED_COORDS', None)
         if fixed_coords is None:
-            # No fixed_coords specified: I store a list of empty strings
-            fixed_coords_strings = [""] * len(structure.sites)
+            # No fixed_coords specified: nothing after the positions
+            atomic_positions_card = "ATOMIC_POSITIONS angstrom\n" + get_card_rows_text(
+                " %18.10f %18.10f %18.10f ", positions, site_labels)
         else:
-            if len(fixed_coords) != len(structure.sites):
+            if len(fixed_coords) != len(sites):
                 raise InputValidationError(
                     "Input structure contains {:d} sites, but "
-                    "fixed_coords has length {:d}".format(len(structure.sites),
+                    "fixed_coords has length {:d}".format(len(sites),
                                                           len(fixed_coords)))
 
-            for i, this_atom_fix in enumerate(fixed_coords):
-                if len(this_atom_fix) != 3:
-                    raise InputValidationError(
-                        "fixed_coords({:d}) has not length three"
-                        "".format(i + 1))
-                for fixed_c in this_atom_fix:
-                    if not isinstance(fixed_c, bool):
-                        raise InputValidationError(
-                            "fixed_coords({:d}) has non-boolean "
-                            "elements".format(i + 1))
-
-                if_pos_values = [self._if_pos(_) for _ in this_atom_fix]
-                fixed_coords_strings.append(
-                    "  {:d} {:d} {:d}".format(*if_pos_values))
-
-        for site, fixed_coords_string in zip(
-                structure.sites, fixed_coords_strings):
-            atomic_positions_card_list.append(
-                "{0} {1:18.10f} {2:18.10f} {3:18.10f} {4}\n".format(
-                    site.kind_name.ljust(6), site.position[0], site.position[1],
-                    site.position[2], fixed_coords_string))
-        atomic_positions_card = "".join(atomic_positions_card_list)
-        del atomic_positions_card_list  # Free memory
+            wrong_lengths = numpy.flatnonzero(
+                numpy.array(map(len, fixed_coords)) != 3)
+            if len(wrong_lengths):
+                i = wrong_lengths[0]
+                raise InputValidationError(
+                    "fixed_coords({:d}) has not length three"
+                    "".format(i + 1))
+            fixed_coords_flat = list(itertools.chain.from_iterable(fixed_coords))
+            if set(map(type, fixed_coords_flat)) - set([bool]):
+                i = next(i for i, this_atom_fix in enumerate(fixed_coords)
+                         if not all(isinstance(_, bool) for _ in this_atom_fix))
+                raise InputValidationError(
+                    "fixed_coords({:d}) has non-boolean "
+                    "elements".format(i + 1))
+
+            if_pos_values = {True: self._if_pos(True), False: self._if_pos(False)}
+            if_pos_values = numpy.reshape(
+                [if_pos_values[_] for _ in fixed_coords_flat], (-1, 3))
+            atomic_positions_card = "ATOMIC_POSITIONS angstrom\n" + get_card_rows_text(
+                " %18.10f %18.10f %18.10f   %d %d %d",
+                numpy.hstack([numpy.reshape(positions, (-1, 3)), if_pos_values]),
+                site_labels)
 
         # velocities (to initialize MD, if set)
         atomic_velocities = settings_dict.pop('ATOMIC_VELOCITIES', None)
         if atomic_velocities is not None:
             # Checking if as many velocities are set as structures:
-            if len(atomic_velocities) != len(structure.sites):
+            if len(atomic_velocities) != len(sites):
                 raise InputValidationError(
                     "Input structure contains {:d} sites, but "
                     "atomic velocities has length {:d}".format(
-                            len(structure.sites),
+                            len(sites),
                             len(atomic_velocities)
                         )
                     )
-            atomic_velocities_strings = ["ATOMIC_VELOCITIES\n"]
-            for site, vel in zip(structure.sites, atomic_velocities):
-                # Checking that all 3 dimension are specified:
-                if len(vel) != 3:
-                    raise InputValidationError(
-                        "Velocities({}) for {} has not length three"
-                        "".format(vel, site))
-                # Appending to atomic_velocities_strings
-                atomic_velocities_strings.append(
-                    "{0} {1:18.10f} {2:18.10f} {3:18.10f}\n".format(
-                            site.kind_name.ljust(6),
-                            vel[0], vel[1], vel[2]
-                        )
-                    )
+            # Checking that all 3 dimension are specified:
+            wrong_lengths = numpy.flatnonzero(
+                numpy.array(map(len, atomic_velocities)) != 3)
+            if len(wrong_lengths):
+                i = wrong_lengths[0]
+                raise InputValidationError(
+                    "Velocities({}) for {} has not length three"
+                    "".format(atomic_velocities[i], sites[i]))
             # I append to atomic_positions_card  so that velocities 
             # are defined right after positions:
-            atomic_positions_card = atomic_positions_card + "".join(atomic_velocities_strings)
-            # Freeing the memory
-            del atomic_velocities_strings
+            atomic_positions_card += "ATOMIC_VELOCITIES\n" + get_card_rows_text(
+                " %18.10f %18.10f %18.10f", atomic_velocities, site_labels)
         # I set the variables that must be specified, related to the system
         # Set some variables (look out at the case! NAMELISTS should be
         # uppercase, internal flag names must be lowercase)
         if 'SYSTEM' not in input_params:
             input_params['SYSTEM'] = {}
         input_params['SYSTEM']['ibrav'] = 0
-        input_params['SYSTEM']['nat'] = len(structure.sites)
+        input_params['SYSTEM']['nat'] = len(sites)
         input_params['SYSTEM']['ntyp'] = len(structure.kinds)
 
         # ============ I prepare the k-points =============
@@ -406,10 +404,10 @@ class BasePwCpInputGenerator(object):
                 pass
             else:
                 kpoints_card_list.append("{:d}\n".format(num_kpoints))
-                for kpoint, weight in zip(kpoints_list, weights):
-                    kpoints_card_list.append(
-                        "  {:18.10f} {:18.10f} {:18.10f} {:18.10f}"
-                        "\n".format(kpoint[0], kpoint[1], kpoint[2], weight))
+                kpoints_card_list.append(get_card_rows_text(
+                    "  %18.10f %18.10f %18.10f %18.10f",
+                    numpy.hstack([numpy.reshape(kpoints_list, (-1, 3)),
+                                  numpy.reshape(weights, (-1, 1))])))
 
             kpoints_card = "".join(kpoints_card_list)
             del kpoints_card_list
@@ -700,10 +698,12 @@ class BasePwCpInputGenerator(object):
             Parserclass = self.get_parserclass()
             parser = Parserclass(self)
             parser_opts = parser.get_parser_settings_key()
-            settings_dict.pop(parser_opts)
+            parser_opts_dict = settings_dict.pop(parser_opts.upper())
         except (KeyError, AttributeError):
             # the key parser_opts isn't inside the dictionary
             pass
+        else:
+            self._check_parser_options(parser_opts_dict)
 
         if settings_dict:
             raise InputValidationError("The following keys have been found in "
@@ -712,6 +712,17 @@ class BasePwCpInputGenerator(object):
 
         return calcinfo
 
+    def _check_parser_options(self, parser_opts):
+        """
+        Check the parser options of the settings before the submission.
+        Nothing is checked here: the subclasses check the options that
+        their parser understands.
+
+        :param parser_opts: the dictionary of the parser options
+        :raise InputValidationError: if the options are not valid
+        """
+        pass
+
     def _if_pos(self, fixed):
         """
         Simple function that returns 0 if fixed is True, 1 otherwise.
@@ -985,6 +996,47 @@ def get_input_data_text(key, val, mapping=None):
         return "  {0} = {1}\n".format(key, conv_to_fortran(val))
 
 
+def get_card_rows_text(row_format, values, labels=None):
+    """
+    Return the text of the rows of a card (e.g. ATOMIC_POSITIONS or K_POINTS),
+    formatted with a single string formatting operation for the whole card
+    rather than one per row. The text is the same as formatting each row with
+    str.format and the corresponding {:18.10f}, {:d} fields.
+
+    :param row_format: the %-format of the values of a row, without the
+            newline, e.g. ``' %18.10f %18.10f %18.10f'``
+    :param values: a 2D array (or list of lists) with the values, one row
+            per line of the card
+    :param labels: optional list of strings (e.g. the kind names), one per
+            row, written at the beginning of each line
+    """
+    values = numpy.asarray(values, dtype=float)
+    if labels is None:
+        text_format = (row_format + "\n") * len(values)
+    else:
+        if len(labels) != len(values):
+            raise ValueError("The number of labels ({}) is different from the "
+                             "number of rows ({})".format(len(labels), len(values)))
+        # the format of the rows, for each (distinct) label
+        row_formats = dict((label, label.replace("%", "%%") + row_format + "\n")
+                           for label in set(labels))
+        text_format = "".join(map(row_formats.__getitem__, labels))
+    return text_format % tuple(values.ravel().tolist())
+
+
+def iter_card_rows_text(row_format, values, labels=None, chunk_size=10000):
+    """
+    Same as get_card_rows_text, but yield the text in chunks of chunk_size
+    rows, so that the text of long cards (e.g. lists of many k-points) can
+    be written to a file without building it in memory as a whole.
+    """
+    values = numpy.asarray(values, dtype=float)
+    for start in range(0, len(values), chunk_size):
+        yield get_card_rows_text(
+            row_format, values[start:start+chunk_size],
+            None if labels is None else labels[start:start+chunk_size])
+
+
 def _lowercase_dict(d, dict_name):
     from collections import Counter
 
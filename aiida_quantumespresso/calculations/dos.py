@@ -27,6 +27,8 @@ class DosCalculation(NamelistsCalculation):
                                  ]
         self._internal_retrieve_list = [self._DOS_FILENAME]
         self._default_parser = 'quantumespresso.dos'
+        # dos.x only reads the parent output
+        self._default_symlink_usage = True
 
     def use_parent_calculation(self,calc):
         """
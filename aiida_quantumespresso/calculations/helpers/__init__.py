@@ -1,6 +1,8 @@
 # -*- coding: utf-8 -*-
 import xml.dom.minidom
 import os
+import json
+import tempfile
 import difflib
 import copy
 from aiida.common.exceptions import InputValidationError, InternalError
@@ -65,8 +67,179 @@ def _check_and_convert(kw,val,expected_type):
 
     return outval
 
+# compiled INPUT_PW definitions, by version (see get_pw_input_schema)
+_pw_input_schemas = {}
+
+def _get_pw_input_xml_path(version):
+    """
+    Return the path of the XML file with the definition of the pw.x input
+    for the given version.
+
+    :raise QEInputValidationError: if the version is not known, suggesting
+        a close-by version
+    """
+    module_dir = os.path.dirname(__file__)
+    if module_dir == '':
+        module_dir = os.curdir
+    xml_path = os.path.join(module_dir,'INPUT_PW-{}.xml'.format(version))
+    if not os.path.isfile(xml_path):
+        prefix = 'INPUT_PW-'
+        suffix = '.xml'
+        versions = [fname[len(prefix):-len(suffix)] for fname
+                    in os.listdir(module_dir) if fname.startswith(prefix)
+                    and fname.endswith(suffix)]        
+        versions = sorted(versions, key=lambda x: StrictVersion(x))
+        strictversions = versions + [version]
+        strictversions = sorted(strictversions, key=lambda x: StrictVersion(x))
+        pos = strictversions.index(version)
+        if pos == 0:
+            add_str = " (the version you specified is too old)"
+        else:
+            add_str = " (the older, closest version you can use is {})".format(
+                strictversions[pos-1])
+        raise QEInputValidationError(
+            "Unknown Quantum Espresso version: {}. "
+            "Available versions: {};{}".format(version, ", ".join(versions),
+            add_str))
+    return xml_path
+
+def compile_pw_input_schema(xml_path):
+    """
+    Parse the XML file with the definition of the pw.x input, and return
+    the tables of the known variables and arrays (dimensions).
+
+    :param xml_path: path of the INPUT_PW-<version>.xml file
+    :return: a dictionary with keys 'keywords' and 'dimensions'. Each is a
+        dictionary associating to each (lowercase) variable name a dictionary
+        with the 'namelist' (missing for variables in cards) and the
+        'expected_type'; for dimensions, also the 'end_val' of the array.
+    """
+    with open(xml_path,'r') as f:
+        dom = xml.dom.minidom.parse(f)
+
+    # ========== List of known PW variables (from XML file) ===============
+    known_kws = dom.getElementsByTagName('var')
+    valid_kws = {}
+    for kw in known_kws:
+        if kw in valid_kws:
+            raise InternalError("Something strange, I found more than one "
+                                "keyword '{}' in the XML description...".format(
+                                kw))
+    
+        valid_kws[kw.getAttribute('name').lower()] = {}
+        parent = kw
+        try:
+            while True:
+                parent = parent.parentNode
+                if parent.tagName == 'namelist':
+                    valid_kws[kw.getAttribute('name').lower()]["namelist"] = \
+                        parent.getAttribute('name').upper()
+                    break
+        except AttributeError:
+            # There are also variables in cards instead of namelists: 
+            # I ignore them
+            pass
+                # raise QEInputValidationError("Unable to find namelist for "
+                #     "keyword %s." % kw.getAttribute('name'))
+        expected_type = kw.getAttribute('type')
+        # Fix for groups of variables
+        if expected_type == '':
+            if kw.parentNode.tagName == 'vargroup':
+                expected_type = kw.parentNode.getAttribute('type')
+        valid_kws[kw.getAttribute('name').lower()]['expected_type'] = \
+            expected_type.upper()
+        
+
+    # ====== List of known PW 'dimensions' (arrays) (from XML file) ===========
+    known_dims = dom.getElementsByTagName('dimension')
+    valid_dims = {}
+    for dim in known_dims:
+        if dim in valid_dims:
+            raise InternalError("Something strange, I found more than one "
+                "keyword '{}' in the XML description...".format(dim))
+    
+        valid_dims[dim.getAttribute('name').lower()] = {}
+        parent = dim
+        try:
+            while True:
+                parent = parent.parentNode
+                if parent.tagName == 'namelist':
+                    valid_dims[dim.getAttribute('name').lower()]["namelist"] = \
+                        parent.getAttribute('name').upper()
+                    break
+        except AttributeError:
+            # There are also variables in cards instead of namelists: 
+            # I ignore them
+            pass
+                # raise QEInputValidationError("Unable to find namelist "
+                #     "for keyword %s." % dim.getAttribute('name'))
+        expected_type = dim.getAttribute('type')
+        # Fix for groups of variables
+        if expected_type == '':
+            if dim.parentNode.tagName == 'vargroup':
+                expected_type = dim.parentNode.getAttribute('type')
+        valid_dims[dim.getAttribute('name').lower()]['expected_type'] = \
+            expected_type.upper()
+        # I assume start_val is always 1
+        start_val = dim.getAttribute('start')
+        if start_val != '1':
+            raise InternalError(
+                "Wrong start value '{}' in input array (dimension) {}".format(
+                    (start_val, dim.getAttribute('name'))))
+        # I save the string as it is; somewhere else I will check for its value
+        valid_dims[dim.getAttribute('name').lower()]['end_val'] = \
+            dim.getAttribute('end')
+
+    return {'keywords': valid_kws, 'dimensions': valid_dims}
+
+def get_pw_input_schema(version, cache_folder=None):
+    """
+    Return the compiled definition of the pw.x input for the given version
+    (see compile_pw_input_schema). The XML file is parsed only once per
+    process; the result must not be modified.
+
+    :param version: the version of Quantum ESPRESSO
+    :param cache_folder: if specified, the compiled definition is also
+        stored as a JSON file in this folder, and read from there (unless
+        the XML file is newer) by the following processes
+    :raise QEInputValidationError: if the version is not known
+    """
+    try:
+        return _pw_input_schemas[version]
+    except KeyError:
+        pass
+
+    xml_path = _get_pw_input_xml_path(version)
+
+    schema = None
+    if cache_folder is not None:
+        cache_path = os.path.join(cache_folder,
+                                  'INPUT_PW-{}.json'.format(version))
+        try:
+            if os.path.getmtime(cache_path) >= os.path.getmtime(xml_path):
+                with open(cache_path) as f:
+                    schema = json.load(f)
+        except (IOError, OSError, ValueError):
+            # missing or broken cache file: compile again
+            schema = None
+
+    if schema is None:
+        schema = compile_pw_input_schema(xml_path)
+        if cache_folder is not None:
+            # write and rename, so that concurrent processes never
+            # read a partially written file
+            handle, tmp_path = tempfile.mkstemp(dir=cache_folder,
+                                                suffix='.json')
+            with os.fdopen(handle, 'w') as f:
+                json.dump(schema, f)
+            os.rename(tmp_path, cache_path)
+
+    _pw_input_schemas[version] = schema
+    return schema
+
 def pw_input_helper(input_params, structure, 
-    stop_at_first_error=False, flat_mode=False, version="5.4.0"):
+    stop_at_first_error=False, flat_mode=False, version="5.4.0",
+    schema_cache_folder=None):
     """
     Validate if the input dictionary for Quantum ESPRESSO is valid.
     Return the dictionary (possibly with small variations: e.g. convert
@@ -123,6 +296,9 @@ def pw_input_helper(input_params, structure,
         available in the validator. It reads the definitions from the XML files
         in the same folder as this python module. If the version is not
         recognised, the Exception message will also suggest a close-by version.
+    :param schema_cache_folder: if specified, a folder where to store the
+        definitions read from the XML files, to be reused by other processes
+        (see get_pw_input_schema).
 
     :raise QeInputValidationError: (subclass of InputValidationError) if
         the input is not considered valid.
@@ -191,107 +367,10 @@ def pw_input_helper(input_params, structure,
                      ]
                    ])
     
-    # ===================== PARSING OF THE XML DEFINITION FILE ===============    
-    module_dir = os.path.dirname(__file__)
-    if module_dir == '':
-        module_dir = os.curdir
-    xml_path = os.path.join(module_dir,'INPUT_PW-{}.xml'.format(version))
-    try:        
-        with open(xml_path,'r') as f:
-            dom = xml.dom.minidom.parse(f)
-    except IOError: 
-        prefix = 'INPUT_PW-'
-        suffix = '.xml'
-        versions = [fname[len(prefix):-len(suffix)] for fname
-                    in os.listdir(module_dir) if fname.startswith(prefix)
-                    and fname.endswith(suffix)]        
-        versions = sorted(versions, key=lambda x: StrictVersion(x))
-        strictversions = versions + [version]
-        strictversions = sorted(strictversions, key=lambda x: StrictVersion(x))
-        pos = strictversions.index(version)
-        if pos == 0:
-            add_str = " (the version you specified is too old)"
-        else:
-            add_str = " (the older, closest version you can use is {})".format(
-                strictversions[pos-1])
-        raise QEInputValidationError(
-            "Unknown Quantum Espresso version: {}. "
-            "Available versions: {};{}".format(version, ", ".join(versions),
-            add_str))
-
-
-    # ========== List of known PW variables (from XML file) ===============
-    known_kws = dom.getElementsByTagName('var')
-    valid_kws = {}
-    for kw in known_kws:
-        if kw in valid_kws:
-            raise InternalError("Something strange, I found more than one "
-                                "keyword '{}' in the XML description...".format(
-                                kw))
-    
-        valid_kws[kw.getAttribute('name').lower()] = {}
-        parent = kw
-        try:
-            while True:
-                parent = parent.parentNode
-                if parent.tagName == 'namelist':
-                    valid_kws[kw.getAttribute('name').lower()]["namelist"] = \
-                        parent.getAttribute('name').upper()
-                    break
-        except AttributeError:
-            # There are also variables in cards instead of namelists: 
-            # I ignore them
-            pass
-                # raise QEInputValidationError("Unable to find namelist for "
-                #     "keyword %s." % kw.getAttribute('name'))
-        expected_type = kw.getAttribute('type')
-        # Fix for groups of variables
-        if expected_type == '':
-            if kw.parentNode.tagName == 'vargroup':
-                expected_type = kw.parentNode.getAttribute('type')
-        valid_kws[kw.getAttribute('name').lower()]['expected_type'] = \
-            expected_type.upper()
-        
-
-    # ====== List of known PW 'dimensions' (arrays) (from XML file) ===========
-    known_dims = dom.getElementsByTagName('dimension')
-    valid_dims = {}
-    for dim in known_dims:
-        if dim in valid_dims:
-            raise InternalError("Something strange, I found more than one "
-                "keyword '{}' in the XML description...".format(dim))
-    
-        valid_dims[dim.getAttribute('name').lower()] = {}
-        parent = dim
-        try:
-            while True:
-                parent = parent.parentNode
-                if parent.tagName == 'namelist':
-                    valid_dims[dim.getAttribute('name').lower()]["namelist"] = \
-                        parent.getAttribute('name').upper()
-                    break
-        except AttributeError:
-            # There are also variables in cards instead of namelists: 
-            # I ignore them
-            pass
-                # raise QEInputValidationError("Unable to find namelist "
-                #     "for keyword %s." % dim.getAttribute('name'))
-        expected_type = dim.getAttribute('type')
-        # Fix for groups of variables
-        if expected_type == '':
-            if dim.parentNode.tagName == 'vargroup':
-                expected_type = dim.parentNode.getAttribute('type')
-        valid_dims[dim.getAttribute('name').lower()]['expected_type'] = \
-            expected_type.upper()
-        # I assume start_val is always 1
-        start_val = dim.getAttribute('start')
-        if start_val != '1':
-            raise InternalError(
-                "Wrong start value '{}' in input array (dimension) {}".format(
-                    (start_val, dim.getAttribute('name'))))
-        # I save the string as it is; somewhere else I will check for its value
-        valid_dims[dim.getAttribute('name').lower()]['end_val'] = \
-            dim.getAttribute('end')
+    # ============ KNOWN VARIABLES (from the XML definition file) =============
+    schema = get_pw_input_schema(version, cache_folder=schema_cache_folder)
+    valid_kws = schema['keywords']
+    valid_dims = schema['dimensions']
 
     # Used to suggest valid keywords if an unknown one is found
     valid_invars_list = list(
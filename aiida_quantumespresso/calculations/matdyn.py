@@ -1,9 +1,11 @@
 # -*- coding: utf-8 -*-
 import os
+import itertools
 from aiida.common.utils import classproperty
 from aiida.orm.data.folder import FolderData
 from aiida.orm.data.remote import RemoteData
 from aiida.orm.data.array.kpoints import KpointsData
+from aiida_quantumespresso.calculations import iter_card_rows_text
 from aiida_quantumespresso.calculations.namelists import NamelistsCalculation
 from aiida_quantumespresso.calculations.q2r import Q2rCalculation
 
@@ -77,7 +79,8 @@ class MatdynCalculation(NamelistsCalculation):
    
     def _get_following_text(self, inputdict, settings):
         """
-        Add the kpoints after the namelist.
+        Add the kpoints after the namelist. The list is formatted in chunks
+        while it is written to the input file.
         
         This function should consume the content of inputdict (if it requires
         a different node) or the keys inside settings, using the 'pop' method,
@@ -98,11 +101,9 @@ class MatdynCalculation(NamelistsCalculation):
         except AttributeError:
             klist = kpoints.get_kpoints_mesh(print_list=True)
         
-        retlist = ["{}".format(len(klist))]
-        for k in klist:
-            retlist.append("{:18.10f} {:18.10f} {:18.10f}".format(*k))
-        
-        return "\n".join(retlist)+"\n"
+        return itertools.chain(["{}\n".format(len(klist))],
+                               iter_card_rows_text("%18.10f %18.10f %18.10f",
+                                                   klist))
     
     def _prepare_for_submission(self,tempfolder, inputdict): 
         from aiida.orm.data.singlefile import SinglefileData
@@ -51,6 +51,13 @@ class NamelistsCalculation(JobCalculation):
         self._parent_folder_type = (RemoteData, FolderData, SinglefileData)
         self._default_parser = None
         self._retrieve_singlefile_list = []
+        # If the parent_folder is of type RemoteData, the files in its
+        # output subfolder are symlinked (one by one, in a new output
+        # subfolder) instead of copied, unless the user specified a
+        # SETTINGS->parent_folder_symlink value. Set it to True only for the
+        # codes that do not write inside the subfolders of the parent output
+        # (e.g. in prefix.save), that would be modified otherwise
+        self._default_symlink_usage = False
 
         # Default input and output files
         self._DEFAULT_INPUT_FILE = 'aiida.in'
@@ -89,6 +96,9 @@ class NamelistsCalculation(JobCalculation):
     def _get_following_text(self, inputdict, settings):
         """
         By default, no text follows the namelists section.
+        The text can be returned as a string or, for long cards, as an
+        iterable of strings (e.g. from iter_card_rows_text), that are
+        written to the input file one after the other.
         This function should consume the content of inputdict (if it requires
         a different node) or the keys inside settings, using the 'pop' method,
         so that inputdict and settings should remain empty at the end of 
@@ -108,6 +118,7 @@ class NamelistsCalculation(JobCalculation):
         """
         local_copy_list = []
         remote_copy_list = []
+        remote_symlink_list = []
 
         try:
             code = inputdict.pop(self.get_linkname('code'))
@@ -204,7 +215,11 @@ class NamelistsCalculation(JobCalculation):
                 infile.write("/\n")
 
             # Write remaning text now, if any
-            infile.write(following_text)
+            if isinstance(following_text, basestring):
+                infile.write(following_text)
+            else:
+                for text in following_text:
+                    infile.write(text)
 
         # Check for specified namelists that are not expected
         if input_params:
@@ -213,16 +228,28 @@ class NamelistsCalculation(JobCalculation):
                 "not valid namelists for the current type of calculation: "
                 "{}".format(",".join(input_params.keys())))
         
-        # copy remote output dir, if specified
+        # copy (or symlink) remote output dir, if specified
+        symlink = settings_dict.pop('PARENT_FOLDER_SYMLINK',
+                                    self._default_symlink_usage) # a boolean
         if parent_calc_folder is not None:
             if isinstance(parent_calc_folder,RemoteData):
                 parent_calc_out_subfolder = settings_dict.pop('PARENT_CALC_OUT_SUBFOLDER',
                                               self._INPUT_SUBFOLDER)
-                remote_copy_list.append(
-                         (parent_calc_folder.get_computer().uuid,
-                          os.path.join(parent_calc_folder.get_remote_path(),
-                                       parent_calc_out_subfolder),
-                          self._OUTPUT_SUBFOLDER))
+                if symlink:
+                    # I create a symlink to each file/folder in the parent
+                    # ./out, so that the files written in ./out stay here
+                    tempfolder.get_subfolder(self._OUTPUT_SUBFOLDER, create=True)
+                    remote_symlink_list.append(
+                             (parent_calc_folder.get_computer().uuid,
+                              os.path.join(parent_calc_folder.get_remote_path(),
+                                           parent_calc_out_subfolder, "*"),
+                              self._OUTPUT_SUBFOLDER))
+                else:
+                    remote_copy_list.append(
+                             (parent_calc_folder.get_computer().uuid,
+                              os.path.join(parent_calc_folder.get_remote_path(),
+                                           parent_calc_out_subfolder),
+                              self._OUTPUT_SUBFOLDER))
             elif isinstance(parent_calc_folder,FolderData):
                 local_copy_list.append(
                     (parent_calc_folder.get_abs_path(self._INPUT_SUBFOLDER),
@@ -240,6 +267,7 @@ class NamelistsCalculation(JobCalculation):
         # Empty command line by default
         calcinfo.local_copy_list = local_copy_list
         calcinfo.remote_copy_list = remote_copy_list
+        calcinfo.remote_symlink_list = remote_symlink_list
         
         codeinfo = CodeInfo()
         codeinfo.cmdline_params = settings_dict.pop('CMDLINE', [])
@@ -268,7 +296,7 @@ class NamelistsCalculation(JobCalculation):
                 Parserclass = self.get_parserclass()
                 parser = Parserclass(self)
                 parser_opts = parser.get_parser_settings_key()
-                settings_dict.pop(parser_opts)
+                settings_dict.pop(parser_opts.upper())
             except (KeyError,AttributeError): # the key parser_opts isn't inside the dictionary, or it is set to None
                 raise InputValidationError("The following keys have been found in "
                   "the settings input node, but were not understood: {}".format(
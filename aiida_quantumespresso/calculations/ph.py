@@ -440,6 +440,15 @@ class PhCalculation(JobCalculation):
         for extra in extra_retrieved:
             calcinfo.retrieve_list.append( extra )
         
+        try:
+            Parserclass = self.get_parserclass()
+            parser = Parserclass(self)
+            parser_opts = parser.get_parser_settings_key()
+            settings_dict.pop(parser_opts.upper())
+        except (KeyError, AttributeError):
+            # the key parser_opts isn't inside the dictionary
+            pass
+        
         if settings_dict:
             raise InputValidationError("The following keys have been found in "
                 "the settings input node, but were not understood: {}".format(
@@ -19,6 +19,8 @@ class PpCalculation(NamelistsCalculation):
                                  ]
         self._default_parser = None
         self._internal_retrieve_list = [self._FILPLOT]
+        # pp.x only reads the parent output
+        self._default_symlink_usage = True
 
     def use_parent_calculation(self,calc):
         """
@@ -26,6 +26,8 @@ class ProjwfcCalculation(NamelistsCalculation):
                                  ]
         self._default_parser = 'quantumespresso.projwfc'
         self._internal_retrieve_list = [self._PREFIX+".pdos*"]
+        # the parent output is copied, not symlinked (the default), because
+        # projwfc.x writes atomic_proj.xml inside prefix.save
 
     def use_parent_calculation(self,calc):
         """
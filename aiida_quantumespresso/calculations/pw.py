@@ -19,6 +19,7 @@ import os
 from aiida.orm.calculation.job import JobCalculation
 from aiida_quantumespresso.calculations import BasePwCpInputGenerator
 from aiida.common.utils import classproperty
+from aiida.common.exceptions import InputValidationError
 from aiida.orm.data.array.kpoints import KpointsData
 
 
@@ -88,6 +89,22 @@ class PwCalculation(BasePwCpInputGenerator, JobCalculation):
 
         return retdict
 
+    def _check_parser_options(self, parser_opts):
+        """
+        Check the xml backend and the sections to exclude of the parser
+        options, so that a wrong name fails the submission and not the
+        parsing.
+
+        :param parser_opts: the dictionary of the parser options
+        :raise InputValidationError: if the backend or a section is unknown
+        """
+        from aiida_quantumespresso.parsers import QEOutputParsingError
+        from aiida_quantumespresso.parsers.raw_parser_pw import check_parser_options
+        try:
+            check_parser_options(parser_opts)
+        except QEOutputParsingError as e:
+            raise InputValidationError("Invalid parser options: {}".format(e))
+
     @classmethod
     def input_helper(cls, *args, **kwargs):
         """
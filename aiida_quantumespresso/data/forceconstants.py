@@ -9,20 +9,26 @@ from aiida_quantumespresso.parsers.constants import bohr_to_ang
 class ForceconstantsData(SinglefileData):
     """
     Class to handle interatomic force constants from Quantum Espresso - Q2R.
+    The force constants array is also stored in binary form (.npy) next to
+    the text file, and memory-mapped when read back.
     """
 
+    _force_constants_suffix = '.npy'
+
     def set_file(self, filename):
     
         """
         Add a file to the singlefiledata, parse it and set the attributes found
         :param filename: absolute path to the file
         """
+        import tempfile
+
         with open(filename,'r') as f:
             lines = f.readlines()
         
         # parse the force constants file
         out_dict, fc, warnings = parse_q2r_force_constants_file(lines,
-                                                    also_force_constants=False)
+                                                    also_force_constants=True)
         
         # check the path and add filename attribute
         self.add_path(filename)
@@ -30,6 +36,21 @@ class ForceconstantsData(SinglefileData):
         # add all other attributes found in the parsed dictionary
         for key in out_dict.keys():
             self._set_attr(key, out_dict[key])
+
+        # store the force constants next to the file. Note: add_path of
+        # SinglefileData would remove all the other files of the node
+        with tempfile.NamedTemporaryFile(suffix=self._force_constants_suffix) as f:
+            numpy.save(f, fc)
+            f.flush()
+            super(SinglefileData, self).add_path(f.name,
+                                                 self._get_force_constants_filename())
+        self._force_constants = fc
+
+    def _get_force_constants_filename(self):
+        """
+        Name of the .npy file with the force constants, in the node folder
+        """
+        return self.filename + self._force_constants_suffix
  
     @property
     def number_of_species(self):
@@ -46,6 +67,20 @@ class ForceconstantsData(SinglefileData):
         :return: a scalar
         """
         return self.get_attr('number_of_atoms')
+
+    @property
+    def lattice_parameter(self):
+        """
+        The lattice parameter ('alat' in QE), in Angstrom. Read from the
+        file for the nodes created before it was stored as an attribute.
+        :return: a scalar
+        """
+        try:
+            return self.get_attr('lattice_parameter')
+        except AttributeError:
+            with open(self.get_file_abs_path(),'r') as f:
+                first_line = f.readline()
+            return float(first_line.split()[3])*bohr_to_ang
         
     @property
     def cell(self):
@@ -96,6 +131,88 @@ class ForceconstantsData(SinglefileData):
         :return: a length-3 tuple
         """
         return tuple(self.get_attr('qpoints_mesh'))
+
+    @property
+    def force_constants(self):
+        """
+        The real-space force constants, read on first access and then cached.
+        The .npy file is memory-mapped, if present (nodes created before it
+        was introduced do not have it); otherwise the text file is parsed.
+        :return: a numpy.array with 7 indices, of the kind
+         C(m1,m2,m3,j1,j2,na1,na2) (see parse_q2r_force_constants_file)
+        """
+        try:
+            return self._force_constants
+        except AttributeError:
+            pass
+
+        fc_filename = self._get_force_constants_filename()
+        if fc_filename in self.get_folder_list():
+            self._force_constants = numpy.load(self.get_abs_path(fc_filename),
+                                               mmap_mode='r')
+        else:
+            with open(self.get_file_abs_path(),'r') as f:
+                lines = f.readlines()
+            _, self._force_constants, _ = parse_q2r_force_constants_file(
+                                            lines, also_force_constants=True)
+        return self._force_constants
+
+    def get_phonon_bands(self, kpoints, asr=False, nac=True):
+        """
+        Computes the phonon frequencies on a list of q-points by Fourier
+        interpolation of the force constants, as a MatdynCalculation does
+        but without running matdyn.x (see interpolate_dynamical_matrices in
+        aiida_quantumespresso.tools.phonon_tools).
+        :param kpoints: a KpointsData with the q-points, as the kpoints
+         input of a MatdynCalculation (list or mesh, in crystal coordinates)
+        :param asr: True to impose the 'simple' acoustic sum rule of matdyn
+        :param nac: True to add the long-range and non-analytic terms, if
+         the dielectric tensor and the effective charges were computed
+        :return: a BandsData with the frequencies in THz, as the
+         output_phonon_bands of the MatdynParser
+        """
+        from aiida.orm.data.array.bands import BandsData
+        from aiida.orm.data.array.kpoints import KpointsData
+        from aiida_quantumespresso.parsers.constants import invcm_to_THz, amu_Ry
+        from aiida_quantumespresso.tools.phonon_tools import (
+            apply_force_constants_sum_rule, interpolate_dynamical_matrices,
+            diagonalize_dynamical_matrices)
+
+        try:
+            qpoints = kpoints.get_kpoints()
+            kpointsdata_for_bands = kpoints.copy()
+        except AttributeError:
+            qpoints = kpoints.get_kpoints_mesh(print_list=True)
+            kpointsdata_for_bands = KpointsData()
+            kpointsdata_for_bands.set_kpoints(qpoints)
+
+        # everything in units of the lattice parameter, as in QE
+        alat = self.lattice_parameter
+        cell = self.cell/alat
+        atom_list = self.atom_list
+        positions = numpy.array([_[2:] for _ in atom_list])/alat
+        masses = numpy.array([_[1] for _ in atom_list])/amu_Ry
+
+        force_constants = self.force_constants
+        dielectric_tensor = None
+        effective_charges = None
+        if nac and self.has_done_electric_field:
+            dielectric_tensor = self.dielectric_tensor
+            effective_charges = self.effective_charges_eu
+        if asr:
+            force_constants, effective_charges = apply_force_constants_sum_rule(
+                force_constants, effective_charges)
+
+        dynamical_matrices = interpolate_dynamical_matrices(qpoints,
+            force_constants, cell, positions, alat/bohr_to_ang,
+            dielectric_tensor, effective_charges)
+        frequencies, _ = diagonalize_dynamical_matrices(dynamical_matrices,
+            masses, also_eigenvectors=False)
+
+        output_bands = BandsData()
+        output_bands.set_kpointsdata(kpointsdata_for_bands)
+        output_bands.set_bands(frequencies*invcm_to_THz,units='THz')
+        return output_bands
         
 
 def parse_q2r_force_constants_file(lines,also_force_constants=False):
@@ -108,6 +225,7 @@ def parse_q2r_force_constants_file(lines,also_force_constants=False):
     
     - number_of_species: number of atom species ('ntyp' in QE)
     - number_of_atoms: number of atoms ('nat' in QE)
+    - lattice_parameter: lattice parameter ('alat' in QE), in Angstrom
     - cell: unit cell
     - atom_list: list with, for each atom in the cell, a length-5 
     tuple of the form (element_name, mass_in_amu_ry, then 3 coordinates in 
@@ -154,6 +272,7 @@ def parse_q2r_force_constants_file(lines,also_force_constants=False):
         
         parsed_data['number_of_species'] = ntyp
         parsed_data['number_of_atoms'] = nat
+        parsed_data['lattice_parameter'] = celldm[0]*bohr_to_ang
         #parsed_data['ibrav'] = ibrav
         #parsed_data['celldm'] = celldm
         current_line += 1
@@ -214,31 +333,35 @@ def parse_q2r_force_constants_file(lines,also_force_constants=False):
 
         force_constants = ()
         if also_force_constants:
-            # read force_constants
-            force_constants = numpy.zeros(qpoints_mesh+(3,3,nat,nat),dtype=float)
-            for j1 in range(3):
-                for j2 in range(3):
-                    for na1 in range(nat):
-                        for na2 in range(nat):
-                            
-                            indices = tuple([int(c) for c in lines[current_line].split()])
-                            current_line += 1
-                            if (j1+1, j2+1, na1+1, na2+1) != indices:
-                                raise ValueError("Wrong indices in force constants")
-                            
-                            for m3 in range(qpoints_mesh[2]):
-                                for m2 in range(qpoints_mesh[1]):
-                                    for m1 in range(qpoints_mesh[0]):
-                            
-                                        line = lines[current_line].split()
-                                        indices = tuple(int(c) for c in line[:3])
-                            
-                                        if (m1+1, m2+1, m3+1) != indices:
-                                            raise ValueError("Wrong supercell "
-                                                    "indices in force constants")
-                
-                                        force_constants[m1,m2,m3,j1,j2,na1,na2] = float(line[3])
-                                        current_line += 1
+            # read force_constants: for each (j1,j2,na1,na2) block, a line
+            # with the 4 indices followed by one line per supercell vector
+            # with 3 indices and the value. All lines have 4 columns, so the
+            # whole section is decoded at once into a
+            # (num_blocks, 1 + supercell size, 4) array
+            num_blocks = 9*nat*nat
+            num_cells = qpoints_mesh[0]*qpoints_mesh[1]*qpoints_mesh[2]
+            num_lines = num_blocks*(num_cells+1)
+            fc_lines = lines[current_line:current_line+num_lines]
+            values = numpy.fromstring(' '.join(fc_lines), sep=' ')
+            if len(fc_lines) != num_lines or len(values) != 4*num_lines:
+                raise ValueError("Wrong number of force constants")
+            values = values.reshape(num_blocks, num_cells+1, 4)
+            current_line += num_lines
+
+            # indices expected in the block headers, na2 running fastest
+            block_indices = numpy.indices((3,3,nat,nat)).reshape(4,-1).T + 1
+            if not numpy.array_equal(values[:,0,:], block_indices):
+                raise ValueError("Wrong indices in force constants")
+            # indices expected in each block, m1 running fastest
+            cell_indices = numpy.indices(qpoints_mesh[::-1]).reshape(3,-1).T[:,::-1] + 1
+            if not (values[:,1:,:3] == cell_indices).all():
+                raise ValueError("Wrong supercell "
+                                 "indices in force constants")
+
+            # from (j1,j2,na1,na2,m3,m2,m1) to (m1,m2,m3,j1,j2,na1,na2)
+            force_constants = values[:,1:,3].reshape(
+                (3,3,nat,nat)+qpoints_mesh[::-1]).transpose(6,5,4,0,1,2,3)
+            force_constants = numpy.ascontiguousarray(force_constants)
 
     except (IndexError, ValueError) as e:
         raise ValueError(e.message+"\nForce constants file could not be parsed "
@@ -1,4 +1,6 @@
 # -*- coding: utf-8 -*-
+import os
+import re
 from aiida.parsers.exceptions import OutputParsingError
 
 
@@ -38,6 +40,210 @@ def convert_qe2aiida_structure(output_dict, input_structure=None):
 
     return s
 
+class RetrievedFiles(object):
+    """
+    Read access to the retrieved files of a calculation, to be shared by a
+    parser and the raw parsing functions it calls, so that each file is read
+    only once: it is memory-mapped on first access, and its text and lines
+    are built (once) only if requested.
+    tail_contains() searches a file backwards from its end, e.g. for the
+    'JOB DONE' written by QE at the end of the run, without decoding it.
+
+    The files are released by close(), or when the object is deleted.
+    """
+
+    def __init__(self, folder=None):
+        """
+        :param folder: the retrieved FolderData, or the path of a directory;
+            None if the files are always given with their absolute path
+        """
+        if folder is None or isinstance(folder, basestring):
+            self._folder_path = folder
+        else:
+            self._folder_path = folder.get_abs_path('.')
+        self._maps = {}
+        self._texts = {}
+        self._lines = {}
+
+    def get_abs_path(self, name):
+        """
+        :param name: the name of the file in the folder, or an absolute path
+        :return: the absolute path of the file
+        """
+        if self._folder_path is None:
+            return name
+        return os.path.join(self._folder_path, name)
+
+    def get_mmap(self, name):
+        """
+        :return: the content of the file, memory-mapped (read only). It
+            supports len(), slicing, find() and rfind() like a string (and
+            it is an empty string for empty files, that cannot be mapped)
+        :raise IOError: if the file cannot be opened
+        """
+        path = self.get_abs_path(name)
+        try:
+            return self._maps[path]
+        except KeyError:
+            pass
+
+        import mmap
+        with open(path, 'rb') as f:
+            f.seek(0, os.SEEK_END)
+            if f.tell() == 0:
+                data = ''
+            else:
+                data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._maps[path] = data
+        return data
+
+    def read(self, name):
+        """
+        :return: the content of the file as a string, as returned by read()
+        :raise IOError: if the file cannot be opened
+        """
+        path = self.get_abs_path(name)
+        try:
+            return self._texts[path]
+        except KeyError:
+            pass
+        text = self.get_mmap(path)[:]
+        self._texts[path] = text
+        return text
+
+    def readlines(self, name):
+        """
+        :return: the list of the lines of the file, with the trailing newline,
+            as returned by readlines(). The list is shared: do not modify it
+        :raise IOError: if the file cannot be opened
+        """
+        path = self.get_abs_path(name)
+        try:
+            return self._lines[path]
+        except KeyError:
+            pass
+        lines = self.read(path).split('\n')
+        last = lines.pop()
+        lines = [line + '\n' for line in lines]
+        if last:
+            lines.append(last)
+        self._lines[path] = lines
+        return lines
+
+    def tail_contains(self, name, string, max_bytes=None):
+        """
+        Search a string in the file, backwards from its end.
+
+        :param max_bytes: if given, only the last max_bytes bytes of the file
+            are searched; by default the whole file is searched
+        :return: True if the string is found
+        :raise IOError: if the file cannot be opened
+        """
+        data = self.get_mmap(name)
+        start = 0
+        if max_bytes is not None:
+            start = max(0, len(data) - max_bytes)
+        return data.rfind(string, start) != -1
+
+    def close(self):
+        """
+        Release the memory-mapped files.
+        """
+        for data in self._maps.values():
+            if not isinstance(data, basestring):
+                data.close()
+        self._maps = {}
+        self._texts = {}
+        self._lines = {}
+
+# comments (e.g. the header of the dos and pdos files)
+table_comment_re = re.compile(r'#[^\n]*')
+
+def get_table_row_lengths(text):
+    """
+    Counts the whitespace separated tokens of each line of a text, with
+    numpy operations on its bytes rather than splitting every line.
+
+    :param text: a string
+    :return: a 1D integer array with the number of tokens of each line
+    """
+    import numpy
+
+    data = numpy.frombuffer(text, dtype=numpy.uint8)
+    is_space = numpy.zeros(len(data), dtype=bool)
+    for char in ' \t\n\r\v\f':
+        is_space |= data == ord(char)
+    # a token starts at a non-space character after a space, or at the start
+    token_starts = ~is_space
+    token_starts[1:] &= is_space[:-1]
+    line_ends = numpy.flatnonzero(data == ord('\n'))
+    # the line of each token is the number of newlines before it
+    token_lines = numpy.searchsorted(line_ends, numpy.flatnonzero(token_starts))
+    return numpy.bincount(token_lines, minlength=len(line_ends) + 1)
+
+def read_numeric_table(text, num_columns=None, usecols=None):
+    """
+    Reads a table of numbers separated by whitespace, one row per line, as
+    the dos, pdos and evp files written by QE. Everything following a # is
+    a comment. The numbers are decoded by a single numpy call, much faster
+    than numpy.genfromtxt or float() on each token.
+
+    :param text: the content of the file (a string)
+    :param num_columns: the expected number of columns; by default, the
+        number of values in the first row
+    :param usecols: if given, only these columns are returned (an index or
+        a list of indices, as for numpy.loadtxt)
+    :return: a 2D array, one row per line (a 1D array if usecols is an index)
+    :raise QEOutputParsingError: if not all the rows have the same number of
+        columns, if a value is not a number, or if a value is a NaN
+    """
+    import numpy
+
+    if '#' in text:
+        text = table_comment_re.sub('', text)
+
+    # the number of values of each row (the blank lines are skipped): they
+    # must all be equal, otherwise the values would be reshaped into the
+    # wrong rows
+    row_lengths = get_table_row_lengths(text)
+    rows = numpy.flatnonzero(row_lengths)
+    num_rows = len(rows)
+    if num_columns is None:
+        num_columns = row_lengths[rows[0]] if num_rows else 0
+    wrong_rows = rows[row_lengths[rows] != num_columns]
+    if len(wrong_rows):
+        raise QEOutputParsingError("Wrong format of the table: {} columns "
+                                   "found in line {} instead of {}"
+                                   .format(row_lengths[wrong_rows[0]],
+                                           wrong_rows[0] + 1, num_columns))
+
+    # fromstring stops at the first token that is not a number: in that
+    # case there are less values than expected
+    if num_rows:
+        values = numpy.fromstring(text, sep=' ')
+    else:
+        values = numpy.zeros(0)
+    if len(values) != num_rows * num_columns:
+        raise QEOutputParsingError("Wrong format of the table: {} values "
+                                   "found instead of {} rows of {} columns"
+                                   .format(len(values), num_rows, num_columns))
+    if numpy.isnan(values).any():
+        raise QEOutputParsingError("The table contains non-numeric elements")
+
+    values = values.reshape(num_rows, num_columns)
+    if usecols is not None:
+        values = values[:, usecols]
+    return values
+
+# critical warnings: if any is found, the calculation status is FAILED
+basic_critical_warnings = {'Maximum CPU time exceeded':'Maximum CPU time exceeded',
+                           '%%%%%%%%%%%%%%':None,
+                           }
+
+basic_minor_warnings = {'Warning:':None,
+                        'DEPRECATED:':None,
+                        }
+
 def parse_raw_out_basic(out_file, calc_name):
     """
     A very simple parser for the standard out, usually aiida.out. Currently
@@ -50,18 +256,17 @@ def parse_raw_out_basic(out_file, calc_name):
     # read file
     parsed_data = {}
     parsed_data['warnings'] = []
-    # critical warnings: if any is found, the calculation status is FAILED
-    critical_warnings = {'Maximum CPU time exceeded':'Maximum CPU time exceeded',
-                         '%%%%%%%%%%%%%%':None,
-                         }
-
-    minor_warnings = {'Warning:':None,
-                      'DEPRECATED:':None,
-                      }
-    all_warnings = dict(critical_warnings.items() + minor_warnings.items())
-    for count in range (len(out_file)):
-        line = out_file[count]
+    for count, line, markers in basic_warnings_scanner.scan(out_file):
         # parse the global file, for informations that are written only once
+        if calc_name in line and 'WALL' in line:
+            continue
+        # Parsing of errors
+        if '%%%%%%%%%%%%%%' in line:
+            parsed_data['warnings'].extend(parse_QE_errors(out_file,count,parsed_data['warnings']))
+        else:
+            parsed_data['warnings'].append(basic_warnings_scanner.get_message(markers[0], line))
+
+    for line in out_file:
         if calc_name in line and 'WALL' in line:
             try:
                 time = line.split('CPU')[1].split('WALL')[0]
@@ -72,22 +277,6 @@ def parse_raw_out_basic(out_file, calc_name):
                 parsed_data['wall_time_seconds'] = convert_qe_time_to_sec(time)
             except ValueError:
                 raise QEOutputParsingError("Unable to convert wall_time in seconds.")
-            # Parsing of errors
-        elif any( i in line for i in all_warnings):
-            message = [ all_warnings[i] for i in all_warnings.keys() if i in line][0]
-            if message is None:
-                message = line
-            if '%%%%%%%%%%%%%%' in line:
-                message  = None
-                messages = parse_QE_errors(out_file,count,parsed_data['warnings'])
-
-            # if it found something, add to log
-            try:
-                parsed_data['warnings'].extend(messages)
-            except UnboundLocalError:
-                pass
-            if message is not None:
-                parsed_data['warnings'].append(message)
 
     return parsed_data
 
@@ -128,13 +317,12 @@ def convert_qe_time_to_sec(timestr):
 
     return num_seconds
 
-def ldlparse_QE_errors(lines,count,warnings):
+def parse_QE_errors(lines,count,warnings):
     """
     Parse QE errors messages (those appearing between some lines with
     ``'%%%%%%%%'``)
     :param lines: list of strings, the output text file as read by readlines()
-    or as obtained by data.split('\n') when data is the text file read by
-    read()
+    or as obtained by data.split('\n') when data is the text file read by read()
     :param count: the line at which we identified some ``'%%%%%%%%'``
     :param warnings: the warnings already parsed in the file
     :return messages: a list of QE error messages
@@ -159,33 +347,107 @@ def ldlparse_QE_errors(lines,count,warnings):
 
     return messages
 
+def markers_regex(markers):
+    """
+    Build a regular expression matching any of the given strings. The
+    alternatives are nested by common prefix, so that each position of the
+    searched text is tested once, instead of once per marker.
+
+    :param markers: a list of strings
+    :return: a string, the regular expression
+    """
+    tree = {}
+    for marker in markers:
+        node = tree
+        for char in marker:
+            node = node.setdefault(char, {})
+        node[''] = {}
 
-def parse_QE_errors(lines,count,warnings):
+    def to_regex(node):
+        if '' in node:
+            # a marker ends here: the longer ones starting with it match anyway
+            return ''
+        alternatives = [re.escape(char) + to_regex(node[char])
+                        for char in sorted(node)]
+        if len(alternatives) == 1:
+            return alternatives[0]
+        return '(?:{})'.format('|'.join(alternatives))
+
+    return to_regex(tree)
+
+class QEWarningScanner(object):
     """
-    Parse QE errors messages (those appearing between some lines with
-    ``'%%%%%%%%'``)
-    :param lines: list of strings, the output text file as read by readlines()
-    or as obtained by data.split('\n') when data is the text file read by read()
-    :param count: the line at which we identified some ``'%%%%%%%%'``
-    :param warnings: the warnings already parsed in the file
-    :return messages: a list of QE error messages
+    Finds the warnings and errors in the output of a QE code.
+
+    The scanner is built once, from a dictionary with the markers to look
+    for (e.g. 'Warning:') and the message to report for each of them (None
+    to report the line itself). All the markers are matched by a single
+    regular expression (see markers_regex), so that the text is searched in
+    one pass, and not once per marker.
     """
 
-    # find the indices of the lines with problems
-    found_endpoint = False
-    init_problem = count
-    for count2,line2 in enumerate(lines[count+1:]):
-        end_problem = count + count2 + 1
-        if "%%%%%%%%%%%%" in line2:
-            found_endpoint = True
-            break
-    messages = []
-    if found_endpoint:
-        # build a dictionary with the lines
-        prob_list = lines[init_problem:end_problem+1]
-        irred_list = list(set(prob_list))
-        for v in prob_list:
-            if ( len(v)>0 and (v in irred_list and v not in warnings) ):
-                messages.append(irred_list.pop(irred_list.index(v)))
+    def __init__(self, messages):
+        """
+        :param messages: dictionary {marker: message}; the markers found in
+            a line are returned in the order of messages.keys()
+        """
+        self.messages = messages
+        self.markers = list(messages.keys())
+        self._regex = re.compile(markers_regex(self.markers))
+        self.search = self._regex.search
 
-    return messages
+    def markers_in(self, line):
+        """
+        :return: the list of the markers found in the line
+        """
+        return [marker for marker in self.markers if marker in line]
+
+    def get_message(self, marker, line):
+        """
+        :return: the message for the marker, found in the line
+        """
+        message = self.messages[marker]
+        return line if message is None else message
+
+    def messages_in(self, line):
+        """
+        :return: the list of the messages of the markers found in the line
+        """
+        return [self.get_message(marker, line) for marker in self.markers_in(line)]
+
+    def scan(self, data):
+        """
+        Find the lines with any of the markers.
+
+        :param data: the text, as a string, or a list of lines (e.g. as
+            returned by readlines())
+        :return: a list of tuples (line number, line, markers), one for each
+            line where a marker is found, in order. The line numbers start
+            from 0 (as the indices in data.split('\\n')), the lines of a string
+            do not include the newline, and the markers are those found in
+            the line, see markers_in()
+        """
+        if not isinstance(data, basestring):
+            search = self.search
+            return [(count, line, self.markers_in(line))
+                    for count, line in enumerate(data) if search(line)]
+
+        hits = []
+        count = 0
+        line_start = 0
+        line_end = -1
+        for match in self._regex.finditer(data):
+            if match.start() < line_end:
+                continue # another marker on the same line
+            previous_start = line_start
+            line_start = data.rfind('\n', 0, match.start()) + 1
+            line_end = data.find('\n', match.start())
+            if line_end == -1:
+                line_end = len(data)
+            count += data.count('\n', previous_start, line_start)
+            line = data[line_start:line_end]
+            hits.append((count, line, self.markers_in(line)))
+        return hits
+
+basic_warnings_scanner = QEWarningScanner(
+    dict(basic_critical_warnings.items() + basic_minor_warnings.items()))
@@ -1,5 +1,5 @@
 # -*- coding: utf-8 -*-
-from aiida_quantumespresso.parsers import QEOutputParsingError
+from aiida_quantumespresso.parsers import QEOutputParsingError, RetrievedFiles
 from xml.dom.minidom import parseString
 from aiida_quantumespresso.parsers.basic_raw_parser_pw import (read_xml_card,
                                                                        parse_xml_child_integer, parse_xml_child_bool,
@@ -184,18 +184,15 @@ def parse_cp_raw_output(out_file, xml_file=None, xml_counter_file=None):
         xml_counter_data = {}
 
     # analyze the standard output
+    files = RetrievedFiles()
     try:
-        with open(out_file, 'r') as f:
-            out_lines = f.readlines()
+        out_lines = files.readlines(out_file)
+        # understand if the job ended smoothly, searching from the end of the file
+        job_successful = files.tail_contains(out_file, 'JOB DONE')
     except IOError:
         raise QEOutputParsingError("Failed to open output file: %s." % out_file)
-
-    # understand if the job ended smoothly
-    job_successful = False
-    for line in reversed(out_lines):
-        if 'JOB DONE' in line:
-            job_successful = True
-            break
+    finally:
+        files.close()
 
     out_data = parse_cp_text_output(out_lines, xml_data)
 
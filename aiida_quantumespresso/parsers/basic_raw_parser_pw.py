@@ -10,7 +10,28 @@ import xml.dom.minidom
 import os
 import string
 from aiida_quantumespresso.parsers.constants import ry_to_ev, hartree_to_ev, bohr_to_ang, ry_si, bohr_si
-from aiida_quantumespresso.parsers import QEOutputParsingError
+from aiida_quantumespresso.parsers import (QEOutputParsingError, QEWarningScanner,
+                                           RetrievedFiles, parse_QE_errors)
+
+# critical warnings: if any is found, the calculation status is FAILED
+pw_critical_warnings = {
+    'The maximum number of steps has been reached.': "The maximum step of the ionic/electronic relaxation has been reached.",
+    'convergence NOT achieved after': "The scf cycle did not reach convergence.",
+    # 'eigenvalues not converged':None, # special treatment
+    'iterations completed, stopping': 'Maximum number of iterations reached in Wentzcovitch Damped Dynamics.',
+    'Maximum CPU time exceeded': 'Maximum CPU time exceeded',
+    '%%%%%%%%%%%%%%': None,
+}
+
+pw_minor_warnings = {'Warning:': None,
+                     'DEPRECATED:': None,
+                     'incommensurate with FFT grid': 'The FFT is incommensurate: some symmetries may be lost.',
+                     'SCF correction compared to forces is too large, reduce conv_thr': "Forces are inaccurate (SCF correction is large): reduce conv_thr.",
+}
+
+pw_all_warnings = dict(pw_critical_warnings.items() + pw_minor_warnings.items())
+
+pw_warnings_scanner = QEWarningScanner(pw_all_warnings)
 
 # TODO: it could be possible to use info of the input file to parse output.
 # but atm the output has all the informations needed for the parsing.
@@ -80,21 +101,20 @@ def parse_raw_output(out_file, input_dict, parser_opts=None, xml_file=None, dir_
         structure_data = {}
 
     # load QE out file
+    files = RetrievedFiles()
     try:
-        with open(out_file, 'r') as f:
-            out_lines = f.read()
+        out_lines = files.read(out_file)
+        # check if the job has finished (that doesn't mean without errors),
+        # searching from the end of the file
+        finished_run = files.tail_contains(out_file, 'JOB DONE')
     except IOError:  # non existing output file -> job crashed
         raise QEOutputParsingError("Failed to open output file: {}.".format(out_file))
+    finally:
+        files.close()
 
     if not out_lines:  # there is an output file, but it's empty -> crash
         job_successful = False
 
-    # check if the job has finished (that doesn't mean without errors)
-    finished_run = False
-    for line in out_lines.split('\n')[::-1]:
-        if 'JOB DONE' in line:
-            finished_run = True
-            break
     if not finished_run:  # error if the job has not finished
         warning = 'QE pw run did not reach the end of the execution.'
         parser_info['parser_warnings'].append(warning)
@@ -580,24 +600,6 @@ def parse_pw_text_output(data, xml_data=None, structure_data=None, input_dict=No
     vdw_correction = False
     trajectory_data = {}
 
-    # critical warnings: if any is found, the calculation status is FAILED
-    critical_warnings = {
-    'The maximum number of steps has been reached.': "The maximum step of the ionic/electronic relaxation has been reached.",
-    'convergence NOT achieved after': "The scf cycle did not reach convergence.",
-    # 'eigenvalues not converged':None, # special treatment
-    'iterations completed, stopping': 'Maximum number of iterations reached in Wentzcovitch Damped Dynamics.',
-    'Maximum CPU time exceeded': 'Maximum CPU time exceeded',
-    '%%%%%%%%%%%%%%': None,
-    }
-
-    minor_warnings = {'Warning:': None,
-                      'DEPRECATED:': None,
-                      'incommensurate with FFT grid': 'The FFT is incommensurate: some symmetries may be lost.',
-                      'SCF correction compared to forces is too large, reduce conv_thr': "Forces are inaccurate (SCF correction is large): reduce conv_thr.",
-    }
-
-    all_warnings = dict(critical_warnings.items() + minor_warnings.items())
-
     # Find some useful quantities.
     try:
         for line in data.split('\n'):
@@ -617,22 +619,18 @@ def parse_pw_text_output(data, xml_data=None, structure_data=None, input_dict=No
         parsed_data['number_of_bands'] = nbnd
     except NameError:  # nat or other variables where not found, and thus not initialized
         # try to get some error message
-        for count, line in enumerate(data.split('\n')):
-            if any(i in line for i in all_warnings):
-                messages = [all_warnings[i] if all_warnings[i] is not None
-                            else line for i in all_warnings.keys()
-                            if i in line]
-
-                if '%%%%%%%%%%%%%%' in line:
-                    messages = parse_QE_errors(data.split('\n'), count,
-                                               parsed_data['warnings'])
-
-                    # if it found something, add to log
-                if len(messages) > 0:
-                    parsed_data['warnings'].extend(messages)
+        lines = data.split('\n')
+        for count, line, markers in pw_warnings_scanner.scan(data):
+            if '%%%%%%%%%%%%%%' in line:
+                messages = parse_QE_errors(lines, count, parsed_data['warnings'])
+            else:
+                messages = [pw_warnings_scanner.get_message(marker, line)
+                            for marker in markers]
+            # if it found something, add to log
+            parsed_data['warnings'].extend(messages)
 
         if len(parsed_data['warnings']) > 0:
-            return parsed_data, trajectory_data, critical_warnings.values()
+            return parsed_data, trajectory_data, pw_critical_warnings.values()
         else:
             # did not find any error message -> raise an Error and do not
             # return anything
@@ -658,10 +656,8 @@ def parse_pw_text_output(data, xml_data=None, structure_data=None, input_dict=No
             c_bands_error = False
 
         # Parsing of errors
-        elif any(i in line for i in all_warnings):
-            message = [all_warnings[i] for i in all_warnings.keys() if i in line][0]
-            if message is None:
-                message = line
+        elif pw_warnings_scanner.search(line):
+            message = pw_warnings_scanner.messages_in(line)[0]
 
             # if the run is a molecular dynamics, I ignore that I reached the
             # last iteration step.
@@ -679,13 +675,9 @@ def parse_pw_text_output(data, xml_data=None, structure_data=None, input_dict=No
 
             if '%%%%%%%%%%%%%%' in line:
                 message = None
-                messages = parse_QE_errors(data.split('\n'), count, parsed_data['warnings'])
+                parsed_data['warnings'].extend(
+                    parse_QE_errors(data.split('\n'), count, parsed_data['warnings']))
 
-                # if it found something, add to log
-            try:
-                parsed_data['warnings'].extend(messages)
-            except UnboundLocalError:
-                pass
             if message is not None:
                 parsed_data['warnings'].append(message)
 
@@ -809,37 +801,5 @@ def parse_pw_text_output(data, xml_data=None, structure_data=None, input_dict=No
                 except Exception:
                     parsed_data['warnings'].append('Error while parsing stress tensor.')
 
-    return parsed_data, trajectory_data, critical_warnings.values()
-
-
-def parse_QE_errors(lines, count, warnings):
-    """
-    Parse QE errors messages (those appearing between some lines with
-    ``'%%%%%%%%'``)
-
-    :param lines: list of strings, the output text file as read by readlines()
-        or as obtained by data.split('\\n') when data is the text file read by read()
-    :param count: the line at which we identified some ``'%%%%%%%%'``
-    :param warnings: the warnings already parsed in the file
-    :return messages: a list of QE error messages
-    """
-
-    # find the indices of the lines with problems
-    found_endpoint = False
-    init_problem = count
-    for count2, line2 in enumerate(lines[count + 1:]):
-        end_problem = count + count2 + 1
-        if "%%%%%%%%%%%%" in line2:
-            found_endpoint = True
-            break
-    messages = []
-    if found_endpoint:
-        # build a dictionary with the lines
-        prob_list = lines[init_problem:end_problem + 1]
-        irred_list = list(set(prob_list))
-        for v in prob_list:
-            if ( len(v) > 0 and (v in irred_list and v not in warnings) ):
-                messages.append(irred_list.pop(irred_list.index(v)))
-
-    return messages
+    return parsed_data, trajectory_data, pw_critical_warnings.values()
 
@@ -28,3 +28,11 @@ from aiida.common.constants import (
 #  REAL(DP), PARAMETER :: AMU_RY           = AMU_AU / 2.0_DP
 amu_Ry = 911.4442421323
 
+
+# From the definition of Quantum ESPRESSO, conversion from the Rydberg
+# units of frequency (sqrt(Ry/bohr^2/amu_Ry)) to cm^-1:
+#  REAL(DP), PARAMETER :: RY_TO_THZ  = 1.0_DP / AU_TERAHERTZ / FPI
+#  REAL(DP), PARAMETER :: RY_TO_CMM1 = 1.E+10_DP * RY_TO_THZ / C_SI
+# with RYDBERG_SI = 2.17987197E-18 J, H_PLANCK_SI = 6.62606896E-34 J s
+# and C_SI = 2.99792458E+8 m/s
+ry_to_cmm1 = 1.e10 * (2.17987197e-18 / 6.62606896e-34 / 1.e12) / 2.99792458e8
@@ -1,7 +1,8 @@
 # -*- coding: utf-8 -*-
 from aiida_quantumespresso.calculations.cp import CpCalculation
 from aiida_quantumespresso.parsers.raw_parser_cp import (
-    QEOutputParsingError, parse_cp_traj_stanzas, parse_cp_raw_output)
+    QEOutputParsingError, parse_cp_traj_file, parse_cp_raw_output)
+from aiida_quantumespresso.parsers import read_numeric_table
 from aiida_quantumespresso.parsers.constants import (bohr_to_ang,
                                                      timeau_to_sec, hartree_to_ev)
 from aiida.orm.data.parameter import ParameterData
@@ -18,6 +19,8 @@ class CpParser(Parser):
     This class is the implementation of the Parser class for Cp.
     """
 
+    _setting_key = 'parser_options'
+
     def __init__(self, calc):
         """
         Initialize the instance of CpParser
@@ -47,6 +50,18 @@ class CpParser(Parser):
             raise InvalidOperation("Calculation not in {} state"
                                    .format(calc_states.PARSING))
 
+        # look for eventual flags of the parser
+        try:
+            parser_opts = self._calc.inp.settings.get_dict()[self.get_parser_settings_key()]
+        except (AttributeError, KeyError):
+            parser_opts = {}
+
+        # only the steps in trajectory[start:stop:stride] are parsed
+        # from the .pos, .cel, .vel and .evp files
+        traj_slice = slice(parser_opts.get('trajectory_start', None),
+                           parser_opts.get('trajectory_stop', None),
+                           parser_opts.get('trajectory_stride', None))
+
         # get the input structure
         input_structure = self._calc.inp.structure
 
@@ -107,14 +122,13 @@ class CpParser(Parser):
 
         # =============== POSITIONS trajectory ============================
         try:
-            with open(out_folder.get_abs_path(
-                    '{}.pos'.format(self._calc._PREFIX))) as posfile:
-                pos_data = [l.split() for l in posfile]
-                # POSITIONS stored in angstrom
-            traj_data = parse_cp_traj_stanzas(num_elements=out_dict['number_of_atoms'],
-                                              splitlines=pos_data,
-                                              prepend_name='positions_traj',
-                                              rescale=bohr_to_ang)
+            # POSITIONS stored in angstrom
+            traj_data = parse_cp_traj_file(out_folder.get_abs_path('{}.pos'.format(self._calc._PREFIX)),
+                                           num_elements=out_dict['number_of_atoms'],
+                                           prepend_name='positions_traj',
+                                           rescale=bohr_to_ang,
+                                           start=traj_slice.start, stop=traj_slice.stop,
+                                           stride=traj_slice.step)
 
             # here initialize the dictionary. If the parsing of positions fails, though, I don't have anything
             # out of the CP dynamics. Therefore, the calculation status is set to FAILED.
@@ -131,14 +145,14 @@ class CpParser(Parser):
 
         # =============== CELL trajectory ============================
         try:
-            with open(os.path.join(out_folder.get_abs_path('.'),
-                                   '{}.cel'.format(self._calc._PREFIX))) as celfile:
-                cel_data = [l.split() for l in celfile]
-            traj_data = parse_cp_traj_stanzas(num_elements=3,
-                                              splitlines=cel_data,
-                                              prepend_name='cell_traj',
-                                              rescale=bohr_to_ang)
-            raw_trajectory['cells'] = numpy.array(traj_data['cell_traj_data'])
+            traj_data = parse_cp_traj_file(os.path.join(out_folder.get_abs_path('.'),
+                                                        '{}.cel'.format(self._calc._PREFIX)),
+                                           num_elements=3,
+                                           prepend_name='cell_traj',
+                                           rescale=bohr_to_ang,
+                                           start=traj_slice.start, stop=traj_slice.stop,
+                                           stride=traj_slice.step)
+            raw_trajectory['cells'] = traj_data['cell_traj_data']
         except IOError:
             out_dict['warnings'].append("Unable to open the CEL file... skipping.")
         except Exception as e:
@@ -147,13 +161,13 @@ class CpParser(Parser):
 
         # =============== VELOCITIES trajectory ============================
         try:
-            with open(os.path.join(out_folder.get_abs_path('.'),
-                                   '{}.vel'.format(self._calc._PREFIX))) as velfile:
-                vel_data = [l.split() for l in velfile]
-            traj_data = parse_cp_traj_stanzas(num_elements=out_dict['number_of_atoms'],
-                                              splitlines=vel_data,
-                                              prepend_name='velocities_traj',
-                                              rescale=bohr_to_ang / timeau_to_sec * 10 ** 12)  # velocities in ang/ps,
+            traj_data = parse_cp_traj_file(os.path.join(out_folder.get_abs_path('.'),
+                                                        '{}.vel'.format(self._calc._PREFIX)),
+                                           num_elements=out_dict['number_of_atoms'],
+                                           prepend_name='velocities_traj',
+                                           rescale=bohr_to_ang / timeau_to_sec * 10 ** 12,  # velocities in ang/ps,
+                                           start=traj_slice.start, stop=traj_slice.stop,
+                                           stride=traj_slice.step)
             raw_trajectory['velocities_ordered'] = self._get_reordered_array(traj_data['velocities_traj_data'],
                                                                              reordering)
         except IOError:
@@ -164,13 +178,11 @@ class CpParser(Parser):
 
         # =============== EVP trajectory ============================
         try:
-            matrix = numpy.genfromtxt(os.path.join(out_folder.get_abs_path('.'),
-                                                   '{}.evp'.format(self._calc._PREFIX)))
-            # there might be a different format if the matrix has one row only
-            try:
-                matrix.shape[1]
-            except IndexError:
-                matrix = numpy.array(numpy.matrix(matrix))
+            with open(os.path.join(out_folder.get_abs_path('.'),
+                                   '{}.evp'.format(self._calc._PREFIX))) as f:
+                matrix = read_numeric_table(f.read())
+            # one row per step, as in the .pos file
+            matrix = matrix[traj_slice]
 
             if LooseVersion(out_dict['creator_version']) > LooseVersion("5.1"):
                 # Between version 5.1 and 5.1.1, someone decided to change
@@ -303,6 +315,13 @@ class CpParser(Parser):
 
         return successful, new_nodes_list
 
+    def get_parser_settings_key(self):
+        """
+        Return the name of the key to be used in the calculation settings, that
+        contains the dictionary with the parser_options
+        """
+        return 'parser_options'
+
     def get_linkname_trajectory(self):
         """
         Returns the name of the link to the output_structure (None if not present)
@@ -362,4 +381,8 @@ class CpParser(Parser):
         return [origlist[e] for e in reordering]
 
     def _get_reordered_array(self, input, reordering):
-        return numpy.array([self._get_reordered_list(i, reordering) for i in input])
+        """
+        Reorder the atoms (second axis) of an array with shape
+        (nsteps, natoms, 3), with the same convention of _get_reordered_list.
+        """
+        return numpy.asarray(input)[:, reordering]
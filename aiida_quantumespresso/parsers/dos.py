@@ -5,7 +5,8 @@ from aiida.orm.data.array.xy import XyData
 from aiida.orm.data.parameter import ParameterData
 from aiida.common.exceptions import InvalidOperation
 from aiida.common.datastructures import calc_states
-from aiida_quantumespresso.parsers import QEOutputParsingError
+from aiida_quantumespresso.parsers import (QEOutputParsingError, RetrievedFiles,
+                                           read_numeric_table)
 from aiida_quantumespresso.parsers import parse_raw_out_basic
 from aiida_quantumespresso.calculations.dos import DosCalculation
 
@@ -62,31 +63,24 @@ class DosParser(Parser):
             self.logger.error("No retrieved folder found")
             return successful, new_nodes_list
 
+        files = RetrievedFiles(out_folder)
+
         # Read standard out
         try:
-            filpath = out_folder.get_abs_path(self._calc._OUTPUT_FILE_NAME)
-            with open(filpath, 'r') as fil:
-                    out_file = fil.readlines()
+            out_file = files.readlines(self._calc._OUTPUT_FILE_NAME)
         except OSError:
             self.logger.error("Standard output file could not be found.")
             successful = False
             return successful, new_nodes_list
 
-        successful = False
-        for i in range(len(out_file)):
-            line = out_file[-i]
-            if "JOB DONE" in line:
-                successful = True
-                break
+        successful = files.tail_contains(self._calc._OUTPUT_FILE_NAME, "JOB DONE")
         if not successful:
             self.logger.error("Computation did not finish properly")
             return successful, new_nodes_list
 
         # check that the dos file is present, if it is, read it
         try:
-            dos_path = out_folder.get_abs_path(self._calc._DOS_FILENAME)
-            with open(dos_path, 'r') as fil:
-                    dos_file = fil.readlines()
+            dos_file = files.read(self._calc._DOS_FILENAME)
         except OSError:
             successful = False
             self.logger.error("Dos output file could not found")
@@ -133,6 +127,7 @@ class DosParser(Parser):
 
         # grabs the parsed data from aiida.out
         parsed_data = parse_raw_out_basic(out_file, "DOS")
+        files.close()
         output_params = ParameterData(dict=parsed_data)
         # Adds warnings
         for message in parsed_data['warnings']:
@@ -146,11 +141,11 @@ class DosParser(Parser):
 
 def parse_raw_dos(dos_file, array_names, array_units):
     """
-    This function takes as input the dos_file as a list of filelines along
+    This function takes as input the content of the dos_file along
     with information on how to give labels and units to the parsed data
     
-    :param dos_file: dos file lines in the form of a list
-    :type dos_file: list
+    :param dos_file: dos file content, as a string or a list of lines
+    :type dos_file: str
     :param array_names: list of all array names, note that array_names[0]
                         is for the case with non spin-polarized calculations
                         and array_names[1] is for the case with spin-polarized
@@ -168,16 +163,16 @@ def parse_raw_dos(dos_file, array_names, array_units):
                   polarized 
     """
 
-    dos_header = dos_file[0]
+    if not isinstance(dos_file, basestring):
+        dos_file = ''.join(dos_file)
+    dos_header = dos_file[:dos_file.find('\n') + 1 or len(dos_file)]
     try:
-        dos_data = np.genfromtxt(dos_file)
-    except ValueError:
-        raise QEOutputParsingError('dosfile could not be loaded '
-        ' using genfromtxt')
+        dos_data = read_numeric_table(dos_file)
+    except QEOutputParsingError as e:
+        raise QEOutputParsingError('dosfile could not be loaded: {}'
+                                   .format(e.message))
     if len(dos_data) == 0:
         raise QEOutputParsingError("Dos file is empty.")
-    if np.isnan(dos_data).any():
-        raise QEOutputParsingError("Dos file contains non-numeric elements.")
 
     # Checks the number of columns, essentially to see whether spin was used
     if len(dos_data[0]) == 3:
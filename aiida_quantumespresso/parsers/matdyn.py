@@ -1,4 +1,5 @@
 # -*- coding: utf-8 -*-
+import re
 from aiida.parsers.parser import Parser
 from aiida.common.datastructures import calc_states
 from aiida.common.exceptions import UniquenessError
@@ -6,7 +7,7 @@ from aiida.orm.data.folder import FolderData
 from aiida.orm.data.parameter import ParameterData
 from aiida.orm.data.array.bands import BandsData
 from aiida.orm.data.array.kpoints import KpointsData
-from aiida_quantumespresso.parsers import QEOutputParsingError
+from aiida_quantumespresso.parsers import QEOutputParsingError, RetrievedFiles
 from aiida_quantumespresso.parsers.constants import invcm_to_THz
 from aiida_quantumespresso.calculations.matdyn import MatdynCalculation
 
@@ -62,10 +63,10 @@ class MatdynParser(Parser):
             return successful,()
         
         # check that the file has finished (i.e. JOB DONE is inside the file)
-        filpath = out_folder.get_abs_path(self._calc._OUTPUT_FILE_NAME)
-        with open(filpath,'r') as fil:
-            lines = fil.read()
-        if "JOB DONE" not in lines:
+        files = RetrievedFiles(out_folder)
+        job_done = files.tail_contains(self._calc._OUTPUT_FILE_NAME, "JOB DONE")
+        files.close()
+        if not job_done:
             successful = False
             self.logger.error("Computation did not finish properly")
         
@@ -112,6 +113,8 @@ class MatdynParser(Parser):
         
         # extract phonon bands (and take out from output dictionary)
         phonon_bands = parsed_data.pop('phonon_bands')
+        # the kpoints are already in kpointsdata_for_bands
+        parsed_data.pop('kpoints')
         
         # save phonon branches into BandsData
         output_bands = BandsData()
@@ -136,6 +139,8 @@ class MatdynParser(Parser):
         """
         return self._outbands_name
 
+bad_token_re = re.compile(r'[^\s\d.eE+-]')
+
 def parse_raw_matdyn_phonon_file(phonon_file):
     """
     Parses the phonon frequencies file
@@ -144,10 +149,12 @@ def parse_raw_matdyn_phonon_file(phonon_file):
     :return dict parsed_data: keys:
          * warnings: parser warnings raised
          * num_kpoints: number of kpoints read from the file
-         * phonon_bands: BandsData object with the bands for each kpoint
+         * kpoints: (num_kpoints,3) array with the kpoint coordinates (cartesian,
+           in units of 2pi/alat)
+         * phonon_bands: (num_kpoints,num_bands) array with the frequencies
+           (in THz) for each kpoint
     """
     import numpy
-    import re
     
     parsed_data = {}
     parsed_data['warnings'] = []
@@ -166,47 +173,27 @@ def parse_raw_matdyn_phonon_file(phonon_file):
                                        "in phonon frequencies file")
         return parsed_data
 
-    # initialize array of frequencies
-    freq_matrix = numpy.zeros((num_kpoints,num_bands))
-
-    split_data = lines.split()
     # discard the header of the file
-    raw_data = split_data[split_data.index('/')+1:]
-    
-    # try to improve matdyn deficiencies
-    corrected_data = []
-    for b in raw_data:
-        try:
-            corrected_data.append(float(b))
-        except ValueError:
-            # case in which there are two frequencies attached like -1204.1234-1020.536
-            if "-" in b:
-                c = re.split('(-)',b)
-                d = [ i for i in c if i is not '' ]
-                for i in range(0,len(d),2): # d should have an even number of elements
-                    corrected_data.append( float( d[i]+d[i+1] ) )
-            else:
-                # I don't know what to do
-                parsed_data["warnings"].append("Bad formatting of frequencies")
-                return parsed_data
-#        if b=='1162.9773': break
-    
-    counter = 3
-    for i in range(num_kpoints):
-        for j in range(num_bands):
-            try:
-                freq_matrix[i,j] = corrected_data[counter]*invcm_to_THz # from cm-1 to THz
-            except ValueError:
-                parsed_data["warnings"].append("Error while parsing the "
-                                               "frequencies") 
-            except IndexError:
-                parsed_data["warnings"].append("Error while parsing the "
-                                               "frequencies, dimension exceeded")
-                return parsed_data
-            counter += 1
-        counter += 3 # move past the kpoint coordinates
-    
-            
+    body = lines[lines.index('/')+1:]
+
+    # try to improve matdyn deficiencies: separate two frequencies attached
+    # like -1204.1234-1020.536 (putting back together negative exponents)
+    body = body.replace('-', ' -').replace('E -', 'E-').replace('e -', 'e-')
+
+    # each kpoint is made of its 3 coordinates followed by num_bands frequencies
+    data = numpy.fromstring(body, sep=' ')
+    if len(data) < num_kpoints*(3+num_bands):
+        if bad_token_re.search(body):
+            # I don't know what to do
+            parsed_data["warnings"].append("Bad formatting of frequencies")
+        else:
+            parsed_data["warnings"].append("Error while parsing the "
+                                           "frequencies, dimension exceeded")
+        return parsed_data
+    data = data[:num_kpoints*(3+num_bands)].reshape(num_kpoints, 3+num_bands)
+
+    parsed_data['kpoints'] = data[:,:3]
+    freq_matrix = data[:,3:]*invcm_to_THz # from cm-1 to THz
     parsed_data['phonon_bands'] = freq_matrix
    
     return parsed_data
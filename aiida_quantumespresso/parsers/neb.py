@@ -116,7 +116,8 @@ class NebParser(Parser):
                 self.logger.error("No xml file found for image {} at {}".format(i+1,xml_file))
                 successful = False
                 return successful, ()
-            xml_data,structure_dict,bands_data = parse_pw_xml_output(xml_lines)
+            xml_data,structure_dict,bands_data = parse_pw_xml_output(xml_lines,
+                backend=parser_opts.get('xml_backend','minidom'))
             
             # convert the dictionary obtained from parsing the xml to an AiiDA StructureData
             structure_data = convert_qe2aiida_structure(structure_dict)
@@ -2,8 +2,9 @@
 from aiida.parsers.parser import Parser
 from aiida.orm.data.folder import FolderData
 from aiida.orm.data.parameter import ParameterData
+from aiida.orm.data.array import ArrayData
 from aiida.common.datastructures import calc_states
-from aiida_quantumespresso.parsers import QEOutputParsingError
+from aiida_quantumespresso.parsers import QEOutputParsingError, RetrievedFiles
 from aiida_quantumespresso.parsers.raw_parser_ph import parse_raw_ph_output
 from aiida_quantumespresso.calculations.ph import PhCalculation
 
@@ -12,6 +13,8 @@ class PhParser(Parser):
     This class is the implementation of the Parser class for PHonon.
     """
 
+    _setting_key = 'parser_options'
+
     def __init__(self,calculation):
         """
         Initialize the instance of PhParser
@@ -57,6 +60,16 @@ class PhParser(Parser):
             # TODO this feature could be a set of flags to pass to the raw_parser
             raise NotImplementedError("The parser_options feature is not yet implemented")
         
+        # the parser options given in the settings: 'dynmat_workers' is the
+        # number of processes parsing the dynamical matrix files
+        # (default: serial parsing), 'also_eigenvectors' to store also the
+        # eigenvectors of the dynamical matrices (default: False)
+        try:
+            parser_settings = self._calc.inp.settings.get_dict()[
+                self.get_parser_settings_key()]
+        except (AttributeError,KeyError):
+            parser_settings = {}
+        
         # Check that the retrieved folder is there 
         try:
             out_folder = retrieved[self._calc._get_linkname_retrieved()]
@@ -102,8 +115,14 @@ class PhParser(Parser):
         out_file = out_folder.get_abs_path(self._calc._OUTPUT_FILE_NAME)
         
         # call the raw parsing function
-        out_dict,raw_successful = parse_raw_ph_output(out_file,xml_tensor_file,
-                                                      dynamical_matrix_list)
+        files = RetrievedFiles(out_folder)
+        try:
+            out_dict,dynamical_matrix_arrays,raw_successful = parse_raw_ph_output(
+                out_file,xml_tensor_file,dynamical_matrix_list,files,
+                num_workers=parser_settings.get('dynmat_workers',None),
+                also_eigenvectors=parser_settings.get('also_eigenvectors',False))
+        finally:
+            files.close()
         successful = raw_successful if successful else successful
         
         # convert the dictionary into an AiiDA object
@@ -112,5 +131,27 @@ class PhParser(Parser):
         # save it into db
         new_nodes_list = [ (self.get_linkname_outparams(),output_params) ]
         
+        # the dynamical matrices, stacked in arrays
+        if dynamical_matrix_arrays:
+            arraydata = ArrayData()
+            for name, array in dynamical_matrix_arrays.iteritems():
+                arraydata.set_array(name, array)
+            new_nodes_list.append( (self.get_linkname_outarray(),arraydata) )
+        
         return successful,new_nodes_list
+    
+    def get_linkname_outarray(self):
+        """
+        Returns the name of the link to the ArrayData with the frequencies,
+        q-points and (if the parser option also_eigenvectors is True)
+        eigenvectors of the dynamical matrices
+        """
+        return 'output_array'
+
+    def get_parser_settings_key(self):
+        """
+        Return the name of the key to be used in the calculation settings, that
+        contains the dictionary with the parser_options
+        """
+        return 'parser_options'
         
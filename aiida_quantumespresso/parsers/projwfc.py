@@ -1,10 +1,10 @@
 # -*- coding: utf-8 -*-
 import re
-import copy
 import fnmatch
 import numpy as np
 from aiida.parsers.parser import Parser
-from aiida_quantumespresso.parsers import QEOutputParsingError
+from aiida_quantumespresso.parsers import (QEOutputParsingError, RetrievedFiles,
+                                           read_numeric_table)
 from aiida_quantumespresso.parsers import parse_raw_out_basic
 from aiida.common.exceptions import InvalidOperation
 from aiida.orm.data.parameter import ParameterData
@@ -16,6 +16,9 @@ from aiida.common.datastructures import calc_states
 from aiida.orm.data.array.xy import XyData
 
 
+# a coefficient of the state composition, like 0.995*[#   1]
+projection_re = re.compile(r"([\d.]+)\*\[#\s*(\d+)\]")
+
 def find_orbitals_from_statelines(out_info_dict):
     """
     This function reads in all the state_lines, that is, the lines describing
@@ -25,13 +28,11 @@ def find_orbitals_from_statelines(out_info_dict):
     :param out_info_dict: contains various technical internals useful in parsing
     :return: orbitals, a list of orbitals suitable for setting ProjectionData
     """
-    out_file = out_info_dict["out_file"]
     atomnum_re = re.compile(r"atom (.*?)\(")
     element_re = re.compile(r"\((.*?)\)")
     lnum_re = re.compile(r"l=(.*?)m=")
     mnum_re = re.compile(r"m=(.*?)\)")
-    wfc_lines = out_info_dict["wfc_lines"]
-    state_lines = [out_file[wfc_line] for wfc_line in wfc_lines]
+    state_lines = out_info_dict["state_lines"]
     state_dicts = []
     for state_line in state_lines:
         try:
@@ -128,6 +129,129 @@ def find_orbitals_from_statelines(out_info_dict):
 #     return pdos_atm_namedicts
 
 
+def parse_projwfc_stdout(out_file):
+    """
+    Parses in a single pass the standard output of projwfc.x, filling
+    the arrays of energies and projections while reading, so that the
+    output does not need to be kept in memory.
+
+    :param out_file: an iterable over the lines of the standard output,
+                     e.g. the open file
+    :return: a dictionary with the keys
+
+        * state_lines: the lines describing the atomic states
+        * other_lines: all the lines not belonging to the projections
+          (header, Lowdin charges, timings, ...)
+        * k_vect: (nk, 3) array with the k-points, both spins if any
+        * bands: (nk, nbands) array with the energies (eV)
+        * projections: (nk, nbands, nstates) array with the projections
+          |<psi|state>|^2
+    """
+    state_lines = []
+    other_lines = []
+    num_bands = None
+    # the number of bands is known only at the end of the first k-point:
+    # bands and projections of the first k-point are kept in lists until then
+    first_bands = []
+    first_projections = []
+    k_vect = bands = projections = None
+    num_k = 0
+    band = -1
+    projection = None
+
+    for line in out_file:
+        if projection is not None:
+            # inside the block psi = ... |psi|^2 = ...
+            if "|psi|^2" in line:
+                projection = None
+            elif "==== e(" in line or "k =" in line:
+                raise QEOutputParsingError("Not formatted in a manner "
+                " that can be handled")
+            else:
+                for fraction, state in projection_re.findall(line):
+                    projection[int(state)-1] = float(fraction)
+        elif "==== e(" in line:
+            if not num_k:
+                raise QEOutputParsingError("Band energy found before "
+                "any k-point")
+            band += 1
+            energy = float(line.split()[4])
+            if num_bands is None:
+                first_bands.append(energy)
+                projection = np.zeros(len(state_lines))
+                first_projections.append(projection)
+            else:
+                if band >= num_bands:
+                    raise QEOutputParsingError("Band Energy Points is not "
+                    " a multiple of kpoints")
+                bands[num_k-1, band] = energy
+                projection = projections[num_k-1, band]
+        elif "k =" in line:
+            if num_k == 1 and num_bands is None:
+                num_bands = len(first_bands)
+                k_vect, bands, projections = _grow_kpoint_arrays(
+                    None, 16, num_bands, len(state_lines))
+                k_vect[0] = first_k_vect
+                bands[0] = first_bands
+                projections[0] = first_projections
+            elif num_k and band+1 != num_bands:
+                raise QEOutputParsingError("Band Energy Points is not "
+                " a multiple of kpoints")
+            this_k_vect = [float(_) for _ in
+                           line.split('=', 1)[1].replace('-', ' -').split()[:3]]
+            if num_bands is None:
+                first_k_vect = this_k_vect
+            else:
+                if num_k == len(k_vect):
+                    k_vect, bands, projections = _grow_kpoint_arrays(
+                        (k_vect, bands, projections), 2*num_k, num_bands,
+                        len(state_lines))
+                k_vect[num_k] = this_k_vect
+            num_k += 1
+            band = -1
+        elif "state #" in line:
+            state_lines.append(line)
+        else:
+            other_lines.append(line)
+
+    if projection is not None:
+        raise QEOutputParsingError("Not formatted in a manner "
+        " that can be handled")
+    if num_k == 0:
+        raise QEOutputParsingError("No k-points found in the standard output")
+    if num_bands is None:
+        k_vect = np.array([first_k_vect])
+        bands = np.array([first_bands])
+        projections = np.array(first_projections).reshape(
+            1, len(first_bands), len(state_lines))
+    else:
+        if band+1 != num_bands:
+            raise QEOutputParsingError("Band Energy Points is not "
+            " a multiple of kpoints")
+        k_vect = k_vect[:num_k]
+        bands = bands[:num_k]
+        projections = projections[:num_k]
+
+    return {"state_lines": state_lines,
+            "other_lines": other_lines,
+            "k_vect": k_vect,
+            "bands": bands,
+            "projections": projections,
+            }
+
+def _grow_kpoint_arrays(arrays, num_k, num_bands, num_states):
+    """
+    Returns the arrays of k-points, bands and projections enlarged to
+    num_k k-points, with the values of the old arrays (if any) copied in
+    """
+    new_arrays = (np.zeros((num_k, 3)),
+                  np.zeros((num_k, num_bands)),
+                  np.zeros((num_k, num_bands, num_states)))
+    if arrays is not None:
+        for old, new in zip(arrays, new_arrays):
+            new[:len(old)] = old
+    return new_arrays
+
 def spin_dependent_subparcer(out_info_dict):
     """
     This find the projection and bands arrays from the out_file and
@@ -138,47 +262,12 @@ def spin_dependent_subparcer(out_info_dict):
     :return: ProjectionData, BandsData parsed from out_file
     """
 
-    out_file = out_info_dict["out_file"]
     spin_down = out_info_dict["spin_down"]
     od = out_info_dict #using a shorter name for convenience
-    #   regular expressions needed for later parsing
-    WaveFraction1_re = re.compile(r"\=(.*?)\*")  # state composition 1
-    WaveFractionremain_re = re.compile(r"\+(.*?)\*")  # state comp 2
-    FunctionId_re = re.compile(r"\#(.*?)\]")  # state identity
-    # primes arrays for the later parsing
-    num_wfc = len(od["wfc_lines"])
-    bands = np.zeros([od["k_states"], od["num_bands"]])
-    projection_arrays = np.zeros([od["k_states"], od["num_bands"], num_wfc])
-
-    try:
-        for i in range(od["k_states"]):
-            if spin_down:
-                i += od["k_states"]
-            # grabs band energy
-            for j in range (i*od["num_bands"],(i+1)*od["num_bands"],1):
-                out_ind = od["e_lines"][j]
-                val = out_file[out_ind].split()[4]
-                bands[i%od["k_states"]][j%od["num_bands"]] = val
-                #subloop grabs pdos
-                wave_fraction = []
-                wave_id = []
-                for k in range(od["e_lines"][j]+1,od["psi_lines"][j],1):
-                    out_line = out_file[k]
-                    wave_fraction += WaveFraction1_re.findall(out_line)
-                    wave_fraction += WaveFractionremain_re.findall(out_line)
-                    wave_id += FunctionId_re.findall(out_line)
-                if len(wave_id) != len(wave_fraction):
-                    raise IndexError
-                for l in range (len(wave_id)):
-                    wave_id[l] = int(wave_id[l])
-                    wave_fraction[l] = float(wave_fraction[l])
-                    #sets relevant values in pdos_array
-                    projection_arrays[i%od["k_states"]][
-                        j%od["num_bands"]][wave_id[l]-1] = wave_fraction[l]
-    except IndexError:
-        raise QEOutputParsingError("the standard out file does not "
-                                   "comply with the official "
-                                   "documentation.")
+    # spin up states are written first, then spin down
+    first_k = od["k_states"] if spin_down else 0
+    bands = od["bands"][first_k:first_k+od["k_states"]]
+    projection_arrays = od["projections"][first_k:first_k+od["k_states"]]
 
     bands_data = BandsData()
     try:
@@ -224,37 +313,185 @@ def spin_dependent_pdos_subparcer(out_info_dict):
     Finds and labels the pdos arrays associated with the out_info_dict
 
     :param out_info_dict: contains various technical internals useful in parsing
-    :return: (pdos_name, pdos_array) tuples for all the specific pdos
+    :return: list of pdos arrays, one for each state, in the same order
+             of the projections
     """
-    spin = out_info_dict["spin"]
     spin_down = out_info_dict["spin_down"]
-    pdos_atm_array_dict = out_info_dict["pdos_atm_array_dict"]
-    if spin:
-        mult_factor = 2
-        if spin_down:
-            first_array = 4
-        else:
-            first_array = 3
-    else:
-        mult_factor = 1
-        first_array = 2
-    mf = mult_factor
-    fa = first_array
-    pdos_file_names = [k for k in pdos_atm_array_dict]
-    pdos_file_names.sort()
-    out_arrays = []
-    # we can keep the pdos in synch with the projections by relying on the fact
-    # both are produced in the same order (thus the sorted file_names)
-    for name in pdos_file_names:
-        this_array = pdos_atm_array_dict[name]
-        for i in range(fa, np.shape(this_array)[1]):
-            if i % mf == 0:
-                out_arrays.append(this_array[:,i])
+    pdos_atm = out_info_dict["pdos_atm"]
+    # the pdos are matched to the states of the projections through the
+    # keys (atom, wfc, l, m) of the state lines, so that only the files of
+    # these states are read
+    keys = [find_key_from_stateline(line)
+            for line in out_info_dict["state_lines"]]
+    return pdos_atm.get_pdos(keys, spin=1 if spin_down else 0)
+
+
+# the name of a pdos_atm file, like aiida.pdos_atm#1(Si)_wfc#2(p)
+pdos_atm_filename_re = re.compile(r"atm#(\d+)\((.*?)\)_wfc#(\d+)\((\w)")
+spdf_to_l = {'s': 0, 'p': 1, 'd': 2, 'f': 3}
+# a state line, like state #   2: atom   1 (Si ), wfc  2 (l=1 m= 1)
+state_line_re = re.compile(r"atom\s+(\d+).*wfc\s+(\d+)\s+\(l=\s*(\d+)\s+m=\s*(\d+)\)")
+
+def find_key_from_stateline(state_line):
+    """
+    Reads the key of a state, as used by PdosAtmFiles, from its state line
 
-    return out_arrays
+    :param state_line: a line like 'state #   2: atom   1 (Si ), wfc  2 (l=1 m= 1)'
+    :return: the tuple (atom, wfc, l, m)
+    """
+    match = state_line_re.search(state_line)
+    if match is None:
+        raise QEOutputParsingError("State line not formatted in a standard "
+                                   "way: {}".format(state_line.strip()))
+    return tuple(int(_) for _ in match.groups())
 
+def read_pdos_file(filepath):
+    """
+    Reads a pdos_tot or pdos_atm file (a table of numbers, after a header
+    line starting with #) with a single numpy call
 
+    :param filepath: absolute path of the file
+    :return: a 2D array, one row per energy
+    """
+    with open(filepath, 'r') as f:
+        text = f.read()
+    try:
+        values = read_numeric_table(text)
+    except QEOutputParsingError as e:
+        raise QEOutputParsingError("Wrong format of the pdos_atm file "
+                                   "{}: {}".format(filepath, e.message))
+    if not values.size:
+        raise QEOutputParsingError("Wrong format of the pdos_atm file "
+                                   "{}".format(filepath))
+    return values
+
+class PdosAtmFiles(object):
+    """
+    The pdos_atm files written by projwfc.x, one for each atom and
+    atomic wavefunction. A file is read only when the pdos of one of its
+    states is first requested, in a pool of threads if num_threads > 1,
+    and then kept for the following requests.
+
+    The states are identified by the keys (atom, wfc, l, m) (1-based, as
+    in the file names and in the projwfc output, except l), sorted in the
+    order of the states in the projwfc output.
+    """
 
+    def __init__(self, filepaths, num_threads=None):
+        """
+        :param filepaths: absolute paths of the pdos_atm files
+        :param num_threads: number of threads reading the files
+        """
+        import os
+
+        files = {}
+        for filepath in filepaths:
+            match = pdos_atm_filename_re.search(os.path.basename(filepath))
+            if match is None:
+                raise QEOutputParsingError("Unrecognized pdos_atm file name "
+                                           "{}".format(filepath))
+            atom, kind_name, wfc, spdf = match.groups()
+            try:
+                l = spdf_to_l[spdf]
+            except KeyError:
+                raise QEOutputParsingError("Unexpected orbital label '{}' in "
+                    "the pdos_atm file name {}".format(spdf, filepath))
+            files[(int(atom), int(wfc))] = (l, filepath)
+        self._files = files
+        self._num_threads = num_threads
+        # for each file already read, the pdos as an array of shape
+        # (nspin, number of m, number of energies)
+        self._arrays = {}
+        self._energy = None
+
+        # sort numerically, not by file name (atm#10 comes after atm#9)
+        self.keys = [(atom, wfc, l, m) for (atom, wfc), (l, _)
+                     in sorted(files.items()) for m in range(1, 2*l+2)]
+
+    def _load(self, file_keys):
+        """
+        Reads the files with the given (atom, wfc) that were not read yet.
+        """
+        file_keys = sorted(set(file_keys).difference(self._arrays))
+        filepaths = [self._files[_][1] for _ in file_keys]
+        if self._num_threads is not None and self._num_threads > 1 and len(filepaths) > 1:
+            from multiprocessing.pool import ThreadPool
+            pool = ThreadPool(min(self._num_threads, len(filepaths)))
+            arrays = pool.imap(read_pdos_file, filepaths)
+        else:
+            pool = None
+            arrays = (read_pdos_file(f) for f in filepaths)
+
+        try:
+            for file_key, filepath, array in zip(file_keys, filepaths, arrays):
+                num_m = 2*self._files[file_key][0]+1
+                # columns: E, ldos, pdos of each m, or with spin
+                # E, ldos up, ldos down, then up and down pdos of each m
+                if array.shape[1] == 2 + num_m:
+                    nspin = 1
+                elif array.shape[1] == 3 + 2*num_m:
+                    nspin = 2
+                else:
+                    raise QEOutputParsingError("Unexpected number of columns "
+                                               "in {}".format(filepath))
+                if self._energy is None:
+                    self._energy = array[:,0].copy()
+                    self._nspin = nspin
+                if array.shape[0] != len(self._energy) or nspin != self._nspin:
+                    raise QEOutputParsingError("Inconsistent shape of "
+                                               "{}".format(filepath))
+                first_column = 1 + nspin
+                self._arrays[file_key] = np.array([array[:,
+                    first_column+spin:first_column+nspin*num_m:nspin].T
+                    for spin in range(nspin)])
+        finally:
+            if pool is not None:
+                pool.close()
+
+    def get_pdos(self, keys, spin=0):
+        """
+        The pdos of the given states, reading only the files of these states
+
+        :param keys: the keys (atom, wfc, l, m) of the states
+        :param spin: 0, or 1 for the spin down pdos of a spin-polarized
+                     calculation
+        :return: a list of 1D arrays, one for each key
+        """
+        for atom, wfc, l, m in keys:
+            if self._files.get((atom, wfc), (None,))[0] != l or not 0 < m <= 2*l+1:
+                raise QEOutputParsingError("No pdos_atm file found for the "
+                    "state with atom {}, wfc {}, l={}, m={}".format(atom, wfc, l, m))
+        self._load([(atom, wfc) for atom, wfc, _, _ in keys])
+        if keys and spin >= self._nspin:
+            raise QEOutputParsingError("The pdos_atm files have no spin "
+                                       "down pdos")
+        return [self._arrays[(atom, wfc)][spin, m-1]
+                for atom, wfc, l, m in keys]
+
+    @property
+    def energy(self):
+        """
+        The energies (eV) of the pdos, read from the first file if none was
+        read yet
+        :return: a 1D array
+        """
+        if self._energy is None:
+            self._load(sorted(self._files)[:1])
+        if self._energy is None:
+            return np.zeros(0)
+        return self._energy
+
+    @property
+    def pdos(self):
+        """
+        The pdos of all the states, reading all the files
+        :return: an array of shape (nspin, number of keys, number of energies)
+        """
+        if not self.keys:
+            return np.zeros((1, 0, 0))
+        self._load(self._files)
+        return np.array([self.get_pdos(self.keys, spin)
+                         for spin in range(self._nspin)])
 
 
 class ProjwfcParser(Parser):
@@ -265,6 +502,8 @@ class ProjwfcParser(Parser):
     the projected density of states onto an energy axis.
     """
 
+    _setting_key = 'parser_options'
+
     def __init__(self, calculation):
         """
         Initialize the instance of ProjwfcParser
@@ -300,24 +539,31 @@ class ProjwfcParser(Parser):
                 self.logger.error("No retrieved folder found")
                 return successful, new_nodes_list
 
+            # look for eventual flags of the parser
+            try:
+                parser_opts = self._calc.inp.settings.get_dict()[
+                    self.get_parser_settings_key()]
+            except (AttributeError, KeyError):
+                parser_opts = {}
 
             # Reading all the files produced during the calculation
             # Read standard out
+            # (the bands and projections are parsed while reading it)
             try:
                 filpath = out_folder.get_abs_path(self._calc._OUTPUT_FILE_NAME)
                 with open(filpath, 'r') as fil:
-                        out_file = fil.readlines()
+                        out_info_dict = parse_projwfc_stdout(fil)
             except OSError:
                 self.logger.error("Standard output file could not be found.")
                 successful = False
                 return successful, new_nodes_list
+            out_file = out_info_dict.pop("other_lines")
 
             # check that the file has finished i.e. JOB DONE is inside the file
-            for i in range(len(out_file)):
-                line = out_file[-i]
-                if "JOB DONE" in line:
-                    successful = True
-                    break
+            files = RetrievedFiles(out_folder)
+            successful = files.tail_contains(self._calc._OUTPUT_FILE_NAME,
+                                             "JOB DONE")
+            files.close()
             if not successful:
                 self.logger.error("Computation did not finish properly")
             parsed_data = parse_raw_out_basic(out_file, "PROJWFC")
@@ -335,7 +581,7 @@ class ProjwfcParser(Parser):
             try:
                 pdostot_path  = out_folder.get_abs_path(pdostot_filename)
                 # Energy(eV), Ldos, Pdos
-                pdostot_array = np.genfromtxt(pdostot_path)
+                pdostot_array = read_pdos_file(pdostot_path)
                 energy = pdostot_array[:,0]
                 dos = pdostot_array[:,1]
             except OSError:
@@ -343,16 +589,16 @@ class ProjwfcParser(Parser):
                 self.logger.error("pdos_tot output file could not found")
                 return successful, new_nodes_list
 
-            # checks and reads all of the individual pdos_atm files
+            # checks all of the individual pdos_atm files, read only when
+            # the pdos are needed
             pdos_atm_filenames = fnmatch.filter(out_filenames,'*pdos_atm*')
-            pdos_atm_array_dict = {name:np.genfromtxt(out_folder.get_abs_path(
-                                   name)) for name in pdos_atm_filenames}
+            pdos_atm = PdosAtmFiles([out_folder.get_abs_path(name)
+                                     for name in pdos_atm_filenames],
+                                    num_threads=parser_opts.get('pdos_threads', None))
 
             # finding the bands and projections
-            out_info_dict = {}
-            out_info_dict["out_file"] = out_file
             out_info_dict["energy"] = energy
-            out_info_dict["pdos_atm_array_dict"] = pdos_atm_array_dict
+            out_info_dict["pdos_atm"] = pdos_atm
             new_nodes_list += self._parse_bands_and_projections(out_info_dict)
 
             Dos_out = XyData()
@@ -363,44 +609,29 @@ class ProjwfcParser(Parser):
             return successful, new_nodes_list
 
 
+    def get_parser_settings_key(self):
+        """
+        Return the name of the key to be used in the calculation settings, that
+        contains the dictionary with the parser_options
+        """
+        return 'parser_options'
+
     def _parse_bands_and_projections(self, out_info_dict):
         """
         Function that parsers the standard out into bands and projection
         data.
-        :param standard_out: standard out file in form of a list
-        :param out_info_dict: used to pass technical internal variables
+        :param out_info_dict: used to pass technical internal variables, and
+                              the arrays from parse_projwfc_stdout
                               to helper functions in compact form
 
         :return: append_nodes_list a list containing BandsData and
                  ProjectionData parsed from standard_out
         """
-        out_file = out_info_dict["out_file"]
-        out_info_dict["k_lines"] = []
-        out_info_dict["e_lines"] = []
-        out_info_dict["psi_lines"] = []
-        out_info_dict["wfc_lines"] = []
         append_nodes_list = []
 
-        for i in range(len(out_file)):
-            if "k =" in out_file[i]:
-                out_info_dict["k_lines"].append(copy.deepcopy(i))
-            if "==== e(" in out_file[i]:
-                out_info_dict["e_lines"].append(i)
-            if "|psi|^2" in out_file[i]:
-                out_info_dict["psi_lines"].append(i)
-            if "state #" in out_file[i]:
-                out_info_dict["wfc_lines"].append(i)
-
-        #Basic check
-        if len(out_info_dict["e_lines"]) != len(out_info_dict["psi_lines"]):
-            raise QEOutputParsingError("Not formatted in a manner "
-            " that can be handled")
-        if len(out_info_dict["psi_lines"]) % len(out_info_dict["k_lines"]) != 0:
-            raise QEOutputParsingError("Band Energy Points is not "
-            " a multiple of kpoints")
         #calculates the number of bands
-        out_info_dict["num_bands"] = len(
-            out_info_dict["psi_lines"])/len(out_info_dict["k_lines"])
+        num_k = len(out_info_dict["k_vect"])
+        out_info_dict["num_bands"] = out_info_dict["bands"].shape[1]
 
         # Uses the parent input parameters, and checks if the parent used
         # spin calculations try to replace with a query, if possible.
@@ -425,16 +656,14 @@ class ProjwfcParser(Parser):
 
         #changes k-numbers to match spin
         #because if spin is on, k points double for up and down
-        out_info_dict["k_states"] = len(out_info_dict["k_lines"])
+        out_info_dict["k_states"] = num_k
         if spin:
             if out_info_dict["k_states"] % 2 != 0:
                 raise ValueError("Internal formatting error regarding spin")
             out_info_dict["k_states"] = out_info_dict["k_states"]/2
 
         #   adds in the k-vector for each kpoint
-        k_vect = [out_file[out_info_dict["k_lines"][i]].split()[2:]
-                  for i in range(out_info_dict["k_states"])]
-        out_info_dict["k_vect"] = np.array(k_vect)
+        out_info_dict["k_vect"] = out_info_dict["k_vect"][:out_info_dict["k_states"]]
         out_info_dict["structure"] = structure
         out_info_dict["orbitals"] = find_orbitals_from_statelines(out_info_dict)
 
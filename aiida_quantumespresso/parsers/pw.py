@@ -218,10 +218,12 @@ class PwParser(Parser):
             import numpy
             from aiida.orm.data.array.trajectory import TrajectoryData
             from aiida.orm.data.array import ArrayData
+            # the values in trajectory_data are TrajectoryBuffers (or lists),
+            # numpy.asarray gets their arrays without copies
             try:
-                positions = numpy.array( trajectory_data.pop('atomic_positions_relax') )
+                positions = numpy.asarray( trajectory_data.pop('atomic_positions_relax') )
                 try:
-                    cells = numpy.array( trajectory_data.pop('lattice_vectors_relax') )
+                    cells = numpy.asarray( trajectory_data.pop('lattice_vectors_relax') )
                     # if KeyError, the MD was at fixed cell
                 except KeyError:
                     cells = numpy.array( [in_struc.cell]*len(positions) )
@@ -238,7 +240,7 @@ class PwParser(Parser):
                                     positions = positions,
                                     )
                 for x in trajectory_data.iteritems():
-                    traj.set_array(x[0],numpy.array(x[1]))
+                    traj.set_array(x[0],numpy.asarray(x[1]))
                 # return it to the execmanager
                 new_nodes_list.append((self.get_linkname_outtrajectory(),traj))
 
@@ -247,7 +249,7 @@ class PwParser(Parser):
                 # calculation (when outputed)
                 arraydata = ArrayData()
                 for x in trajectory_data.iteritems():
-                    arraydata.set_array(x[0],numpy.array(x[1]))
+                    arraydata.set_array(x[0],numpy.asarray(x[1]))
                 # return it to the execmanager
                 new_nodes_list.append((self.get_linkname_outarray(),arraydata))
 
@@ -2,7 +2,7 @@
 from aiida.orm.data.folder import FolderData
 from aiida.parsers.parser import Parser
 from aiida.common.datastructures import calc_states
-from aiida_quantumespresso.parsers import QEOutputParsingError
+from aiida_quantumespresso.parsers import QEOutputParsingError, RetrievedFiles
 from aiida_quantumespresso.calculations.q2r import Q2rCalculation
 
 class Q2rParser(Parser):
@@ -55,10 +55,10 @@ class Q2rParser(Parser):
             return successful,()
         
         # check that the file has finished (i.e. JOB DONE is inside the file)
-        filpath = out_folder.get_abs_path(self._calc._OUTPUT_FILE_NAME)
-        with open(filpath,'r') as fil:
-            lines = fil.read()
-        if "JOB DONE" not in lines:
+        files = RetrievedFiles(out_folder)
+        job_done = files.tail_contains(self._calc._OUTPUT_FILE_NAME, "JOB DONE")
+        files.close()
+        if not job_done:
             successful = False
             self.logger.error("Computation did not finish properly")
        
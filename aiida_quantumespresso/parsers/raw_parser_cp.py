@@ -1,5 +1,5 @@
 # -*- coding: utf-8 -*-
-from aiida_quantumespresso.parsers import QEOutputParsingError
+from aiida_quantumespresso.parsers import QEOutputParsingError, RetrievedFiles
 from xml.dom.minidom import parseString
 from aiida_quantumespresso.parsers.raw_parser_pw import (read_xml_card,
                    parse_xml_child_integer,xml_card_header,parse_xml_child_bool,
@@ -59,6 +59,104 @@ def parse_cp_traj_stanzas(num_elements, splitlines, prepend_name,rescale=1.):
         e.message = "At line {}: {}".format(linenum+1, e.message)
         raise e
 
+def parse_cp_traj_file(filename, num_elements, prepend_name, rescale=1.,
+                       start=None, stop=None, stride=None, chunk_size=2**24):
+    """
+    Parse a trajectory file of CP (.pos, .cel, .vel, .for), made of stanzas of
+    a line with step number and time in ps followed by num_elements lines
+    with three values each. Same as parse_cp_traj_stanzas, but the file is
+    memory-mapped instead of being read in a list of lines: a first scan
+    finds where the stanzas start, then only the selected stanzas are decoded
+    directly into a preallocated array.
+
+    num_elements: is 3 for cell, and the number of atoms for coordinates,
+    velocities and forces.
+
+    prepend_name: a string to be prepended to the name of keys returned
+    in the return dictionary.
+
+    rescale: the values in each stanza are multiplied by this factor, for units conversion
+
+    start, stop, stride: select the stanzas to be returned, as in
+    slicing a list (e.g. stride=10 keeps one every ten steps)
+
+    chunk_size: the number of bytes scanned at a time to find the stanzas
+
+    The data is returned as a numpy array with shape (nsteps, num_elements, 3),
+    steps and times as lists.
+    """
+    import mmap
+    import numpy
+
+    lines_per_stanza = num_elements + 1
+
+    with open(filename, 'rb') as f:
+        try:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # empty file: cannot be mapped
+            data = ''
+    try:
+        size = len(data)
+        # offsets of the first line of each stanza
+        stanza_starts = [0] if size else []
+        num_newlines = 0
+        offset = 0
+        while offset < size:
+            chunk = numpy.frombuffer(data, dtype=numpy.uint8,
+                                     count=min(chunk_size, size - offset), offset=offset)
+            newlines = numpy.flatnonzero(chunk == ord('\n')) + offset
+            # the line following the n-th newline of the file is the line n
+            line_indices = numpy.arange(num_newlines + 1, num_newlines + 1 + len(newlines))
+            is_start = (line_indices % lines_per_stanza == 0) & (newlines + 1 < size)
+            stanza_starts.extend((newlines[is_start] + 1).tolist())
+            num_newlines += len(newlines)
+            offset += len(chunk)
+        num_lines = num_newlines
+        if size and data[size-1:size] != '\n':
+            # last line without newline
+            num_lines += 1
+
+        if num_lines % lines_per_stanza:
+            raise ValueError("At line {}: Wrong length of last block ({} lines instead of {})."
+                             .format(num_lines, num_lines % lines_per_stanza, lines_per_stanza))
+
+        stanza_ends = stanza_starts[1:] + [size]
+        selected = range(len(stanza_starts))[slice(start, stop, stride)]
+
+        steps = []
+        times = []
+        stanzas = numpy.empty((len(selected), num_elements, 3))
+        for index, i in enumerate(selected):
+            linenum = i * lines_per_stanza + 1
+            header_end = data.find('\n', stanza_starts[i], stanza_ends[i])
+            if header_end < 0:
+                header_end = stanza_ends[i]
+            header = data[stanza_starts[i]:header_end].split()
+            if len(header) != 2:
+                raise ValueError("At line {}: Wrong line length ({})".format(linenum, len(header)))
+            steps.append(int(header[0]))
+            times.append(float(header[1]))
+
+            block = data[header_end+1:stanza_ends[i]]
+            values = numpy.fromstring(block, sep=' ')
+            if len(values) != 3 * num_elements:
+                raise ValueError("At line {}: Wrong number of values in the stanza "
+                                 "({} instead of {})".format(linenum, len(values), 3*num_elements))
+            stanzas[index] = values.reshape(num_elements, 3)
+    finally:
+        if isinstance(data, mmap.mmap):
+            data.close()
+
+    if rescale != 1.:
+        stanzas *= rescale
+
+    return {
+        '{}_steps'.format(prepend_name): steps,
+        '{}_times'.format(prepend_name): times,
+        '{}_data'.format(prepend_name): stanzas,
+        }
+
 def parse_cp_text_output(data,xml_data):
     """
     data must be a list of strings, one for each lines, as returned by readlines().
@@ -189,18 +287,14 @@ def parse_cp_raw_output(out_file,xml_file=None,xml_counter_file=None):
         xml_counter_data={}
 
     # analyze the standard output
+    files = RetrievedFiles()
     try:
-        with open(out_file,'r') as f:
-            out_lines = f.readlines()
+        out_lines = files.readlines(out_file)
     except IOError:
         raise QEOutputParsingError("Failed to open output file: %s." % out_file)
 
     # understand if the job ended smoothly
-    job_successful=False
-    for line in reversed(out_lines):
-        if 'JOB DONE' in line:
-            job_successful=True
-            break
+    job_successful = files.tail_contains(out_file, 'JOB DONE')
 
     out_data=parse_cp_text_output(out_lines,xml_data)
 
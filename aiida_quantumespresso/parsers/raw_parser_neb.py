@@ -11,7 +11,24 @@ import os
 import string
 from aiida_quantumespresso.parsers.constants import ry_to_ev,hartree_to_ev,bohr_to_ang,ry_si,bohr_si
 from aiida_quantumespresso.parsers.raw_parser_pw import convert_qe_time_to_sec
-from aiida_quantumespresso.parsers import QEOutputParsingError
+from aiida_quantumespresso.parsers import (QEOutputParsingError, QEWarningScanner,
+                                           RetrievedFiles, parse_QE_errors)
+
+# TODO: find a more exhaustive list of the common errors of neb
+
+# critical warnings: if any is found, the calculation status is FAILED
+neb_critical_warnings = {'scf convergence NOT achieved on image':
+                         'SCF did not converge for a given image',
+                         'Maximum CPU time exceeded':'Maximum CPU time exceeded',
+                         'reached the maximum number of steps': 'Maximum number of iterations reached in the image optimization',
+                         '%%%%%%%%%%%%%%':None,
+                         }
+
+neb_minor_warnings = {'Warning:':None,
+                      }
+
+neb_warnings_scanner = QEWarningScanner(
+    dict(neb_critical_warnings.items() + neb_minor_warnings.items()))
 
 def parse_raw_output_neb(out_file, input_dict,parser_opts=None):
     """
@@ -44,9 +61,9 @@ def parse_raw_output_neb(out_file, input_dict,parser_opts=None):
     parser_info['parser_info'] = 'AiiDA QE Parser v{}'.format(parser_version)
     
     # load NEB out file
+    files = RetrievedFiles()
     try:
-        with open(out_file,'r') as f:
-            out_lines = f.read()
+        out_lines = files.read(out_file)
     except IOError: # non existing output file -> job crashed
         raise QEOutputParsingError("Failed to open output file: {}.".format(out_file))
 
@@ -54,11 +71,8 @@ def parse_raw_output_neb(out_file, input_dict,parser_opts=None):
         job_successful = False
 
     # check if the job has finished (that doesn't mean without errors)
-    finished_run = False
-    for line in out_lines.split('\n')[::-1]:
-        if 'JOB DONE' in line:
-            finished_run = True
-            break
+    finished_run = files.tail_contains(out_file, 'JOB DONE')
+    files.close()
     if not finished_run: # error if the job has not finished
         warning = 'QE neb run did not reach the end of the execution.'
         parser_info['parser_warnings'].append(warning)        
@@ -110,24 +124,8 @@ def parse_neb_text_output(data,input_dict={}):
     :return critical_messages: a list with critical messages. If any is found in
                                parsed_data['warnings'], the calculation is FAILED!
     """
-    from aiida_quantumespresso.parsers.raw_parser_pw import parse_QE_errors
     from collections import defaultdict
     
-    # TODO: find a more exhaustive list of the common errors of neb
-    
-    # critical warnings: if any is found, the calculation status is FAILED
-    critical_warnings = {'scf convergence NOT achieved on image':
-                         'SCF did not converge for a given image',
-                         'Maximum CPU time exceeded':'Maximum CPU time exceeded',
-                         'reached the maximum number of steps': 'Maximum number of iterations reached in the image optimization',       
-                         '%%%%%%%%%%%%%%':None,
-                         }
-    
-    minor_warnings = {'Warning:':None,                           
-                      }
-    
-    all_warnings = dict(critical_warnings.items() + minor_warnings.items())
-    
     parsed_data = {}
     parsed_data['warnings'] = []
     iteration_data = defaultdict(list)
@@ -152,7 +150,8 @@ def parse_neb_text_output(data,input_dict={}):
     # set by default the calculation as not converged.     
     parsed_data['converged'] = [False,0]
     
-    for count, line in enumerate(data.split('\n')):
+    lines = data.split('\n')
+    for count, line in enumerate(lines):
         if 'initial path length' in line:
             initial_path_length = float(line.split('=')[1].split('bohr')[0])
             parsed_data['initial_path_length'] = initial_path_length * bohr_to_ang
@@ -191,22 +190,12 @@ def parse_neb_text_output(data,input_dict={}):
             parsed_data['climbing_images_manual'] = [int(_) for _ in line.split(':')[1].split(',')[:-1]]
         elif 'neb: convergence achieved in' in line:
             parsed_data['converged'] = [True, int(line.split('iteration')[0].split()[-1])]
-        elif any( i in line for i in all_warnings):
-            message = [ all_warnings[i] for i in all_warnings.keys() if i in line][0]
-            if message is None:
-                message = line                
-                    
+        elif neb_warnings_scanner.search(line):
             if '%%%%%%%%%%%%%%' in line:
-                message  = None
-                messages = parse_QE_errors(data.split('\n'),count,parsed_data['warnings']) 
-                        
-            # if it found something, add to log
-            try:
-                parsed_data['warnings'].extend(messages)
-            except UnboundLocalError:
-                pass
-            if message is not None:
-                parsed_data['warnings'].append(message)
+                parsed_data['warnings'].extend(
+                    parse_QE_errors(lines,count,parsed_data['warnings']))
+            else:
+                parsed_data['warnings'].append(neb_warnings_scanner.messages_in(line)[0])
 
     try:
         num_images = parsed_data['num_of_images']
@@ -252,4 +241,4 @@ def parse_neb_text_output(data,input_dict={}):
                 image_dist = float(line.split('=')[1].split('bohr')[0])
                 iteration_data['image_dist'].append(image_dist * bohr_to_ang)
                 
-    return parsed_data, dict(iteration_data), critical_warnings.values()
+    return parsed_data, dict(iteration_data), neb_critical_warnings.values()
@@ -4,13 +4,31 @@ A collection of function that are used to parse the output of Quantum Espresso P
 The function that needs to be called from outside is parse_raw_ph_output().
 Ideally, the functions should work even without aiida and will return a dictionary with parsed keys.
 """
+import itertools
 from xml.dom.minidom import parseString
 from aiida_quantumespresso.parsers.constants import *
-from aiida_quantumespresso.parsers import QEOutputParsingError
+from aiida_quantumespresso.parsers import (QEOutputParsingError, QEWarningScanner,
+                                           RetrievedFiles, parse_QE_errors)
 from aiida_quantumespresso.parsers.raw_parser_pw import parse_xml_child_bool,read_xml_card,convert_qe_time_to_sec
 import numpy
 
-def parse_raw_ph_output(out_file, tensor_file=None, dynmat_files=[]):
+# TODO: find a more exhaustive list of the common errors of ph
+
+# critical warnings: if any is found, the calculation status is FAILED
+ph_critical_warnings = {'No convergence has been achieved':
+                        'Phonon did not reach end of self consistency',
+                        'Maximum CPU time exceeded':'Maximum CPU time exceeded',
+                        '%%%%%%%%%%%%%%':None,
+                        }
+
+ph_minor_warnings = {'Warning:':None,
+                     }
+
+ph_warnings_scanner = QEWarningScanner(
+    dict(ph_critical_warnings.items() + ph_minor_warnings.items()))
+
+def parse_raw_ph_output(out_file, tensor_file=None, dynmat_files=[], files=None,
+                        num_workers=None, also_eigenvectors=False):
     """
     Parses the output of a calculation
     Receives in input the paths to the output file and the xml file.
@@ -18,10 +36,22 @@ def parse_raw_ph_output(out_file, tensor_file=None, dynmat_files=[]):
     Args: 
         out_file 
             path to ph std output
+        files
+            the RetrievedFiles through which the files are read, if shared
+            with the caller (by default, a new one is used)
+        num_workers
+            the number of processes parsing the dynamical matrix files
+            (default: serial parsing)
+        also_eigenvectors
+            if True, decode and return also the eigenvectors of the
+            dynamical matrices (default: only frequencies and q-points)
     
     Returns:
         out_dict
             a dictionary with parsed data
+        dynmat_arrays
+            a dictionary with the arrays of the dynamical matrices (see
+            stack_ph_dynmats), empty if there are none
         successful
             a boolean that is False in case of failed calculations
             
@@ -41,10 +71,12 @@ def parse_raw_ph_output(out_file, tensor_file=None, dynmat_files=[]):
     parser_info['parser_warnings'] = []
     parser_info['parser_info'] = 'AiiDA QE-PH Parser v{}'.format(parser_version)
     
+    if files is None:
+        files = RetrievedFiles()
+    
     # load QE out file
     try:
-        with open(out_file,'r') as f:
-            out_lines = f.readlines()
+        out_lines = files.readlines(out_file)
     except IOError:
         # if the file cannot be open, the error is severe.
         raise QEOutputParsingError("Failed to open output file: {}.".format(out_file))
@@ -54,11 +86,7 @@ def parse_raw_ph_output(out_file, tensor_file=None, dynmat_files=[]):
         job_successful = False
     
     # check if the job has finished (that doesn't mean without errors)
-    finished_run = False
-    for line in out_lines[::-1]:
-        if 'JOB DONE' in line:
-            finished_run = True
-            break
+    finished_run = files.tail_contains(out_file, 'JOB DONE')
     
     if not finished_run:
         warning = 'QE ph run did not reach the end of the execution.'
@@ -68,8 +96,7 @@ def parse_raw_ph_output(out_file, tensor_file=None, dynmat_files=[]):
     # parse tensors, if present
     tensor_data = {}
     if tensor_file:
-        with open(tensor_file,'r') as f:
-            tensor_lines = f.read()
+        tensor_lines = files.read(tensor_file)
         try:
             tensor_data = parse_ph_tensor(tensor_lines)
         except QEOutputParsingError:
@@ -77,58 +104,271 @@ def parse_raw_ph_output(out_file, tensor_file=None, dynmat_files=[]):
             pass
     
     # parse ph output
-    with open(out_file,'r') as f:
-        out_lines = f.readlines()
     out_data,critical_messages = parse_ph_text_output(out_lines)
     
     # if there is a severe error, the calculation is FAILED
     if any([x in out_data['warnings'] for x in critical_messages]):
         job_successful = False
     
-    # parse dynamical matrices if present
+    # parse dynamical matrices if present (skipping the files without
+    # frequencies, like the one with the list of q-points)
+    dynmat_list = [_ for _ in parse_ph_dynmat_files(dynmat_files, num_workers, files,
+                                                    also_eigenvectors)
+                   if _ is not None]
+
+    # the dynamical matrices are stacked in arrays; only their number, units
+    # and warnings are kept in the output dictionary
+    dynmat_arrays = {}
     dynmat_data = {}
-    if dynmat_files:
-        # find lattice parameter
-        for dynmat_counter,this_dynmat in enumerate(dynmat_files):
-            # read it
-            with open(this_dynmat,'r') as f:
-                lines = f.readlines()
-            
-            # check if the file contains frequencies (i.e. is useful) or not
-            dynmat_to_parse = False
-            if not lines:
-                continue
-            try:
-                _ = [ float(i) for i in lines[0].split()]
-            except ValueError:
-                dynmat_to_parse = True
-            if not dynmat_to_parse:
-                continue
-            
-            # parse it
-            this_dynmat_data = parse_ph_dynmat(lines) 
-            
-            # join it with the previous dynmat info
-            dynmat_data['dynamical_matrix_%s' % dynmat_counter] = this_dynmat_data
-            # TODO: use the bands format?
+    if dynmat_list:
+        for this_dynmat_data in dynmat_list:
+            out_data['warnings'] += this_dynmat_data['warnings']
+        try:
+            dynmat_arrays = stack_ph_dynmats(dynmat_list, also_eigenvectors)
+        except QEOutputParsingError as e:
+            parser_info['parser_warnings'].append(
+                'Error while stacking the dynamical matrices: {}'.format(e.message))
+        else:
+            dynmat_data['number_of_dynamical_matrices'] = len(dynmat_list)
+            dynmat_data['dynamical_matrix_frequencies_units'] = 'cm-1'
+            dynmat_data['dynamical_matrix_q_points_units'] = '2pi/lattice_parameter'
 
     # join dictionaries, there should not be any twice repeated key
     for key in out_data.keys():
         if key in tensor_data.keys():
             raise AssertionError('{} found in two dictionaries'.format(key))
-    for key in out_data.keys():
-        if key in dynmat_data.keys():
-            if key=='warnings': # this ke can be found in both, but is not a problem
-                out_data['warnings'] += dynmat_data['warnings']
-                del dynmat_data['warnings']
-            else:
-                raise AssertionError('{} found in two dictionaries'.format(key))
     # I don't check the dynmat_data and parser_info keys 
     final_data = dict(dynmat_data.items() + out_data.items() + 
                       tensor_data.items() + parser_info.items())
 
-    return final_data,job_successful
+    return final_data,dynmat_arrays,job_successful
+
+
+def stack_ph_dynmats(dynmat_list, also_eigenvectors=False):
+    """
+    Stacks the frequencies, q-points and (optionally) eigenvectors of the
+    dynamical matrices parsed by parse_ph_dynmat (without
+    lattice_parameter), all of the same system.
+    The values that could not be parsed (because of Fortran overflows)
+    are set to NaN.
+
+    :param dynmat_list: the list of dictionaries returned by parse_ph_dynmat
+    :param also_eigenvectors: if True, stack also the eigenvectors (the
+        dynamical matrices must have been parsed with also_eigenvectors=True)
+    :return: a dictionary with the arrays
+
+        * frequencies: (nq, 3N) array with the frequencies (cm-1)
+        * q_points: (nq, 3) array with the q-points (2pi/lattice_parameter)
+        * eigenvectors: only if also_eigenvectors, complex (nq, 3N, N, 3)
+          array with the eigenvectors, with the index of the mode first and
+          then those of the atom and of the direction
+
+    :raise QEOutputParsingError: if the dynamical matrices have different
+        numbers of modes or atoms
+    """
+    try:
+        frequencies = numpy.array([_['frequencies'] for _ in dynmat_list],
+                                  dtype=float)
+        q_points = numpy.array([_['q_point'] for _ in dynmat_list],
+                               dtype=float)
+        eigenvectors = []
+        for this_dynmat_data in (dynmat_list if also_eigenvectors else []):
+            this_eigenvectors = this_dynmat_data['eigenvectors']
+            if not numpy.iscomplexobj(this_eigenvectors):
+                # (re,im) pairs, as returned by parse_ph_dynmat
+                this_eigenvectors = numpy.array(this_eigenvectors, dtype=float)
+                if this_eigenvectors.shape[-1:] != (2,):
+                    raise ValueError("wrong shape of the eigenvectors")
+                this_eigenvectors = (this_eigenvectors[...,0] +
+                                     1j * this_eigenvectors[...,1])
+            eigenvectors.append(this_eigenvectors)
+        eigenvectors = numpy.array(eigenvectors, dtype=complex)
+    except (KeyError, ValueError) as e:
+        raise QEOutputParsingError("Dynamical matrices of different sizes, "
+                                   "or without q-point ({})".format(e))
+    if frequencies.ndim != 2 or q_points.shape != (len(dynmat_list), 3):
+        raise QEOutputParsingError("Dynamical matrices of different sizes")
+
+    dynmat_arrays = {'frequencies': frequencies,
+                     'q_points': q_points,
+                     }
+    if also_eigenvectors:
+        if (eigenvectors.ndim != 4 or eigenvectors.shape[1] != frequencies.shape[1]
+                or eigenvectors.shape[3] != 3):
+            raise QEOutputParsingError("Dynamical matrices of different sizes")
+        dynmat_arrays['eigenvectors'] = eigenvectors
 
+    return dynmat_arrays
+
+
+# the lines delimiting the list of modes
+dynmat_modes_delimiter = '*' * 48
+
+def parse_ph_dynmat_files(dynmat_files, num_workers=None, files=None,
+                          also_eigenvectors=False):
+    """
+    Parses the dynamical matrix files with parse_ph_dynmat_text, in a pool of
+    num_workers processes if num_workers > 1.
+
+    :param dynmat_files: the paths of the files
+    :param num_workers: the number of processes (default: serial parsing)
+    :param files: the RetrievedFiles to read the files, for serial parsing
+    :param also_eigenvectors: if True, parse also the eigenvectors
+    :return: the list of the dictionaries returned by parse_ph_dynmat_text,
+        in the same order of dynmat_files (None for the files without
+        a dynamical matrix)
+    """
+    if num_workers > 1 and len(dynmat_files) > 1:
+        import multiprocessing
+        pool = multiprocessing.Pool(min(num_workers, len(dynmat_files)))
+        try:
+            return pool.map(_parse_ph_dynmat_file,
+                            [(_, also_eigenvectors) for _ in dynmat_files])
+        finally:
+            pool.terminate()
+            pool.join()
+
+    if files is None:
+        files = RetrievedFiles()
+    return [parse_ph_dynmat_text(files.read(_), also_eigenvectors)
+            for _ in dynmat_files]
+
+def _parse_ph_dynmat_file(task):
+    """
+    Reads and parses a dynamical matrix file (in a worker process)
+
+    :param task: tuple with the path of the file and also_eigenvectors
+    """
+    filename, also_eigenvectors = task
+    files = RetrievedFiles()
+    try:
+        return parse_ph_dynmat_text(files.read(filename), also_eigenvectors)
+    finally:
+        files.close()
+
+def parse_ph_dynmat_text(text, also_eigenvectors=False):
+    """
+    Parses a dynamical matrix file, as parse_ph_dynmat, but decoding the
+    frequencies (and eigenvectors) at once with decode_ph_dynmat_modes. The
+    files that cannot be decoded this way (e.g. with Fortran overflows) are
+    parsed by parse_ph_dynmat.
+
+    :param text: the content of the file
+    :param also_eigenvectors: if True, return also the eigenvectors
+    :return: None if the file does not contain a dynamical matrix (as the
+        file with the list of q-points, that starts with numbers), otherwise
+        a dictionary with the keys of parse_ph_dynmat. The eigenvectors, if
+        requested, are returned as a complex (3N, N, 3) array
+    """
+    lines = text.split('\n', 3)
+    # check if the file contains frequencies (i.e. is useful) or not
+    try:
+        _ = [float(i) for i in lines[0].split()]
+        return None
+    except ValueError:
+        pass
+
+    try:
+        if 'Dynamical matrix file' not in lines[0]:
+            raise ValueError("not a dynamical matrix file")
+        num_atoms = int(lines[2].split()[1])
+        # q point is written several times, because it can also be rotated.
+        # I consider only the first point, which is the one computed
+        q_start = text.index('q = ', len(lines[0]))
+        q_line = text[q_start:text.index('\n', q_start)]
+        q_point = [float(i) for i in q_line.split('(')[1].split(')')[0].split()]
+        frequencies, eigenvectors = decode_ph_dynmat_modes(text, num_atoms,
+                                                           also_eigenvectors)
+    except (ValueError, IndexError):
+        return parse_ph_dynmat(text.splitlines(True),
+                               also_eigenvectors=also_eigenvectors)
+
+    parsed_data = {'warnings': [],
+                   'q_point': q_point,
+                   'q_point_units': '2pi/lattice_parameter',
+                   'frequencies': frequencies.tolist(),
+                   'frequencies_units': 'cm-1',
+                   }
+    if also_eigenvectors:
+        parsed_data['eigenvectors'] = eigenvectors
+    return parsed_data
+
+def decode_ph_dynmat_modes(text, num_atoms, also_eigenvectors=True):
+    """
+    Decodes at once the frequencies and the eigenvectors of the modes
+    written at the end of a dynamical matrix file, after
+    'Diagonalizing the dynamical matrix'.
+
+    :param text: the content of the dynamical matrix file
+    :param num_atoms: the number of atoms N
+    :param also_eigenvectors: if False, the eigenvectors are not decoded
+    :return: a (3N,) array with the frequencies (cm-1) and a complex
+        (3N, N, 3) array with the eigenvectors (None if not
+        also_eigenvectors)
+    :raise ValueError: if the modes are not in the expected format, or
+        if a value is not a number (e.g. *** written by Fortran)
+    """
+    start = text.index(dynmat_modes_delimiter,
+                       text.index('Diagonalizing the dynamical matrix'))
+    start = text.index('\n', start) + 1
+    end = text.rindex(dynmat_modes_delimiter)
+    section = text[start:end]
+
+    # the line with the frequency of each mode is followed by its
+    # eigenvector: one line per atom, with the 3 complex components
+    # between parentheses
+    lines = section.split('\n')
+    is_mode_line = ['freq' in _ or 'omega' in _ for _ in lines]
+    mode_lines = list(itertools.compress(lines, is_mode_line))
+    if len(mode_lines) != 3 * num_atoms:
+        raise ValueError("Wrong number of modes")
+    frequencies = numpy.array([float(_.split('[cm-1]')[0].split('=')[-1])
+                               for _ in mode_lines])
+    if not also_eigenvectors:
+        return frequencies, None
+
+    eigenvectors_text = ' '.join(itertools.compress(
+        lines, [not _ for _ in is_mode_line]))
+    values = numpy.fromstring(
+        eigenvectors_text.replace('(', ' ').replace(')', ' '), sep=' ')
+    if len(values) != 3 * num_atoms * num_atoms * 6:
+        raise ValueError("Wrong number of values in the eigenvectors")
+    values = values.reshape(3 * num_atoms, num_atoms, 3, 2)
+
+    return frequencies, values[...,0] + 1j * values[...,1]
+
+def decode_ph_dynmat_matrix(text, num_atoms):
+    """
+    Decodes at once the dynamical matrix of the first q-point of a
+    dynamical matrix file, written as N*N blocks, each with the indices of
+    the two atoms followed by 3 rows with the 3 complex elements of the
+    block.
+
+    :param text: the content of the dynamical matrix file
+    :param num_atoms: the number of atoms N
+    :return: a complex (N, N, 3, 3) array with the dynamical matrix (in
+        Ry/bohr^2, not divided by the masses), with indices D[na,nb,i,j]
+    :raise ValueError: if the matrix is not in the expected format
+    """
+    start = text.index('q = ', text.index('Dynamical  Matrix in cartesian axes'))
+    start = text.index('\n', start) + 1
+    # the blocks end where the next section (the matrix of another q-point
+    # of the star, the dielectric tensor or the modes) starts
+    ends = [text.find(_, start) for _ in ('q = ', 'Dielectric', 'Effective',
+                                          'Diagonalizing')]
+    end = min([_ for _ in ends if _ >= 0] or [len(text)])
+    end = text.rfind('\n', start, end) + 1
+
+    values = numpy.fromstring(text[start:end], sep=' ')
+    if len(values) != num_atoms * num_atoms * 20:
+        raise ValueError("Wrong number of values in the dynamical matrix")
+    values = values.reshape(num_atoms * num_atoms, 20)
+    indices = numpy.indices((num_atoms, num_atoms)).reshape(2, -1).T + 1
+    if not numpy.array_equal(values[:,:2], indices):
+        raise ValueError("Wrong atom indices in the dynamical matrix")
+    values = values[:,2:].reshape(num_atoms, num_atoms, 3, 3, 2)
+
+    return values[...,0] + 1j * values[...,1]
 
 def parse_ph_tensor(data):
     """
@@ -201,8 +441,6 @@ def parse_ph_text_output(lines):
     :return critical_messages: a list with critical messages. If any is found in
                                parsed_data['warnings'], the calculation is FAILED!
     """
-    from aiida_quantumespresso.parsers.raw_parser_pw import parse_QE_errors
-
     parsed_data = {}
     parsed_data['warnings'] = []
     # parse time, starting from the end
@@ -279,35 +517,16 @@ def parse_ph_text_output(lines):
         #            )[1].split(")")[0].split()] for i,li in enumerate(lines[count+1:count+4])]
         #    parsed_data['cell'] = cell
             
-    # TODO: find a more exhaustive list of the common errors of ph
-    
-    # critical warnings: if any is found, the calculation status is FAILED
-    critical_warnings = {'No convergence has been achieved':
-                         'Phonon did not reach end of self consistency',
-                         'Maximum CPU time exceeded':'Maximum CPU time exceeded',
-                         '%%%%%%%%%%%%%%':None,
-                         }
-    
-    minor_warnings = {'Warning:':None,
-                      }
-    
-    all_warnings = dict(critical_warnings.items() + minor_warnings.items())
-
-    for count,line in enumerate(lines):
+    for count,line,markers in ph_warnings_scanner.scan(lines):
+        if '%%%%%%%%%%%%%%' in line:
+            messages = parse_QE_errors(lines,count,parsed_data['warnings'])
+        else:
+            messages = [ph_warnings_scanner.get_message(marker,line)
+                        for marker in markers]
+        # if it found something, add to log
+        parsed_data['warnings'].extend(messages)
 
-        if any( i in line for i in all_warnings):
-            messages = [ all_warnings[i] if all_warnings[i] is not None 
-                            else line for i in all_warnings.keys() 
-                            if i in line]
-                                               
-            if '%%%%%%%%%%%%%%' in line:
-                messages = parse_QE_errors(lines,count,parsed_data['warnings']) 
-                        
-            # if it found something, add to log
-            if len(messages)>0:
-                parsed_data['warnings'].extend(messages)
-            
-    return parsed_data,critical_warnings.values()
+    return parsed_data,ph_critical_warnings.values()
 
 def parse_ph_dynmat(data,lattice_parameter=None,also_eigenvectors=False,
                     parse_header=False):
@@ -7,11 +7,14 @@ The parsing will try to convert whatever it can in some dictionary, which
 by operative decision doesn't have much structure encoded, [the values are simple ]
 """
 import xml.dom.minidom
+import io
 import os
 import string
 import re
+import numpy
 from aiida_quantumespresso.parsers.constants import ry_to_ev,hartree_to_ev,bohr_to_ang,ry_si,bohr_si
-from aiida_quantumespresso.parsers import QEOutputParsingError
+from aiida_quantumespresso.parsers import (QEOutputParsingError, QEWarningScanner,
+                                           RetrievedFiles, markers_regex, parse_QE_errors)
 
 # TODO: it could be possible to use info of the input file to parse output.
 # but atm the output has all the informations needed for the parsing.
@@ -38,7 +41,16 @@ def parse_raw_output(out_file, input_dict, parser_opts=None, xml_file=None, dir_
 
     :param out_file: path to pw std output
     :param input_dict: dictionary with the input parameters
-    :param parser_opts: not used
+    :param parser_opts: dictionary of parser options. Here, 'xml_backend'
+        selects how the xml file is read (see parse_pw_xml_output):
+        'minidom' (default) or 'etree'; 'eigenval_threads' is the number of
+        threads reading the files with the bands (default: serial reading);
+        'text_workers' is the number of processes parsing the ionic steps of
+        the text output (default: serial parsing, see
+        PwTextOutputParser.feed_file); 'exclude' is a list of sections not to
+        be parsed at all, among 'bands' (the files of the k-points),
+        'symmetries', 'magnetic_moments' (per atom), 'forces', 'stress',
+        'polarization' and 'dipole'
     :param dir_with_bands: path to directory with all k-points (Kxxxxx) folders
     :param xml_file: path to QE data-file.xml
 
@@ -48,7 +60,8 @@ def parse_raw_output(out_file, input_dict, parser_opts=None, xml_file=None, dir_
     :return bands_data: a dictionary with data for bands (for bands calcs.)
     :return job_successful: a boolean that is False in case of failed calculations
 
-    :raises QEOutputParsingError: for errors in the parsing,
+    :raises QEOutputParsingError: for errors in the parsing, or for unknown
+        parser options (see check_parser_options)
     :raises AssertionError: if two keys in the parsed dicts are found to be qual
 
     3 different keys to check in output: parser_warnings, xml_warnings and warnings.
@@ -67,15 +80,28 @@ def parse_raw_output(out_file, input_dict, parser_opts=None, xml_file=None, dir_
     parser_info['parser_warnings'] = []
     parser_info['parser_info'] = 'AiiDA QE Parser v{}'.format(parser_version)
 
+    if parser_opts is None:
+        parser_opts = {}
+    check_parser_options(parser_opts)
+    xml_backend = parser_opts.get('xml_backend','minidom')
+    exclude = parser_opts.get('exclude',[])
+
     # if xml_file is not given in input, skip its parsing
     if xml_file is not None:
         try:
-            with open(xml_file,'r') as f:
-                xml_lines = f.read() # Note: read() and not readlines()
+            xml_handle = open(xml_file,'r')
         except IOError:
             raise QEOutputParsingError("Failed to open xml file: {}.".format(xml_file))
 
-        xml_data,structure_data,bands_data = parse_pw_xml_output(xml_lines,dir_with_bands)
+        with xml_handle:
+            if xml_backend == 'minidom':
+                xml_source = xml_handle.read() # Note: read() and not readlines()
+            else:
+                # the file is read incrementally
+                xml_source = xml_handle
+            xml_data,structure_data,bands_data = parse_pw_xml_output(xml_source,dir_with_bands,
+                backend=xml_backend,eigenval_threads=parser_opts.get('eigenval_threads',None),
+                exclude=exclude)
         # Note the xml file should always be consistent.
     else:
         parser_info['parser_warnings'].append('Skipping the parsing of the xml file.')
@@ -83,38 +109,43 @@ def parse_raw_output(out_file, input_dict, parser_opts=None, xml_file=None, dir_
         bands_data = {}
         structure_data = {}
 
-    # load QE out file
-    try:
-        with open(out_file,'r') as f:
-            out_lines = f.read()
-    except IOError: # non existing output file -> job crashed
+    # parse the QE out file, streaming it line by line
+    if not os.path.isfile(out_file): # non existing output file -> job crashed
         raise QEOutputParsingError("Failed to open output file: {}.".format(out_file))
 
-    if not out_lines: # there is an output file, but it's empty -> crash
+    text_parser = PwTextOutputParser(xml_data,structure_data,input_dict,exclude)
+    parsing_error = None
+    try:
+        text_parser.feed_file(out_file, parser_opts.get('text_workers',None))
+        out_data,trajectory_data,critical_messages = text_parser.close()
+    except QEOutputParsingError as e:
+        parsing_error = e
+        # the parsing stopped before the end: look for JOB DONE from the end
+        # of the (memory-mapped) file, without reading it again
+        files = RetrievedFiles()
+        try:
+            text_parser.job_done = files.tail_contains(out_file, 'JOB DONE')
+        finally:
+            files.close()
+
+    if not text_parser.number_of_lines: # there is an output file, but it's empty -> crash
         job_successful = False
 
     # check if the job has finished (that doesn't mean without errors)
-    finished_run = False
-    for line in out_lines.split('\n')[::-1]:
-        if 'JOB DONE' in line:
-            finished_run = True
-            break
+    finished_run = text_parser.job_done
     if not finished_run: # error if the job has not finished
         warning = 'QE pw run did not reach the end of the execution.'
         parser_info['parser_warnings'].append(warning)
         job_successful = False
 
-    # parse
-    try:
-        out_data,trajectory_data,critical_messages = parse_pw_text_output(out_lines,xml_data,structure_data,input_dict)
-    except QEOutputParsingError as e:
+    if parsing_error is not None:
         if not finished_run: # I try to parse it as much as possible
             parser_info['parser_warnings'].append('Error while parsing the output file')
             out_data = {}
             trajectory_data = {}
             critical_messages = []
         else: # if it was finished and I got error, it's a mistake of the parser
-            raise QEOutputParsingError('Error while parsing QE output. Exception message: {}'.format(e.message))
+            raise QEOutputParsingError('Error while parsing QE output. Exception message: {}'.format(parsing_error.message))
 
     # I add in the out_data all the last elements of trajectory_data values.
     # Safe for some large arrays, that I will likely never query.
@@ -174,6 +205,8 @@ def cell_volume(a1,a2,a3):
 # In the following, some functions that helps the parsing of
 # the xml file of QE v5.0.x (version below not tested)
 def read_xml_card(dom,cardname):
+    if isinstance(dom, XmlCardsReader):
+        return dom.read_card(cardname)
     try:
         root_node = [_ for _ in dom.childNodes if
                     isinstance(_, xml.dom.minidom.Element)
@@ -185,6 +218,128 @@ def read_xml_card(dom,cardname):
         print e
         raise QEOutputParsingError('Error parsing tag {}'.format(cardname) )
 
+def get_iterparse():
+    """
+    Return the fastest iterparse available: the one of lxml, if installed,
+    otherwise the one of cElementTree.
+    """
+    try:
+        from lxml.etree import iterparse
+    except ImportError:
+        try:
+            from xml.etree.cElementTree import iterparse
+        except ImportError:
+            from xml.etree.ElementTree import iterparse
+    return iterparse
+
+class XmlCardsReader(object):
+    """
+    Incremental reader of the cards of the xml data-file of QE, to be used
+    instead of the DOM of xml.dom.minidom with read_xml_card().
+
+    The file is read with iterparse only up to the requested card. Cards
+    found on the way are kept until they are requested, if they are among
+    the expected cardnames, or dropped otherwise; a card is dropped also as
+    soon as it is returned, so that the whole tree is never in memory.
+    The cards are returned wrapped in XmlElementNode.
+    """
+    def __init__(self, source, cardnames=None):
+        """
+        :param source: a file name or an open file
+        :param cardnames: the names of the cards that will be read, or None
+            to keep all of them until requested
+        """
+        self._events = get_iterparse()(source, events=('start','end'))
+        self._cardnames = cardnames
+        self._cards = {}
+        self._root = None
+        self._depth = 0
+
+    def read_card(self, cardname):
+        """
+        Return the card, child of the Root element, with the given name.
+
+        :raise QEOutputParsingError: if the card is not found
+        :raise SyntaxError: if the file is not a valid xml (ParseError of
+            ElementTree and lxml are subclasses of it)
+        """
+        while cardname not in self._cards:
+            try:
+                event, element = next(self._events)
+            except StopIteration:
+                raise QEOutputParsingError('Error parsing tag {}'.format(cardname))
+
+            if event == 'start':
+                self._depth += 1
+                if self._root is None:
+                    if element.tag != 'Root':
+                        raise QEOutputParsingError('Error parsing tag {}'.format(cardname))
+                    self._root = element
+                continue
+
+            self._depth -= 1
+            if self._depth == 1:
+                # the card is complete: detach it from the tree
+                if ((self._cardnames is None or element.tag in self._cardnames)
+                    and element.tag not in self._cards):
+                    self._cards[element.tag] = element
+                self._root.remove(element)
+
+        return XmlElementNode(self._cards.pop(cardname))
+
+class XmlElementNode(object):
+    """
+    Wrapper of an ElementTree (or lxml) element, with the attributes and
+    methods of the nodes of xml.dom.minidom used by the parsing functions.
+    """
+    ELEMENT_NODE = 1
+    nodeType = ELEMENT_NODE
+
+    def __init__(self, element):
+        self._element = element
+        self._child_nodes = None
+
+    @property
+    def nodeName(self):
+        return self._element.tag
+
+    @property
+    def tagName(self):
+        return self._element.tag
+
+    @property
+    def childNodes(self):
+        if self._child_nodes is None:
+            nodes = []
+            if self._element.text:
+                nodes.append(XmlTextNode(self._element.text))
+            for child in self._element:
+                # lxml also returns comments and processing instructions
+                if isinstance(child.tag, basestring):
+                    nodes.append(XmlElementNode(child))
+                if child.tail:
+                    nodes.append(XmlTextNode(child.tail))
+            self._child_nodes = nodes
+        return self._child_nodes
+
+    def getAttribute(self, name):
+        return self._element.get(name, '')
+
+    def getElementsByTagName(self, name):
+        return [XmlElementNode(_) for _ in self._element.iter(name)
+                if _ is not self._element]
+
+class XmlTextNode(object):
+    """
+    The text of an XmlElementNode, as the Text nodes of xml.dom.minidom.
+    """
+    TEXT_NODE = 3
+    nodeType = TEXT_NODE
+    nodeName = '#text'
+
+    def __init__(self, data):
+        self.data = data
+
 def parse_xml_child_integer(tagname,target_tags):
     try:
         #a=target_tags.getElementsByTagName(tagname)[0]
@@ -605,6 +760,8 @@ def xml_card_symmetries(parsed_data,dom):
 
     # parse the symmetry matrices
     parsed_data['symmetries']=[]
+    a_dict={_.nodeName: _ for _ in target_tags.childNodes
+            if _.nodeName.startswith('SYMM.')}
     find_sym=True
     i=0
     while find_sym:
@@ -613,7 +770,7 @@ def xml_card_symmetries(parsed_data,dom):
             current_sym={}
             tagname='SYMM.'+str(i)
             #a=target_tags.getElementsByTagName(tagname)[0]
-            a=[_ for _ in target_tags.childNodes if _.nodeName == tagname][0]
+            a=a_dict[tagname]
             tagname2='INFO'
             b=a.getElementsByTagName(tagname2)[0]
             attrname='NAME'
@@ -644,7 +801,7 @@ def xml_card_symmetries(parsed_data,dom):
                     raise
 
             parsed_data['symmetries'].append(current_sym)
-        except IndexError: # SYMM.i out of index
+        except (KeyError,IndexError): # SYMM.i out of index
             find_sym=False
 
     return parsed_data
@@ -724,34 +881,172 @@ def xml_card_exchangecorrelation(parsed_data,dom):
 
     return parsed_data
 
-def parse_pw_xml_output(data,dir_with_bands=None):
+eigenval_units_re = re.compile(r'<UNITS_FOR_ENERGIES\s+UNITS="([^"]*)"')
+
+def read_eigenval_file(filename):
+    """
+    Read the eigenvalues and occupations of one eigenval.xml file of QE.
+    Only the few tags needed are looked for in the text, without building
+    the DOM of the file.
+
+    :param filename: path of the eigenval.xml file
+    :return energies,occupations: 1D numpy arrays, energies in eV
+    """
+    import numpy
+
+    with open(filename,'r') as f:
+        data = f.read()
+
+    match = eigenval_units_re.search(data)
+    metric = match.group(1) if match else None
+    if metric not in ['Hartree']:
+        raise QEOutputParsingError('Error parsing eigenvalues xml file, ' + \
+                                   'units {} not implemented.'.format(metric))
+
+    values = []
+    for tagname in ['EIGENVALUES','OCCUPATIONS']:
+        start = data.index('>',data.index('<'+tagname)) + 1
+        end = data.index('</'+tagname+'>',start)
+        values.append(numpy.fromstring(data[start:end],sep=' '))
+    energies,occupations = values
+    if len(energies) != len(occupations):
+        raise QEOutputParsingError('Error parsing eigenvalues xml file {}: '
+                                   'different number of eigenvalues and '
+                                   'occupations'.format(filename))
+    return energies*hartree_to_ev,occupations
+
+def read_eigenval_files(filenames,num_threads=None):
+    """
+    Read the eigenval.xml files of all k-points into preallocated arrays.
+
+    :param filenames: a list with, for each spin component, the list of the
+        eigenval.xml files of all the k-points
+    :param num_threads: if larger than 1, the files are read by a pool of
+        as many threads (useful e.g. on network filesystems)
+    :return bands,occupations: numpy arrays with shape (nspin,nkpt,nbnd),
+        the bands in eV
+    """
+    import numpy
+
+    nspin = len(filenames)
+    nkpt = len(filenames[0]) if nspin else 0
+    all_files = [name for spin_files in filenames for name in spin_files]
+    if not all_files:
+        return numpy.zeros((nspin,nkpt,0)),numpy.zeros((nspin,nkpt,0))
+
+    pool = None
+    if num_threads > 1:
+        from multiprocessing.pool import ThreadPool
+        pool = ThreadPool(num_threads)
+        results = pool.imap(read_eigenval_file,all_files,
+                            chunksize=max(1,len(all_files)//(4*num_threads)))
+    else:
+        results = (read_eigenval_file(name) for name in all_files)
+
+    try:
+        bands = None
+        for index,(energies,occupations) in enumerate(results):
+            if bands is None:
+                nbnd = len(energies)
+                bands = numpy.empty((nspin,nkpt,nbnd))
+                occupations_array = numpy.empty((nspin,nkpt,nbnd))
+            elif len(energies) != nbnd:
+                raise QEOutputParsingError('Error parsing eigenvalues xml file {}: '
+                                           'expected {} bands, found {}'.format(
+                                           all_files[index],nbnd,len(energies)))
+            spin,kpoint = divmod(index,nkpt)
+            bands[spin,kpoint] = energies
+            occupations_array[spin,kpoint] = occupations
+    finally:
+        if pool is not None:
+            pool.terminate()
+
+    return bands,occupations_array
+
+# the cards of the xml file that are parsed by parse_pw_xml_cards
+pw_xml_cardnames = ['CELL','IONS','HEADER','CONTROL','ELECTRIC_FIELD',
+                    'PLANE_WAVES','SPIN','BRILLOUIN_ZONE','BAND_STRUCTURE_INFO',
+                    'MAGNETIZATION_INIT','OCCUPATIONS','CHARGE-DENSITY',
+                    'EIGENVALUES','SYMMETRIES','EXCHANGE_CORRELATION']
+
+# the cards that are skipped if their section is excluded
+pw_xml_card_sections = {'EIGENVALUES':'bands', 'SYMMETRIES':'symmetries'}
+
+pw_xml_backends = ['minidom', 'etree']
+
+def parse_pw_xml_output(data,dir_with_bands=None,backend='minidom',eigenval_threads=None,exclude=()):
     """
     Parse the xml data of QE v5.0.x
-    Input data must be a single string, as returned by file.read()
+    Input data must be a single string, as returned by file.read(), or an
+    open file.
     Returns a dictionary with parsed values
+
+    :param backend: 'minidom' to build the whole DOM with xml.dom.minidom,
+        or 'etree' to read the file incrementally with iterparse (of lxml,
+        if available, or of cElementTree), faster and without keeping the
+        whole tree in memory. The parsed dictionaries are the same.
+    :param eigenval_threads: number of threads reading the eigenval.xml
+        files, see read_eigenval_files
+    :param exclude: list of the sections not to be parsed, see
+        parse_pw_xml_cards
+    :raise QEOutputParsingError: if the backend is unknown
     """
-    import copy
     from xml.parsers.expat import ExpatError
     # NOTE : I often assume that if the xml file has been written, it has no
     # internal errors.
-    try:
-        dom = xml.dom.minidom.parseString(data)
-    except ExpatError:
-        return {'xml_warnings':"Error in XML parseString: bad format"},{},{}
+    bad_format = {'xml_warnings':"Error in XML parseString: bad format"},{},{}
 
+    if backend == 'minidom':
+        if hasattr(data,'read'):
+            data = data.read()
+        try:
+            dom = xml.dom.minidom.parseString(data)
+        except ExpatError:
+            return bad_format
+        return parse_pw_xml_cards(dom,dir_with_bands,eigenval_threads,exclude)
+
+    elif backend == 'etree':
+        if not hasattr(data,'read'):
+            data = io.BytesIO(data)
+        # the cards that are not needed are dropped while reading
+        cardnames = [cardname for cardname in pw_xml_cardnames
+                     if pw_xml_card_sections.get(cardname) not in exclude]
+        dom = XmlCardsReader(data,cardnames)
+        try:
+            return parse_pw_xml_cards(dom,dir_with_bands,eigenval_threads,exclude)
+        except SyntaxError: # parsing errors of ElementTree and lxml
+            return bad_format
+
+    else:
+        raise QEOutputParsingError("Unknown xml backend '{}', must be "
+            "among {}".format(backend, ', '.join(pw_xml_backends)))
+
+def parse_pw_xml_cards(dom,dir_with_bands=None,eigenval_threads=None,exclude=()):
+    """
+    Parse the cards of the xml data of QE v5.0.x
+
+    :param dom: the xml.dom.minidom Document, or an XmlCardsReader.
+        The cards are read in the order of pw_xml_cardnames.
+    :param dir_with_bands: path to directory with all k-points (Kxxxxx) folders
+    :param eigenval_threads: number of threads reading the eigenval.xml
+        files, see read_eigenval_files
+    :param exclude: list of the sections not to be parsed: 'bands' (the
+        EIGENVALUES card and the eigenval.xml files) and 'symmetries'
+    Returns a dictionary with parsed values
+    """
     parsed_data = {}
 
     parsed_data['xml_warnings'] = []
 
     structure_dict = {}
     # CARD CELL
-    structure_dict,lattice_vectors,volume = copy.deepcopy(xml_card_cell(structure_dict,dom))
+    structure_dict,lattice_vectors,volume = xml_card_cell(structure_dict,dom)
 
     # CARD IONS
-    structure_dict = copy.deepcopy(xml_card_ions(structure_dict,dom,lattice_vectors,volume))
+    structure_dict = xml_card_ions(structure_dict,dom,lattice_vectors,volume)
 
     #CARD HEADER
-    parsed_data = copy.deepcopy(xml_card_header(parsed_data,dom))
+    parsed_data = xml_card_header(parsed_data,dom)
 
     # CARD CONTROL
     cardname='CONTROL'
@@ -785,10 +1080,10 @@ def parse_pw_xml_output(data,dir_with_bands=None):
             parsed_data[tagname.lower()]=parse_xml_child_float(tagname,target_tags)
 
     # CARD PLANE_WAVES
-    parsed_data = copy.deepcopy(xml_card_planewaves(parsed_data,dom,'pw'))
+    parsed_data = xml_card_planewaves(parsed_data,dom,'pw')
 
     # CARD SPIN
-    parsed_data = copy.deepcopy(xml_card_spin(parsed_data,dom))
+    parsed_data = xml_card_spin(parsed_data,dom)
 
     # CARD BRILLOUIN ZONE
     cardname='BRILLOUIN_ZONE'
@@ -971,82 +1266,37 @@ def parse_pw_xml_output(data,dir_with_bands=None):
     #CARD EIGENVALUES
     # Note: if this card is parsed, the dimension of the database grows very much!
     cardname='EIGENVALUES'
-    target_tags=read_xml_card(dom,cardname)
     bands_dict = {}
-    if dir_with_bands:
+    if 'bands' not in exclude:
+        target_tags=read_xml_card(dom,cardname)
+    if dir_with_bands and 'bands' not in exclude:
         try:
-            occupations1 = []
-            occupations2 = []
-            bands1 = []
-            bands2 = []
+            # the eigenval.xml files of each k-point
+            eigenval_files = []
+            a_dict={_.nodeName: _ for _ in target_tags.childNodes
+                    if _.nodeName.startswith('K-POINT.')}
             for i in range(parsed_data['number_of_k_points']):
                 tagname='K-POINT.'+str(i+1)
                 #a=target_tags.getElementsByTagName(tagname)[0]
-                a=[_ for _ in target_tags.childNodes if _.nodeName == tagname][0]
-
-                def read_bands_and_occupations(eigenval_n):
-                    # load the eigenval.xml file
-                    with open(eigenval_n,'r') as eigenval_f:
-                        f = eigenval_f.read()
-
-                    eig_dom = xml.dom.minidom.parseString(f)
-
-                    tagname = 'UNITS_FOR_ENERGIES'
-                    a = eig_dom.getElementsByTagName(tagname)[0]
-                    attrname = 'UNITS'
-                    metric = str(a.getAttribute(attrname))
-                    if metric not in ['Hartree']:
-                        raise QEOutputParsingError('Error parsing eigenvalues xml file, ' + \
-                                                   'units {} not implemented.'.format(metric))
-
-                    tagname='EIGENVALUES'
-                    a=eig_dom.getElementsByTagName(tagname)[0]
-                    b=a.childNodes[0]
-                    value_e = [ float(s)*hartree_to_ev for s in b.data.split() ]
-
-                    tagname='OCCUPATIONS'
-                    a = eig_dom.getElementsByTagName(tagname)[0]
-                    b = a.childNodes[0]
-                    value_o = [ float(s) for s in b.data.split() ]
-                    return value_e,value_o
+                a=a_dict[tagname]
 
                 # two cases: in cases of magnetic calculations, I have both spins
-                try:
-                    tagname2 = 'DATAFILE'
-                    b = a.getElementsByTagName(tagname2)[0]
-                    attrname = 'iotk_link'
-                    value = str(b.getAttribute(attrname)).rstrip().replace('\n','')
-                    eigenval_n =  os.path.join(dir_with_bands,value)
-
-                    value_e,value_o = read_bands_and_occupations(eigenval_n)
-                    bands1.append(value_e)
-                    occupations1.append(value_o)
-
-                except IndexError:
-                    tagname2='DATAFILE.1'
-                    b1 = a.getElementsByTagName(tagname2)[0]
-                    tagname2='DATAFILE.2'
-                    b2 = a.getElementsByTagName(tagname2)[0]
-                    attrname = 'iotk_link'
-                    value1 = str(b1.getAttribute(attrname)).rstrip().replace('\n','')
-                    value2 = str(b2.getAttribute(attrname)).rstrip().replace('\n','')
-
-                    eigenval_n =  os.path.join(dir_with_bands,value1)
-                    value_e,value_o = read_bands_and_occupations(eigenval_n)
-                    bands1.append(value_e)
-                    occupations1.append(value_o)
-
-                    eigenval_n =  os.path.join(dir_with_bands,value2)
-                    value_e,value_o = read_bands_and_occupations(eigenval_n)
-                    bands2.append(value_e)
-                    occupations2.append(value_o)
-
-            occupations = [occupations1]
-            bands = [bands1]
-            if occupations2:
-                occupations.append(occupations2)
-            if bands2:
-                bands.append(bands2)
+                datafiles = a.getElementsByTagName('DATAFILE')[:1]
+                if not datafiles:
+                    datafiles = [a.getElementsByTagName('DATAFILE.1')[0],
+                                 a.getElementsByTagName('DATAFILE.2')[0]]
+                attrname = 'iotk_link'
+                values = [str(b.getAttribute(attrname)).rstrip().replace('\n','')
+                          for b in datafiles]
+                eigenval_files.append([os.path.join(dir_with_bands,value)
+                                       for value in values])
+
+            if len(set(len(_) for _ in eigenval_files)) > 1:
+                raise QEOutputParsingError('Spin components of the k-points do not match')
+
+            # one list of files for each spin component
+            bands,occupations = read_eigenval_files(zip(*eigenval_files),
+                                                    eigenval_threads)
 
             bands_dict['occupations'] = occupations
             bands_dict['bands'] = bands
@@ -1074,21 +1324,46 @@ def parse_pw_xml_output(data,dir_with_bands=None):
 #                 parsed_data['lumo'+units_suffix] = default_energy_units
 
     # CARD symmetries
-    parsed_data = copy.deepcopy(xml_card_symmetries(parsed_data,dom))
+    if 'symmetries' not in exclude:
+        parsed_data = xml_card_symmetries(parsed_data,dom)
 
     # CARD EXCHANGE_CORRELATION
-    parsed_data = copy.deepcopy(xml_card_exchangecorrelation(parsed_data,dom))
+    parsed_data = xml_card_exchangecorrelation(parsed_data,dom)
 
     return parsed_data,structure_dict,bands_dict
 
-def parse_pw_text_output(data, xml_data={}, structure_data={}, input_dict={}):
+# critical warnings: if any is found, the calculation status is FAILED
+pw_critical_warnings = {'The maximum number of steps has been reached.':"The maximum step of the ionic/electronic relaxation has been reached.",
+                        'convergence NOT achieved after':"The scf cycle did not reach convergence.",
+                        #'eigenvalues not converged':None, # special treatment
+                        'iterations completed, stopping':'Maximum number of iterations reached in Wentzcovitch Damped Dynamics.',
+                        'Maximum CPU time exceeded':'Maximum CPU time exceeded',
+                        '%%%%%%%%%%%%%%':None,
+                        }
+
+pw_minor_warnings = {'Warning:':None,
+                     'DEPRECATED:':None,
+                     'incommensurate with FFT grid':'The FFT is incommensurate: some symmetries may be lost.',
+                     'SCF correction compared to forces is too large, reduce conv_thr':"Forces are inaccurate (SCF correction is large): reduce conv_thr.",
+                     }
+
+pw_all_warnings = dict(pw_critical_warnings.items() + pw_minor_warnings.items())
+
+pw_warnings_scanner = QEWarningScanner(pw_all_warnings)
+
+def parse_pw_text_output(data, xml_data={}, structure_data={}, input_dict={}, exclude=()):
     """
     Parses the text output of QE-PWscf.
 
-    :param data: a string, the file as read by read()
+    :param data: the output, either as a string (the file as read by read())
+                 or as an iterable of lines, like the open file itself:
+                 in the latter case the file is streamed and never loaded
+                 in memory as a whole
     :param xml_data: the dictionary with the keys read from xml.
     :param structure_data: dictionary, coming from the xml, with info on the structure
     :param input_dict: dictionary with the input parameters
+    :param exclude: list of the sections not to be parsed, see
+                    PwTextOutputParser._sections
 
     :return parsed_data: dictionary with key values, referring to quantities
                          at the last scf step.
@@ -1098,657 +1373,1276 @@ def parse_pw_text_output(data, xml_data={}, structure_data={}, input_dict={}):
     :return critical_messages: a list with critical messages. If any is found in
                                parsed_data['warnings'], the calculation is FAILED!
     """
-    # Separate the input string into separate lines
-    data_lines = data.split('\n')
+    if isinstance(data, basestring):
+        data = data.split('\n')
 
-    parsed_data = {}
-    parsed_data['warnings'] = []
-    vdw_correction = False
-    trajectory_data = {}
-
-    # critical warnings: if any is found, the calculation status is FAILED
-    critical_warnings = {'The maximum number of steps has been reached.':"The maximum step of the ionic/electronic relaxation has been reached.",
-                         'convergence NOT achieved after':"The scf cycle did not reach convergence.",
-                         #'eigenvalues not converged':None, # special treatment
-                         'iterations completed, stopping':'Maximum number of iterations reached in Wentzcovitch Damped Dynamics.',
-                         'Maximum CPU time exceeded':'Maximum CPU time exceeded',
-                         '%%%%%%%%%%%%%%':None,
-                         }
-
-    minor_warnings = {'Warning:':None,
-                      'DEPRECATED:':None,
-                      'incommensurate with FFT grid':'The FFT is incommensurate: some symmetries may be lost.',
-                      'SCF correction compared to forces is too large, reduce conv_thr':"Forces are inaccurate (SCF correction is large): reduce conv_thr.",
-                      }
-
-    all_warnings = dict(critical_warnings.items() + minor_warnings.items())
-
-    # Find some useful quantities.
-    if not xml_data.get('number_of_bands',None) and not structure_data:
+    text_parser = PwTextOutputParser(xml_data, structure_data, input_dict, exclude)
+    text_parser.feed(data)
+    return text_parser.close()
+
+class TrajectoryBuffer(object):
+    """
+    A list of values with the same shape (e.g. the forces at each ionic
+    step), stored in a numpy array that is grown geometrically as values
+    are appended, so that no nested lists are built while parsing.
+
+    Indexing returns python objects (e.g. buf[-1] is a float, or a list of
+    lists), like a list would; numpy.asarray(buf) gives the array with all
+    the values, without copies. If a value with a different shape is
+    appended, the buffer falls back to a plain list of values.
+    """
+
+    def __init__(self, initial_capacity=16):
+        self._capacity = initial_capacity
+        self._data = None
+        self._length = 0
+        self._list = None
+
+    def append(self, value):
+        if self._list is not None:
+            self._list.append(value)
+            return
+
+        value_array = numpy.asarray(value)
+        if self._data is None:
+            if value_array.dtype.kind not in 'biuf':
+                self._list = [value]
+                return
+            self._data = numpy.empty((self._capacity,) + value_array.shape,
+                                     dtype=value_array.dtype)
+        elif value_array.shape != self._data.shape[1:]:
+            self._list = self.tolist() + [value]
+            self._data = None
+            return
+        elif not numpy.can_cast(value_array.dtype, self._data.dtype):
+            if value_array.dtype.kind not in 'biuf':
+                self._list = self.tolist() + [value]
+                self._data = None
+                return
+            self._data = self._data.astype(
+                numpy.result_type(self._data, value_array))
+
+        if self._length == len(self._data):
+            new_data = numpy.empty((2*len(self._data),) + self._data.shape[1:],
+                                   dtype=self._data.dtype)
+            new_data[:self._length] = self._data
+            self._data = new_data
+        self._data[self._length] = value_array
+        self._length += 1
+
+    def __len__(self):
+        if self._list is not None:
+            return len(self._list)
+        return self._length
+
+    def __getitem__(self, index):
+        if self._list is not None:
+            return self._list[index]
+        if isinstance(index, slice):
+            return self._data[:self._length][index].tolist()
+        if index < 0:
+            index += self._length
+        if not 0 <= index < self._length:
+            raise IndexError("list index out of range")
+        return self._data[index].tolist()
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+    def __eq__(self, other):
+        return self.tolist() == list(other)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return 'TrajectoryBuffer({!r})'.format(self.tolist())
+
+    def __array__(self, dtype=None):
+        if self._list is not None:
+            array = numpy.array(self._list)
+        elif self._data is None:
+            array = numpy.array([])
+        else:
+            array = self._data[:self._length]
+        if dtype is not None:
+            array = array.astype(dtype, copy=False)
+        return array
+
+    def extend(self, values):
+        for value in values:
+            self.append(value)
+
+    def tolist(self):
+        """
+        :return: the values, as a list of python objects
+        """
+        if self._list is not None:
+            return list(self._list)
+        if self._data is None:
+            return []
+        return self._data[:self._length].tolist()
+
+class PwTextOutputParser(object):
+    """
+    Single-pass parser of the text output of QE-PWscf, used by
+    parse_pw_text_output().
+
+    The lines of the output are passed to feed(), in one or more calls (e.g.
+    the open file, that is read line by line), and the parsed dictionaries
+    are returned by close(). Every line is checked once against
+    a regular expression matching all the known markers: the (few) lines that
+    match are dispatched to the handlers of the _header_handlers (only if the
+    xml data is missing), _global_handlers and _step_handlers tables. The
+    first table that matches wins, in the order in which they are listed.
+    The step handlers only see the lines of the ionic steps, i.e. the text
+    following each 'Self-consistent Calculation'.
+
+    Handlers that need the lines following the marker start a generator, that
+    is sent the next lines until it returns. When the end of the file (or of
+    the ionic step, for step handlers) is reached, an IndexError is raised
+    inside the generators that are still waiting for lines.
+    Quantities that are found looking backwards from a marker (e.g. the
+    diagonalization threshold, the magnetic moments) are instead tracked while
+    reading, and the last value seen is used.
+
+    The output of a running calculation can be followed by calling update()
+    (or feed_data(), with the newly appended text) from time to time: only
+    the new part of the file is parsed, and trajectory_data and
+    current_warnings() are updated as the steps are completed. The state
+    lives in the generators of this instance, so it is resumable only within
+    the same process (it cannot be pickled).
+    """
+    _step_separator = 'Self-consistent Calculation'
+
+    # (marker, method) in order of priority
+    _header_handlers = [
+        ('lattice parameter (alat)', '_handle_header_alat'),
+        ('number of atoms/cell', '_handle_header_nat'),
+        ('number of atomic types', '_handle_header_ntyp'),
+        ('unit-cell volume', '_handle_header_volume'),
+        ('number of Kohn-Sham states', '_handle_header_nbnd'),
+        ('number of k points', '_handle_header_nk'),
+        ('Dense  grid', '_handle_header_fft_grid'),
+        ('Smooth grid', '_handle_header_smooth_fft_grid'),
+        ]
+
+    _global_handlers = [
+        ('Carrying out vdW-DF run using the following parameters:', '_handle_vdw'),
+        ('Cartesian axes', '_handle_cartesian_axes'),
+        ('total cpu time spent up to now is', '_handle_init_wall_time'),
+        ('PWSCF', '_handle_wall_time'),
+        ('SUMMARY OF PHASES', '_handle_phases'),
+        ('nstep', '_handle_nstep'),
+        ('point group', '_handle_point_group'),
+        ('c_bands', '_handle_c_bands'),
+        ('iteration #', '_handle_scf_iteration'),
+        ] + list((marker, '_handle_warning') for marker in pw_all_warnings)
+
+    _step_handlers = [
+        ('CELL_PARAMETERS', '_handle_cell_parameters'),
+        ('ATOMIC_POSITIONS', '_handle_atomic_positions'),
+        ('Computed dipole along edir', '_handle_dipole'),
+        ('convergence has been achieved in', '_handle_scf_convergence'),
+        ('convergence NOT achieved after', '_handle_scf_convergence'),
+        ('End of self-consistent calculation', '_handle_end_of_scf'),
+        ('!', '_handle_energy'),
+        ('the Fermi energy is', '_handle_fermi_energy'),
+        ('Forces acting on atoms (Ry/au):', '_handle_forces'),
+        ('Total force =', '_handle_total_force'),
+        ('entering subroutine stress ...', '_handle_stress'),
+        ]
+
+    # lines remembered while reading the ionic steps, for the handlers that
+    # look backwards
+    _step_trackers = ['ethr', 'Magnetic moment per site', 'iteration',
+                      'Non-local correlation energy']
+
+    _energy_terms = [
+        ['one-electron contribution','energy_one_electron'],
+        ['hartree contribution','energy_hartree'],
+        ['xc contribution','energy_xc'],
+        ['ewald contribution','energy_ewald'],
+        ['smearing contrib.','energy_smearing'],
+        ['one-center paw contrib.','energy_one_center_paw'],
+        ['est. exchange err','energy_est_exchange'],
+        ['Fock energy','energy_fock'],
+        # Add also ENVIRON specific contribution to the total energy
+        ['solvation energy','energy_solvation'],
+        ['cavitation energy','energy_cavitation'],
+        ['PV energy', 'energy_pv'],
+        ['periodic energy correct.','energy_pbc_correction'],
+        ['ionic charge energy','energy_ionic_charge'],
+        ['external charges energy','energy_external_charges']
+        ]
+
+    _markers_re = re.compile(markers_regex(
+        [handler[0] for handler in _header_handlers + _global_handlers + _step_handlers]
+        + _step_trackers + [_step_separator, 'JOB DONE']))
+
+    # the sections that can be skipped, with the markers of their lines
+    _sections = {
+        'symmetries': ['point group'],
+        'magnetic_moments': ['Magnetic moment per site'],
+        'forces': ['Forces acting on atoms (Ry/au):', 'Total force ='],
+        'stress': ['entering subroutine stress ...'],
+        'polarization': ['SUMMARY OF PHASES'],
+        'dipole': ['Computed dipole along edir'],
+        }
+
+    # regular expressions of the markers, for each set of excluded markers
+    _markers_re_cache = {}
+
+    def __init__(self, xml_data={}, structure_data={}, input_dict={}, exclude=()):
+        """
+        :param exclude: the names of the sections (keys of _sections) to skip:
+            their markers are removed from the tables of this instance, so
+            that their lines are not even matched. Other names (e.g. 'bands',
+            read only from the xml) are ignored
+        """
+        self.input_dict = input_dict
+        self._exclude = tuple(exclude)
+        self._excluded_markers = frozenset(marker for section in self._exclude
+                                           for marker in self._sections.get(section, []))
+        if self._excluded_markers:
+            for table in ['_header_handlers', '_global_handlers', '_step_handlers']:
+                setattr(self, table, [handler for handler in getattr(self, table)
+                                      if handler[0] not in self._excluded_markers])
+            self._step_trackers = [marker for marker in self._step_trackers
+                                   if marker not in self._excluded_markers]
+            self._markers_re = self._get_markers_re(self._excluded_markers)
+
+        self.parsed_data = {}
+        self.trajectory_data = {}
+        self.job_done = False
+        self.number_of_lines = 0
+        # bytes of the output read so far (see feed_data), and the last
+        # line if incomplete
+        self.offset = 0
+        self._incomplete_line = ''
+
+        # if the xml was not parsed, the basic quantities are read from the
+        # header of the text output
+        self._from_header = (not xml_data.get('number_of_bands',None)
+                             and not structure_data)
+        self._header = {}
+        if self._from_header:
+            self.nat = None
+        else:
+            self.nat = structure_data['number_of_atoms']
+            self._header = {'nat': structure_data['number_of_atoms'],
+                            'ntyp': structure_data['number_of_species'],
+                            'nbnd': xml_data['number_of_bands'],
+                            'alat': structure_data['lattice_parameter_xml'],
+                            'volume': structure_data['cell']['volume']}
+
+        self._vdw_correction = False
+        self._c_bands_error = False
+        self._max_dynamic_iterations = None
+        self._lattice_parameter_b = None
+
+        # warnings found in the whole file, and in the ionic steps. The
+        # latter are stored with the line where they were triggered, as they
+        # may be found later, and are returned in that order.
+        # If the basic info is not found in the header, _basic_warnings are
+        # the only ones returned
+        self._warnings = []
+        self._step_warnings = []
+        self._basic_warnings = [] if self._from_header else None
+
+        self._global_collectors = []
+        self._step_collectors = None # None until the first ionic step
+        self._step_state = None
+
+    def feed(self, lines):
+        """
+        Parse the next lines of the output.
+
+        :param lines: an iterable of lines (e.g. an open file), with or
+            without the trailing newline
+        """
+        search = self._markers_re.search
+        send = self._send
+        for line in lines:
+            line = line.rstrip('\n')
+            self.number_of_lines += 1
+
+            if self._global_collectors:
+                self._global_collectors = send(self._global_collectors, line)
+
+            if search(line) is None:
+                if self._step_collectors:
+                    self._step_collectors = send(self._step_collectors, line)
+            else:
+                self._feed_marker_line(line)
+
+    def feed_data(self, data):
+        """
+        Parse the next chunk of the output, e.g. the text appended to the
+        file of a running calculation. The last line, if not terminated by
+        a newline, is kept and completed by the next calls.
+
+        :param data: a string
+        """
+        self.offset += len(data)
+        lines = (self._incomplete_line + data).split('\n')
+        self._incomplete_line = lines.pop()
+        self.feed(lines)
+
+    def update(self, filename):
+        """
+        Parse the text appended to the output file since the last call
+        (or from the beginning).
+
+        :param filename: the path of the output file
+        :return: the number of bytes read
+        """
+        with open(filename, 'rb') as f:
+            f.seek(0, os.SEEK_END)
+            if f.tell() < self.offset:
+                raise QEOutputParsingError("The file {} is shorter than the "
+                    "part already parsed".format(filename))
+            f.seek(self.offset)
+            data = f.read()
+        self.feed_data(data)
+        return len(data)
+
+    def feed_file(self, filename, num_workers=None):
+        """
+        Parse a whole output file (with a parser that was not fed before).
+
+        With num_workers > 1, the file is first scanned for the ionic steps
+        (see index_pw_ionic_steps), the header is parsed here and the steps
+        are split in consecutive blocks, parsed by a pool of num_workers
+        processes; the results are then merged in order, as if the file had
+        been read line by line. The parsing falls back to serial if there
+        are less than two ionic steps, or if the header is not complete.
+
+        :param filename: the path of the output file
+        :param num_workers: the number of processes (default: serial parsing)
+        """
+        import multiprocessing
+
+        with open(filename, 'r') as f:
+            if not num_workers or num_workers < 2:
+                self.feed(f)
+                return
+
+            step_starts, step_lines, num_lines = index_pw_ionic_steps(
+                filename, self._step_separator)
+            if len(step_starts) < 2:
+                self.feed(f)
+                return
+
+            header_lines = f.read(step_starts[0]).split('\n')
+            header_lines.pop() # the header ends with a newline
+            self.feed(header_lines)
+            if (self._global_collectors or self._basic_warnings is not None
+                or (self._from_header and 'smooth_fft_grid' not in self._header)):
+                # the steps need lines (or values) of the header not read yet
+                self.feed(f)
+                return
+
+        state = {'input_dict': self.input_dict,
+                 '_exclude': self._exclude,
+                 '_from_header': self._from_header,
+                 '_header': self._header,
+                 'nat': self.nat,
+                 '_vdw_correction': self._vdw_correction,
+                 '_max_dynamic_iterations': self._max_dynamic_iterations,
+                 '_lattice_parameter_b': self._lattice_parameter_b}
+        num_blocks = min(len(step_starts), 4*num_workers)
+        first_steps = [len(step_starts)*i//num_blocks for i in range(num_blocks)]
+        ends = [step_starts[i] for i in first_steps[1:]] + [None]
+        tasks = [(filename, step_starts[i], end, step_lines[i], state)
+                 for i, end in zip(first_steps, ends)]
+
+        pool = multiprocessing.Pool(num_workers)
         try:
-            for line in data.split('\n'):
-                if 'lattice parameter (alat)' in line:
-                    alat = float(line.split('=')[1].split('a.u')[0])
-                elif 'number of atoms/cell' in line:
-                    nat = int(line.split('=')[1])
-                elif 'number of atomic types' in line:
-                    ntyp = int(line.split('=')[1])
-                elif 'unit-cell volume' in line:
-                    volume = float(line.split('=')[1].split('(a.u.)^3')[0])
-                elif 'number of Kohn-Sham states' in line:
-                    nbnd = int(line.split('=')[1])
-                elif "number of k points" in line:
-                    nk = int(line.split('=')[1].split()[0])
-                    if input_dict.get('SYSTEM',{}).get('nspin',1) > 1:
-                        # QE counts twice each k-point in spin-polarized calculations
-                        nk /= 2
-                elif "Dense  grid" in line:
-                    FFT_grid = [int(g) for g in
-                                line.split('(')[1].split(')')[0].split(',')]
-                elif "Smooth grid" in line:
-                    smooth_FFT_grid = [int(g) for g in
-                                       line.split('(')[1].split(')')[0].split(',')]
+            results = pool.map(_parse_pw_text_block, tasks)
+        finally:
+            pool.terminate()
+            pool.join()
+
+        for result in results:
+            self._merge_block(result)
+        self.number_of_lines = num_lines
+
+    def _merge_block(self, result):
+        """
+        Add the results of a block of ionic steps, parsed by
+        _parse_pw_text_block(), to those of the previous blocks.
+        """
+        for key, values in result['trajectory_data'].iteritems():
+            if isinstance(values, TrajectoryBuffer):
+                self.trajectory_data.setdefault(key, TrajectoryBuffer()).extend(values)
+            else:
+                self.trajectory_data[key] = values
+
+        for key, value in result['parsed_data'].iteritems():
+            if key == 'total_number_of_scf_iterations':
+                self.parsed_data[key] = self.parsed_data.get(key, 0) + value
+            elif key == 'init_wall_time_seconds':
+                # only the first occurence is taken
+                self.parsed_data.setdefault(key, value)
+            else:
+                self.parsed_data[key] = value
+
+        self._warnings.extend(result['warnings'])
+        self._step_warnings.extend(result['step_warnings'])
+        if result['c_bands_error'] is not None:
+            self._c_bands_error = result['c_bands_error']
+        self.job_done = self.job_done or result['job_done']
+
+    def current_warnings(self):
+        """
+        The warnings found so far, without closing the parser, e.g. to check
+        if a running calculation is going wrong.
+
+        :return: a list of strings
+        """
+        warnings = list(self._warnings)
+        if self._c_bands_error:
+            warnings.append("c_bands: at least 1 eigenvalues not converged")
+        warnings += [message for position, message in
+                     sorted(self._step_warnings, key=lambda w: w[0])]
+        return warnings
+
+    def _feed_marker_line(self, line):
+        if 'JOB DONE' in line:
+            self.job_done = True
+
+        if self._from_header and 'smooth_fft_grid' not in self._header:
+            # the header ends with the smooth grid
+            self._dispatch(self._header_handlers, line)
+            if self._header.get('nat') is not None:
+                self.nat = self._header['nat']
+
+        self._dispatch(self._global_handlers, line)
+
+        if self._basic_warnings is not None:
+            self._parse_basic_warnings(line)
+
+        # the ionic steps are separated by 'Self-consistent Calculation',
+        # that might be in the middle of a line
+        pieces = line.split(self._step_separator)
+        if self._step_collectors is not None:
+            self._feed_step(pieces[0])
+        for piece in pieces[1:]:
+            self._close_step()
+            self._step_collectors = []
+            self._step_state = {'ethr': None, 'magnetic_moments': None,
+                                'nonlocal_energy': None, 'at_close': []}
+            self._feed_step(piece)
+
+    def close(self):
+        """
+        Signal that the output is finished, and return the parsed data.
+
+        :return parsed_data, trajectory_data, critical_messages: see
+            parse_pw_text_output()
+        """
+        if self._incomplete_line:
+            self.feed([self._incomplete_line])
+            self._incomplete_line = ''
+        self._close_step()
+        self._throw_end(self._global_collectors)
+        self._global_collectors = []
+
+        parsed_data = self.parsed_data
+        header = self._header
+
+        warnings = []
+        if self._from_header:
+            if header.get('alat') is not None and header.get('volume') is not None:
+                parsed_data['lattice_parameter_initial'] = header['alat']*bohr_to_ang
+                warnings.append('Xml data not found: parsing only the text output')
+
+            if (header.get('alat') is None or header.get('volume') is None
+                or header.get('nbnd') is None):
+                # the basic info was not found: return only the error messages
+                basic_data = {'warnings': warnings + self._basic_warnings}
+                if 'lattice_parameter_initial' in parsed_data:
+                    basic_data['lattice_parameter_initial'] = parsed_data['lattice_parameter_initial']
+                if len(basic_data['warnings'])>0:
+                    return basic_data, {}, pw_critical_warnings.values()
+                else:
+                    # did not find any error message -> raise an Error and do not
+                    # return anything
+                    raise QEOutputParsingError("Parser can't load basic info.")
+
+            parsed_data['number_of_bands'] = header['nbnd']
+            # these are not crucial, so parsing does not fail if they are not found
+            for key, header_key in [('number_of_k_points','nk'),
+                                    ('fft_grid','fft_grid'),
+                                    ('smooth_fft_grid','smooth_fft_grid')]:
+                if header.get(header_key) is None:
                     break
-            alat *= bohr_to_ang
-            volume *= bohr_to_ang**3
-            parsed_data['lattice_parameter_initial'] = alat
-            parsed_data['warnings'].append('Xml data not found: parsing only the text output')
-            parsed_data['number_of_bands'] = nbnd
+                parsed_data[key] = header[header_key]
+
+            if header.get('nat') is None or header.get('ntyp') is None:
+                raise QEOutputParsingError("Parser can't load basic info.")
+
+        # Save these two quantities in the parsed_data, because they will be
+        # useful for queries (maybe), and structure_data will not be stored as a ParameterData
+        parsed_data['number_of_atoms'] = header['nat']
+        parsed_data['number_of_species'] = header['ntyp']
+        parsed_data['volume'] = self._get_volume()
+
+        parsed_data['warnings'] = warnings + self.current_warnings()
+
+        return parsed_data, self.trajectory_data, pw_critical_warnings.values()
+
+    @classmethod
+    def _get_markers_re(cls, excluded_markers):
+        try:
+            return cls._markers_re_cache[excluded_markers]
+        except KeyError:
+            pass
+        markers = [handler[0] for handler in cls._header_handlers +
+                   cls._global_handlers + cls._step_handlers] + cls._step_trackers
+        markers = [marker for marker in markers if marker not in excluded_markers]
+        markers_re = re.compile(markers_regex(markers + [cls._step_separator, 'JOB DONE']))
+        cls._markers_re_cache[excluded_markers] = markers_re
+        return markers_re
+
+    def _get_alat(self):
+        """
+        The lattice parameter, in angstrom if read from the header, or in the
+        units of the xml (lattice_parameter_xml) otherwise.
+        """
+        if self._from_header:
+            return self._header['alat']*bohr_to_ang
+        return self._header['alat']
+
+    def _get_volume(self):
+        if self._from_header:
+            return self._header['volume']*bohr_to_ang**3
+        return self._header['volume']
+
+    # Machinery
+
+    def _dispatch(self, handlers, line):
+        for marker, method in handlers:
+            if marker in line:
+                if getattr(self, method)(line) is not False:
+                    return True
+        return False
+
+    @staticmethod
+    def _send(collectors, line):
+        """
+        Send a line to the generators, returns those still waiting for lines.
+        """
+        alive = []
+        for collector in collectors:
+            try:
+                collector.send(line)
+            except StopIteration:
+                continue
+            alive.append(collector)
+        return alive
+
+    @staticmethod
+    def _start(collectors, collector):
+        """
+        Start a generator and add it to the list, if it needs more lines.
+        """
+        try:
+            next(collector)
+        except StopIteration:
+            return
+        collectors.append(collector)
+
+    @staticmethod
+    def _throw_end(collectors):
+        """
+        Tell the generators that there are no more lines.
+        """
+        for collector in collectors:
             try:
-                parsed_data['number_of_k_points'] = nk
-                parsed_data['fft_grid'] = FFT_grid
-                parsed_data['smooth_fft_grid'] = smooth_FFT_grid
-            except NameError:
-                # these are not crucial, so parsing does not fail if they are not found
+                collector.throw(IndexError)
+            except (StopIteration, IndexError):
                 pass
-        except NameError: # nat or other variables where not found, and thus not initialized
-            # try to get some error message
-            for count,line in enumerate(data.split('\n')):
-                if any( i in line for i in all_warnings):
-                    messages = [ all_warnings[i] if all_warnings[i] is not None
-                                    else line for i in all_warnings.keys()
-                                    if i in line]
-
-                    if '%%%%%%%%%%%%%%' in line:
-                        messages = parse_QE_errors(data.split('\n'),count,
-                                                   parsed_data['warnings'])
-
-                    # if it found something, add to log
-                    if len(messages)>0:
-                        parsed_data['warnings'].extend(messages)
-
-            if len(parsed_data['warnings'])>0:
-                return parsed_data, trajectory_data, critical_warnings.values()
-            else:
-                # did not find any error message -> raise an Error and do not
-                # return anything
-                raise QEOutputParsingError("Parser can't load basic info.")
-    else:
-        nat = structure_data['number_of_atoms']
-        ntyp = structure_data['number_of_species']
-        nbnd = xml_data['number_of_bands']
-        alat = structure_data['lattice_parameter_xml']
-        volume = structure_data['cell']['volume']
-    # NOTE: lattice_parameter_xml is the lattice parameter of the xml file
-    # in the units used by the code. lattice_parameter instead in angstroms.
 
-    # Save these two quantities in the parsed_data, because they will be
-    # useful for queries (maybe), and structure_data will not be stored as a ParameterData
-    parsed_data['number_of_atoms'] = nat
-    parsed_data['number_of_species'] = ntyp
-    parsed_data['volume'] = volume
+    def _feed_step(self, line):
+        if self._step_collectors:
+            self._step_collectors = self._send(self._step_collectors, line)
+
+        if self._markers_re.search(line) is None:
+            return
+
+        self._dispatch(self._step_handlers, line)
+
+        state = self._step_state
+        if 'ethr' in line:
+            state['ethr'] = line
+        if ('Magnetic moment per site' in line and
+            'Magnetic moment per site' in self._step_trackers):
+            moments = {'lines': [], 'store': False}
+            state['magnetic_moments'] = moments
+            self._start(self._step_collectors,
+                        self._collect_magnetic_moments(moments))
+        elif 'iteration' in line:
+            state['magnetic_moments'] = None
+        if 'Non-local correlation energy' in line:
+            state['nonlocal_energy'] = line
+
+    def _close_step(self):
+        if self._step_collectors is None:
+            return
+        self._throw_end(self._step_collectors)
+        self._step_collectors = []
+        for function in self._step_state['at_close']:
+            function()
+
+    def _step_warning(self, message, position=None):
+        if position is None:
+            position = self.number_of_lines
+        self._step_warnings.append((position, message))
+
+    def _append(self, key, value):
+        try:
+            self.trajectory_data[key].append(value)
+        except KeyError:
+            self.trajectory_data[key] = TrajectoryBuffer()
+            self.trajectory_data[key].append(value)
 
-    c_bands_error = False
+    # Header, read only if the xml is not available
 
-    # now grep quantities that can be considered isolated informations.
-    for count,line in enumerate(data_lines):
+    def _handle_header_alat(self, line):
+        self._header['alat'] = float(line.split('=')[1].split('a.u')[0])
 
-        # to be used for later
-        if 'Carrying out vdW-DF run using the following parameters:' in line:
-            vdw_correction=True
-
-#        # single information only. To check that is not an info of the input already.
-#        elif 'EXX-fraction' in line:
-#            parsed_data['exx_fraction'] = float( line.split()[-1] )
-
-        elif 'Cartesian axes' in line:
-            # this is the part when initial positions and chemical
-            # symbols are printed (they do not change during a run)
-            i = count+1
-            while i<count+10 and not('site n.' in data_lines[i] and
-                                      'atom' in data_lines[i]):
-                i += 1
-            if 'site n.' in data_lines[i] and 'atom' in data_lines[i]:
-                trajectory_data['atomic_species_name'] = \
-                    [data_lines[i+1+j].split()[1] for j in range(nat)]
+    def _handle_header_nat(self, line):
+        self._header['nat'] = int(line.split('=')[1])
 
-        # parse the initialization time (take only first occurence)
-        elif ('init_wall_time_seconds' not in parsed_data
-              and "total cpu time spent up to now is" in line):
-            init_time = float(line.split("total cpu time spent up to now is"
-                                         )[1].split('secs')[0])
-            parsed_data['init_wall_time_seconds'] = init_time
+    def _handle_header_ntyp(self, line):
+        self._header['ntyp'] = int(line.split('=')[1])
 
-        # parse the global file, for informations that are written only once
-        elif 'PWSCF' in line and 'WALL' in line:
-            try:
-                time = line.split('CPU')[1].split('WALL')[0]
-                parsed_data['wall_time'] = time
-            except Exception:
-                parsed_data['warnings'].append('Error while parsing wall time.')
-            try:
-                parsed_data['wall_time_seconds'] = convert_qe_time_to_sec(time)
-            except ValueError:
-                raise QEOutputParsingError("Unable to convert wall_time in seconds.")
+    def _handle_header_volume(self, line):
+        self._header['volume'] = float(line.split('=')[1].split('(a.u.)^3')[0])
 
-        elif 'SUMMARY OF PHASES' in line:
-            try:
-                j = 0
-                while True:
-                    j+=1
-                    if 'Ionic Phase' in data_lines[count+j]:
-                        value = float(data_lines[count+j].split(':')[1].split('(')[0])
-                        mod = int(data_lines[count+j].split('(mod')[1].split(')')[0])
-                        if mod != 2:
-                            raise QEOutputParsingError("Units for polarization phase not supported")
-                        parsed_data['ionic_phase'] = value
-                        parsed_data['ionic_phase'+units_suffix] = '2pi'
+    def _handle_header_nbnd(self, line):
+        self._header['nbnd'] = int(line.split('=')[1])
 
-                    if 'Electronic Phase' in data_lines[count+j]:
-                        value = float(data_lines[count+j].split(':')[1].split('(')[0])
-                        mod = int(data_lines[count+j].split('(mod')[1].split(')')[0])
-                        if mod != 2:
-                            raise QEOutputParsingError("Units for polarization phase not supported")
-                        parsed_data['electronic_phase'] = value
-                        parsed_data['electronic_phase'+units_suffix] = '2pi'
+    def _handle_header_nk(self, line):
+        nk = int(line.split('=')[1].split()[0])
+        if self.input_dict.get('SYSTEM',{}).get('nspin',1) > 1:
+            # QE counts twice each k-point in spin-polarized calculations
+            nk //= 2
+        self._header['nk'] = nk
 
-                    if 'Total Phase' in data_lines[count+j]:
-                        value = float(data_lines[count+j].split(':')[1].split('(')[0])
-                        mod = int(data_lines[count+j].split('(mod')[1].split(')')[0])
-                        if mod != 2:
-                            raise QEOutputParsingError("Units for polarization phase not supported")
-                        parsed_data['total_phase'] = value
-                        parsed_data['total_phase'+units_suffix] = '2pi'
-
-                    # TODO: decide a standard unit for e charge
-                    if "C/m^2" in data_lines[count+j]:
-                        value = float(data_lines[count+j].split('=')[1].split('(')[0])
-                        mod = float(data_lines[count+j].split('mod')[1].split(')')[0])
-                        units = data_lines[count+j].split(')')[1].strip()
-                        parsed_data['polarization'] = value
-                        parsed_data['polarization_module'] = mod
-                        parsed_data['polarization'+units_suffix] = default_polarization_units
-                        if 'C / m^2' not in default_polarization_units:
-                            raise  QEOutputParsingError("Units for polarization phase not supported")
-
-                    if 'polarization direction' in data_lines[count+j]:
-                        vec = [ float(s) for s in \
-                                data_lines[count+j].split('(')[1].split(')')[0].split(',') ]
-                        parsed_data['polarization_direction'] = vec
+    def _handle_header_fft_grid(self, line):
+        self._header['fft_grid'] = [int(g) for g in
+                                    line.split('(')[1].split(')')[0].split(',')]
 
-            except Exception:
-                warning = 'Error while parsing polarization.'
-                parsed_data['warnings'].append(warning)
+    def _handle_header_smooth_fft_grid(self, line):
+        self._header['smooth_fft_grid'] = [int(g) for g in
+                                           line.split('(')[1].split(')')[0].split(',')]
 
-        # for later control on relaxation-dynamics convergence
-        elif 'nstep' in line and '=' in line:
-            max_dynamic_iterations = int(line.split()[2])
+    def _parse_basic_warnings(self, line):
+        """
+        The error messages that are returned if the basic info is not found.
+        """
+        if pw_warnings_scanner.search(line):
+            warnings = self._basic_warnings
+            if '%%%%%%%%%%%%%%' in line:
+                self._start(self._global_collectors,
+                            self._collect_qe_errors(line, warnings))
+            else:
+                warnings.extend(pw_warnings_scanner.messages_in(line))
 
-        elif 'point group' in line:
-            if 'k-point group' not in line:
-                try:
-                    # Split line in components delimited by either space(s) or
-                    # parenthesis and filter out empty strings
-                    line_elems = filter(None, re.split(' +|\(|\)', line))
+        if all(self._header.get(key) is not None
+               for key in ['alat','volume','nbnd']):
+            # the header is complete: no need to keep them
+            self._basic_warnings = None
 
-                    pg_international = line_elems[-1]
-                    pg_schoenflies = line_elems[-2]
+    # Informations written once, or that do not depend on the ionic step
 
-                    parsed_data['pointgroup_international'] = pg_international
-                    parsed_data['pointgroup_schoenflies'] = pg_schoenflies
+    def _handle_vdw(self, line):
+        # to be used for later
+        self._vdw_correction = True
 
-                except Exception:
-                    warning = "Problem parsing point group, I found: {}".format(line.strip())
-                    parsed_data['warnings'].append(warning)
+    def _handle_cartesian_axes(self, line):
+        # this is the part when initial positions and chemical
+        # symbols are printed (they do not change during a run)
+        if self.nat is None:
+            return
+        self._start(self._global_collectors, self._collect_species_names())
 
-        # special parsing of c_bands error
-        elif 'c_bands' in line and 'eigenvalues not converged' in line:
-            c_bands_error = True
+    def _collect_species_names(self):
+        try:
+            for _ in range(9):
+                line = yield
+                if 'site n.' in line and 'atom' in line:
+                    break
+            else:
+                line = yield
+                if not ('site n.' in line and 'atom' in line):
+                    return
+            species_names = []
+            for _ in range(self.nat):
+                line = yield
+                species_names.append(line.split()[1])
+            self.trajectory_data['atomic_species_name'] = species_names
+        except IndexError:
+            pass
 
-        elif "iteration #" in line:
-            if ( ("Calculation restarted" not in line) and
-                 ("Calculation stopped" not in line) ):
-                try:
-                    parsed_data['total_number_of_scf_iterations'] += 1
-                except KeyError:
-                    parsed_data['total_number_of_scf_iterations'] = 1
-
-            if c_bands_error:
-                # if there is another iteration, c_bands is not necessarily a problem
-                # I put a warning only if c_bands error appears in the last iteration
-                c_bands_error = False
-
-        # Parsing of errors
-        elif any( i in line for i in all_warnings):
-            message = [ all_warnings[i] for i in all_warnings.keys() if i in line][0]
-            if message is None:
-                message = line
-
-            # if the run is a molecular dynamics, I ignore that I reached the
-            # last iteration step.
-            if ('The maximum number of steps has been reached.' in line and
-                'md' in input_dict.get('CONTROL',{}).get('calculation','')):
-                message = None
-
-            if 'iterations completed, stopping' in line:
-                value = message
-                message = None
-                if 'Wentzcovitch Damped Dynamics:' in line:
-                    dynamic_iterations = int(line.split()[3])
-                    if max_dynamic_iterations == dynamic_iterations:
-                        message = value
-
-#             if 'c_bands' and 'eigenvalues not converged' in line:
-#                 # even if some bands are not converged, this is a problem only
-#                 # if it happens at the last scf step
-#                 # start a loop to find the end of scf step
-#                 # if another iteration is found, no warning is needed
-#                 doloop = True
-#                 j = 0
-#                 while doloop:
-#                     line2 = data.split('\n')[count+j]
-#                     if "iteration #" in line2:
-#                         doloop = False
-#                         message = None
-#                     if "End of self-consistent calculation" in line2:
-#                         doloop = False # to prevent going until the end of file
-#                     j += 1
-#                     print count+j
+    def _handle_init_wall_time(self, line):
+        # parse the initialization time (take only first occurence)
+        if 'init_wall_time_seconds' in self.parsed_data:
+            return False
+        init_time = float(line.split("total cpu time spent up to now is"
+                                     )[1].split('secs')[0])
+        self.parsed_data['init_wall_time_seconds'] = init_time
 
-            if '%%%%%%%%%%%%%%' in line:
-                message  = None
-                messages = parse_QE_errors(data_lines,count,parsed_data['warnings'])
+    def _handle_wall_time(self, line):
+        # parse the global file, for informations that are written only once
+        if 'WALL' not in line:
+            return False
+        try:
+            time = line.split('CPU')[1].split('WALL')[0]
+            self.parsed_data['wall_time'] = time
+        except Exception:
+            self._warnings.append('Error while parsing wall time.')
+            return
+        try:
+            self.parsed_data['wall_time_seconds'] = convert_qe_time_to_sec(time)
+        except ValueError:
+            raise QEOutputParsingError("Unable to convert wall_time in seconds.")
+
+    def _handle_phases(self, line):
+        # the phases are read until the end of the file, or until an
+        # error, that always stops the reading
+        warning = 'Error while parsing polarization.'
+        self._warnings.append(warning)
+        self._start(self._global_collectors, self._collect_phases())
+
+    def _collect_phases(self):
+        parsed_data = self.parsed_data
+        try:
+            while True:
+                line = yield
+                for phase, key in [['Ionic Phase', 'ionic_phase'],
+                                   ['Electronic Phase', 'electronic_phase'],
+                                   ['Total Phase', 'total_phase']]:
+                    if phase in line:
+                        value = float(line.split(':')[1].split('(')[0])
+                        mod = int(line.split('(mod')[1].split(')')[0])
+                        if mod != 2:
+                            raise QEOutputParsingError("Units for polarization phase not supported")
+                        parsed_data[key] = value
+                        parsed_data[key+units_suffix] = '2pi'
+
+                # TODO: decide a standard unit for e charge
+                if "C/m^2" in line:
+                    value = float(line.split('=')[1].split('(')[0])
+                    mod = float(line.split('mod')[1].split(')')[0])
+                    units = line.split(')')[1].strip()
+                    parsed_data['polarization'] = value
+                    parsed_data['polarization_module'] = mod
+                    parsed_data['polarization'+units_suffix] = default_polarization_units
+                    if 'C / m^2' not in default_polarization_units:
+                        raise  QEOutputParsingError("Units for polarization phase not supported")
+
+                if 'polarization direction' in line:
+                    vec = [ float(s) for s in \
+                            line.split('(')[1].split(')')[0].split(',') ]
+                    parsed_data['polarization_direction'] = vec
+        except Exception:
+            pass
+
+    def _handle_nstep(self, line):
+        # for later control on relaxation-dynamics convergence
+        if '=' not in line:
+            return False
+        self._max_dynamic_iterations = int(line.split()[2])
 
-            # if it found something, add to log
+    def _handle_point_group(self, line):
+        if 'k-point group' not in line:
             try:
-                parsed_data['warnings'].extend(messages)
-            except UnboundLocalError:
-                pass
-            if message is not None:
-                parsed_data['warnings'].append(message)
+                # Split line in components delimited by either space(s) or
+                # parenthesis and filter out empty strings
+                line_elems = filter(None, re.split(' +|\(|\)', line))
 
-    if c_bands_error:
-        parsed_data['warnings'].append("c_bands: at least 1 eigenvalues not converged")
+                pg_international = line_elems[-1]
+                pg_schoenflies = line_elems[-2]
 
+                self.parsed_data['pointgroup_international'] = pg_international
+                self.parsed_data['pointgroup_schoenflies'] = pg_schoenflies
 
-    # I split the output text in the atomic SCF calculations.
-    # the initial part should be things already contained in the xml.
-    # (cell, initial positions, kpoints, ...) and I skip them.
-    # In case, parse for them before this point.
-    # Put everything in a trajectory_data dictionary
-    relax_steps = data.split('Self-consistent Calculation')[1:]
-    relax_steps = [ i.split('\n') for i in relax_steps]
+            except Exception:
+                warning = "Problem parsing point group, I found: {}".format(line.strip())
+                self._warnings.append(warning)
 
+    def _handle_c_bands(self, line):
+        # special parsing of c_bands error
+        if 'eigenvalues not converged' not in line:
+            return False
+        self._c_bands_error = True
 
-    # now I create a bunch of arrays for every step.
-    for data_step in relax_steps:
-        for count,line in enumerate(data_step):
+    def _handle_scf_iteration(self, line):
+        if ( ("Calculation restarted" not in line) and
+             ("Calculation stopped" not in line) ):
+            try:
+                self.parsed_data['total_number_of_scf_iterations'] += 1
+            except KeyError:
+                self.parsed_data['total_number_of_scf_iterations'] = 1
+
+        # if there is another iteration, c_bands is not necessarily a problem
+        # I put a warning only if c_bands error appears in the last iteration
+        self._c_bands_error = False
+
+    def _handle_warning(self, line):
+        message = pw_warnings_scanner.messages_in(line)[0]
+
+        # if the run is a molecular dynamics, I ignore that I reached the
+        # last iteration step.
+        if ('The maximum number of steps has been reached.' in line and
+            'md' in self.input_dict.get('CONTROL',{}).get('calculation','')):
+            message = None
+
+        if 'iterations completed, stopping' in line:
+            value = message
+            message = None
+            if 'Wentzcovitch Damped Dynamics:' in line:
+                dynamic_iterations = int(line.split()[3])
+                if self._max_dynamic_iterations == dynamic_iterations:
+                    message = value
+
+        if '%%%%%%%%%%%%%%' in line:
+            message = None
+            self._start(self._global_collectors,
+                        self._collect_qe_errors(line, self._warnings))
+
+        if message is not None:
+            self._warnings.append(message)
+
+    def _collect_qe_errors(self, line, warnings):
+        """
+        Collect the QE error message, between the line with ``'%%%%%%%%'``
+        and the next one, and insert it where the first line was found.
+        """
+        index = len(warnings)
+        problem = [line]
+        try:
+            while True:
+                line = yield
+                problem.append(line)
+                if "%%%%%%%%%%%%" in line:
+                    break
+        except IndexError:
+            # the endpoint was not found
+            return
+        warnings[index:index] = parse_QE_errors(problem, 0, warnings[:index])
 
-            if 'CELL_PARAMETERS' in line:
-                try:
-                    a1 = [float(s) for s in data_step[count+1].split()]
-                    a2 = [float(s) for s in data_step[count+2].split()]
-                    a3 = [float(s) for s in data_step[count+3].split()]
-                    # try except indexerror for not enough lines
-                    lattice = line.split('(')[1].split(')')[0].split('=')
-                    if lattice[0].lower() not in ['alat','bohr','angstrom']:
-                        raise QEOutputParsingError('Error while parsing cell_parameters: '+\
-                                                   'unsupported units {}'.format(lattice[0]) )
-
-                    if 'alat' in lattice[0].lower():
-                        a1 = [ alat*bohr_to_ang*float(s) for s in a1 ]
-                        a2 = [ alat*bohr_to_ang*float(s) for s in a2 ]
-                        a3 = [ alat*bohr_to_ang*float(s) for s in a3 ]
-                        lattice_parameter_b = float(lattice[1])
-                        if abs(lattice_parameter_b - alat) > lattice_tolerance:
-                            raise QEOutputParsingError("Lattice parameters mismatch! " + \
-                                                       "{} vs {}".format(lattice_parameter_b, alat))
-                    elif 'bohr' in lattice[0].lower():
-                        lattice_parameter_b*=bohr_to_ang
-                        a1 = [ bohr_to_ang*float(s) for s in a1 ]
-                        a2 = [ bohr_to_ang*float(s) for s in a2 ]
-                        a3 = [ bohr_to_ang*float(s) for s in a3 ]
-                    try:
-                        trajectory_data['lattice_vectors_relax'].append([a1,a2,a3])
-                    except KeyError:
-                        trajectory_data['lattice_vectors_relax'] = [[a1,a2,a3]]
+    # Ionic steps
 
-                except Exception:
-                    parsed_data['warnings'].append('Error while parsing relaxation cell parameters.')
+    def _handle_cell_parameters(self, line):
+        self._start(self._step_collectors, self._collect_cell_parameters(line))
 
-            elif 'ATOMIC_POSITIONS' in line:
-                try:
-                    this_key = 'atomic_positions_relax'
-                    #this_key_2 = 'atomic_species_name'
-                    # the inizialization of tau prevent parsed_data to be associated
-                    # to the pointer of the previous iteration
-                    metric = line.split('(')[1].split(')')[0]
-                    if metric not in ['alat','bohr','angstrom']:
-                        raise QEOutputParsingError('Error while parsing atomic_positions:'
-                                                   ' units not supported.')
-                    # TODO: check how to map the atoms in the original scheme
-                    positions = []
-                    #chem_symbols = []
-                    for i in range(nat):
-                        line2 = data_step[count+1+i].split()
-                        tau = [float(s) for s in line2[1:4]]
-                        #chem_symbol = str(line2[0]).rstrip()
-                        if metric == 'alat':
-                            tau = [ alat*float(s) for s in tau ]
-                        elif metric == 'bohr':
-                            tau = [ bohr_to_ang*float(s) for s in tau ]
-                        positions.append(tau)
-                        #chem_symbols.append(chem_symbol)
-                    try:
-                        trajectory_data[this_key].append(positions)
-                    except KeyError:
-                        trajectory_data[this_key] = [positions]
-                    #trajectory_data[this_key_2] = chem_symbols # the symbols do not change during a run
-                except Exception:
-                    parsed_data['warnings'].append('Error while parsing relaxation atomic positions.')
+    def _collect_cell_parameters(self, line):
+        position = self.number_of_lines
+        try:
+            a1 = [float(s) for s in (yield).split()]
+            a2 = [float(s) for s in (yield).split()]
+            a3 = [float(s) for s in (yield).split()]
+            # try except indexerror for not enough lines
+            lattice = line.split('(')[1].split(')')[0].split('=')
+            if lattice[0].lower() not in ['alat','bohr','angstrom']:
+                raise QEOutputParsingError('Error while parsing cell_parameters: '+\
+                                           'unsupported units {}'.format(lattice[0]) )
+
+            if 'alat' in lattice[0].lower():
+                alat = self._get_alat()
+                a1 = [ alat*bohr_to_ang*float(s) for s in a1 ]
+                a2 = [ alat*bohr_to_ang*float(s) for s in a2 ]
+                a3 = [ alat*bohr_to_ang*float(s) for s in a3 ]
+                self._lattice_parameter_b = float(lattice[1])
+                if abs(self._lattice_parameter_b - alat) > lattice_tolerance:
+                    raise QEOutputParsingError("Lattice parameters mismatch! " + \
+                                               "{} vs {}".format(self._lattice_parameter_b, alat))
+            elif 'bohr' in lattice[0].lower():
+                self._lattice_parameter_b*=bohr_to_ang
+                a1 = [ bohr_to_ang*float(s) for s in a1 ]
+                a2 = [ bohr_to_ang*float(s) for s in a2 ]
+                a3 = [ bohr_to_ang*float(s) for s in a3 ]
+            self._append('lattice_vectors_relax', [a1,a2,a3])
 
-            # NOTE: in the above, the chemical symbols are not those of AiiDA
-            # since the AiiDA structure is different. So, I assume now that the
-            # order of atoms is the same of the input atomic structure.
+        except Exception:
+            self._step_warning('Error while parsing relaxation cell parameters.', position)
 
-            # Computed dipole correction in slab geometries.
-            # save dipole in debye units, only at last iteration of scf cycle
-            elif 'Computed dipole along edir' in line:
-                j = count+3
-                line2 = data_step[j]
-                try:
-                    units = line2.split()[-1]
-                    if default_dipole_units.lower() not in units.lower(): # only debye
-                       raise QEOutputParsingError("Error parsing the dipole correction."
-                                                      " Units {} are not supported.".format(units))
-                    value = float(line2.split()[-2])
-                except IndexError: # on units
-                    pass
-                # save only the last dipole correction
-                while 'Computed dipole along edir' not in line2:
-                    j += 1
-                    try:
-                        line2 = data_step[j]
-                    except IndexError: # The dipole is also written at the beginning of a new bfgs iteration
-                        break
-                    if 'End of self-consistent calculation' in line2:
-                        try:
-                            trajectory_data['dipole'].append( value )
-                        except KeyError:
-                            trajectory_data['dipole'] = [value]
-                        parsed_data['dipole'+units_suffix] = default_dipole_units
-                        break
-
-            elif ('convergence has been achieved in' in line
-                  or 'convergence NOT achieved after' in line):
-                try:
-                    scf_iterations = int(line.split("iterations")[0].split()[-1])
-                    try:
-                        trajectory_data['scf_iterations'].append(scf_iterations)
-                    except KeyError:
-                        trajectory_data['scf_iterations'] = [scf_iterations]
-                except Exception:
-                    parsed_data['warnings'].append('Error while parsing scf iterations.')
+    def _handle_atomic_positions(self, line):
+        try:
+            # the inizialization of tau prevent parsed_data to be associated
+            # to the pointer of the previous iteration
+            metric = line.split('(')[1].split(')')[0]
+            if metric not in ['alat','bohr','angstrom']:
+                raise QEOutputParsingError('Error while parsing atomic_positions:'
+                                           ' units not supported.')
+        except Exception:
+            self._step_warning('Error while parsing relaxation atomic positions.')
+        else:
+            self._start(self._step_collectors,
+                        self._collect_atomic_positions(metric))
+
+    def _collect_atomic_positions(self, metric):
+        # NOTE: the chemical symbols are not those of AiiDA
+        # since the AiiDA structure is different. So, I assume now that the
+        # order of atoms is the same of the input atomic structure.
+        position = self.number_of_lines
+        try:
+            positions = []
+            for i in range(self.nat):
+                line2 = (yield).split()
+                tau = [float(s) for s in line2[1:4]]
+                if metric == 'alat':
+                    tau = [ self._get_alat()*float(s) for s in tau ]
+                elif metric == 'bohr':
+                    tau = [ bohr_to_ang*float(s) for s in tau ]
+                positions.append(tau)
+            self._append('atomic_positions_relax', positions)
+        except Exception:
+            self._step_warning('Error while parsing relaxation atomic positions.', position)
+
+    def _handle_dipole(self, line):
+        # Computed dipole correction in slab geometries.
+        # save dipole in debye units, only at last iteration of scf cycle
+        self._start(self._step_collectors, self._collect_dipole())
+
+    def _collect_dipole(self):
+        yield
+        yield
+        line = yield
+        value = None
+        try:
+            units = line.split()[-1]
+            if default_dipole_units.lower() not in units.lower(): # only debye
+                raise QEOutputParsingError("Error parsing the dipole correction."
+                                           " Units {} are not supported.".format(units))
+            value = float(line.split()[-2])
+        except IndexError: # on units
+            pass
+        # save only the last dipole correction
+        try:
+            while 'Computed dipole along edir' not in line:
+                line = yield
+                if 'End of self-consistent calculation' in line:
+                    if value is not None:
+                        self._append('dipole', value)
+                        self.parsed_data['dipole'+units_suffix] = default_dipole_units
+                    break
+        except IndexError: # The dipole is also written at the beginning of a new bfgs iteration
+            pass
 
-            elif 'End of self-consistent calculation' in line:
-                # parse energy threshold for diagonalization algorithm
-                try:
-                    j = 0
-                    while True:
-                        j -= 1
-                        line2 = data_step[count+j]
-                        if 'ethr' in line2:
-                            value = float(line2.split('=')[1].split(',')[0])
-                            break
-                    try:
-                        trajectory_data['energy_threshold'].append(value)
-                    except KeyError:
-                        trajectory_data['energy_threshold'] = [value]
-                except Exception:
-                    parsed_data['warnings'].append('Error while parsing ethr.')
+    def _handle_scf_convergence(self, line):
+        try:
+            scf_iterations = int(line.split("iterations")[0].split()[-1])
+            self._append('scf_iterations', scf_iterations)
+        except Exception:
+            self._step_warning('Error while parsing scf iterations.')
 
-                # parse final magnetic moments, if present
-                try:
-                    j = 0
-                    while True:
-                        j -= 1
-                        line2 = data_step[count+j]
-                        if 'Magnetic moment per site' in line2:
-                            break
-                        if 'iteration' in line2:
-                            raise QEOutputParsingError
-                    mag_moments = []
-                    charges = []
-                    while True:
-                        j += 1
-                        line2 = data_step[count+j]
-                        if 'atom:' in line2:
-                            mag_moments.append(float(line2.split('magn:')[1].split()[0]))
-                            charges.append(float(line2.split('charge:')[1].split()[0]))
-                        if len(mag_moments)==nat:
-                            break
-                    try:
-                        trajectory_data['atomic_magnetic_moments'].append(mag_moments)
-                        trajectory_data['atomic_charges'].append(charges)
-                    except KeyError:
-                        trajectory_data['atomic_magnetic_moments'] = [mag_moments]
-                        trajectory_data['atomic_charges'] = [charges]
-                    parsed_data['atomic_magnetic_moments'+units_suffix] = default_magnetization_units
-                    parsed_data['atomic_charges'+units_suffix] = default_charge_units
-                except QEOutputParsingError:
-                    pass
-
-            # grep energy and possibly, magnetization
-            elif '!' in line:
-                try:
-                    for key in ['energy','energy_accuracy']:
-                        if key not in trajectory_data:
-                            trajectory_data[key] = []
+    def _handle_end_of_scf(self, line):
+        state = self._step_state
+        position = self.number_of_lines
 
-                    En = float(line.split('=')[1].split('Ry')[0])*ry_to_ev
-                    E_acc = float(data_step[count+2].split('<')[1].split('Ry')[0])*ry_to_ev
+        # parse energy threshold for diagonalization algorithm
+        def store_energy_threshold():
+            try:
+                value = float(state['ethr'].split('=')[1].split(',')[0])
+                self._append('energy_threshold', value)
+            except Exception:
+                self._step_warning('Error while parsing ethr.', position)
 
-                    for key,value in [['energy',En],['energy_accuracy',E_acc]]:
-                        trajectory_data[key].append(value)
+        if state['ethr'] is not None:
+            store_energy_threshold()
+        else:
+            # it can only be found after this line
+            state['at_close'].append(store_energy_threshold)
+
+        # parse final magnetic moments, if present
+        moments = state['magnetic_moments']
+        if moments is not None:
+            if len(moments['lines']) == self.nat:
+                self._store_magnetic_moments(moments)
+            else:
+                moments['store'] = True
+
+    def _collect_magnetic_moments(self, moments):
+        # the lines are parsed only if stored, at the end of the scf cycle
+        while len(moments['lines']) < self.nat:
+            line = yield
+            if 'atom:' in line:
+                moments['lines'].append(line)
+        if moments['store']:
+            self._store_magnetic_moments(moments)
+
+    def _store_magnetic_moments(self, moments):
+        mag_moments = [float(line.split('magn:')[1].split()[0])
+                       for line in moments['lines']]
+        charges = [float(line.split('charge:')[1].split()[0])
+                   for line in moments['lines']]
+        self._append('atomic_magnetic_moments', mag_moments)
+        self._append('atomic_charges', charges)
+        self.parsed_data['atomic_magnetic_moments'+units_suffix] = default_magnetization_units
+        self.parsed_data['atomic_charges'+units_suffix] = default_charge_units
+
+    def _handle_energy(self, line):
+        # grep energy and possibly, magnetization
+        for key in ['energy','energy_accuracy']:
+            if key not in self.trajectory_data:
+                self.trajectory_data[key] = TrajectoryBuffer()
+        self._start(self._step_collectors, self._collect_energy(line))
+
+    def _collect_energy(self, line):
+        trajectory_data = self.trajectory_data
+        parsed_data = self.parsed_data
+        state = self._step_state
+        nonlocal_energy = state['nonlocal_energy']
+        position = self.number_of_lines
+        try:
+            En = float(line.split('=')[1].split('Ry')[0])*ry_to_ev
+            following = [(yield)]
+            following.append((yield))
+            E_acc = float(following[1].split('<')[1].split('Ry')[0])*ry_to_ev
+
+            for key,value in [['energy',En],['energy_accuracy',E_acc]]:
+                trajectory_data[key].append(value)
+                parsed_data[key+units_suffix] = default_energy_units
+            # TODO: decide units for magnetization. now bohr mag/cell
+            j = 0
+            while True:
+                if j < len(following):
+                    line2 = following[j]
+                else:
+                    line2 = yield
+                j += 1
+
+                for string,key in self._energy_terms:
+                    if string in line2:
+                        value = grep_energy_from_line(line2)
+                        self._append(key, value)
                         parsed_data[key+units_suffix] = default_energy_units
-                    # TODO: decide units for magnetization. now bohr mag/cell
-                    j = 0
-                    while True:
-                        j+=1
-                        line2 = data_step[count+j]
-
-                        for string,key in [
-                            ['one-electron contribution','energy_one_electron'],
-                            ['hartree contribution','energy_hartree'],
-                            ['xc contribution','energy_xc'],
-                            ['ewald contribution','energy_ewald'],
-                            ['smearing contrib.','energy_smearing'],
-                            ['one-center paw contrib.','energy_one_center_paw'],
-                            ['est. exchange err','energy_est_exchange'],
-                            ['Fock energy','energy_fock'],
-                            # Add also ENVIRON specific contribution to the total energy
-                            ['solvation energy','energy_solvation'],
-                            ['cavitation energy','energy_cavitation'],
-                            ['PV energy', 'energy_pv'],
-                            ['periodic energy correct.','energy_pbc_correction'],
-                            ['ionic charge energy','energy_ionic_charge'],
-                            ['external charges energy','energy_external_charges']
-                            ]:
-                            if string in line2:
-                                value = grep_energy_from_line(line2)
-                                try:
-                                    trajectory_data[key].append(value)
-                                except KeyError:
-                                    trajectory_data[key] = [value]
-                                parsed_data[key+units_suffix] = default_energy_units
-                        # magnetizations
-                        if 'total magnetization' in line2:
-                            this_m = line2.split('=')[1].split('Bohr')[0]
-                            try: # magnetization might be a scalar
-                                value = float(this_m)
-                            except ValueError: # but can also be a three vector component in non-collinear calcs
-                                value = [ float(i) for i in this_m.split() ]
-                            try:
-                                trajectory_data['total_magnetization'].append(value)
-                            except KeyError:
-                                trajectory_data['total_magnetization'] = [value]
-                            parsed_data['total_magnetization'+units_suffix] = default_magnetization_units
-                        elif 'absolute magnetization' in line2:
-                            value=float(line2.split('=')[1].split('Bohr')[0])
-                            try:
-                                trajectory_data['absolute_magnetization'].append(value)
-                            except KeyError:
-                                trajectory_data['absolute_magnetization'] = [value]
-                            parsed_data['absolute_magnetization'+units_suffix] = default_magnetization_units
-                        # exit loop
-                        elif 'convergence' in line2:
-                            break
-
-                    if vdw_correction:
-                        j=0
-                        while True:
-                            j+=-1
-                            line2 = data_step[count+j]
-                            if 'Non-local correlation energy' in line2:
-                                value = grep_energy_from_line(line2)
-                                try:
-                                    trajectory_data['energy_vdw'].append(value)
-                                except KeyError:
-                                    trajectory_data['energy_vdw'] = [value]
-                                break
-                        parsed_data['energy_vdw'+units_suffix] = default_energy_units
-                except Exception:
-                    parsed_data['warnings'].append('Error while parsing for energy terms.')
+                # magnetizations
+                if 'total magnetization' in line2:
+                    this_m = line2.split('=')[1].split('Bohr')[0]
+                    try: # magnetization might be a scalar
+                        value = float(this_m)
+                    except ValueError: # but can also be a three vector component in non-collinear calcs
+                        value = [ float(i) for i in this_m.split() ]
+                    self._append('total_magnetization', value)
+                    parsed_data['total_magnetization'+units_suffix] = default_magnetization_units
+                elif 'absolute magnetization' in line2:
+                    value=float(line2.split('=')[1].split('Bohr')[0])
+                    self._append('absolute_magnetization', value)
+                    parsed_data['absolute_magnetization'+units_suffix] = default_magnetization_units
+                # exit loop
+                elif 'convergence' in line2:
+                    break
+        except Exception:
+            self._step_warning('Error while parsing for energy terms.', position)
+            return
 
-            elif 'the Fermi energy is' in line:
+        if self._vdw_correction:
+            def store_vdw_energy(nonlocal_energy):
                 try:
-                    value = float(line.split('is')[1].split('ev')[0])
-                    try:
-                        trajectory_data['fermi_energy'].append(value)
-                    except KeyError:
-                        trajectory_data['fermi_energy'] = [value]
-                    parsed_data['fermi_energy'+units_suffix] = default_energy_units
+                    self._append('energy_vdw', grep_energy_from_line(nonlocal_energy))
+                    parsed_data['energy_vdw'+units_suffix] = default_energy_units
                 except Exception:
-                    parsed_data['warnings'].append('Error while parsing Fermi energy from the output file.')
+                    self._step_warning('Error while parsing for energy terms.', position)
 
+            if nonlocal_energy is not None:
+                store_vdw_energy(nonlocal_energy)
+            else:
+                # take the last one of the step, if none was printed before
+                state['at_close'].append(
+                    lambda: store_vdw_energy(state['nonlocal_energy']))
 
-            elif 'Forces acting on atoms (Ry/au):' in line:
-                try:
-                    forces = []
-                    j = 0
-                    while True:
-                        j+=1
-                        line2 = data_step[count+j]
-                        if 'atom ' in line2:
-                            line2 = line2.split('=')[1].split()
-                            # CONVERT FORCES IN eV/Ang
-                            vec = [ float(s)*ry_to_ev / \
-                                   bohr_to_ang for s in line2 ]
-                            forces.append(vec)
-                        if len(forces)==nat:
-                            break
-                    try:
-                        trajectory_data['forces'].append(forces)
-                    except KeyError:
-                        trajectory_data['forces'] = [forces]
-                    parsed_data['forces'+units_suffix] = default_force_units
-                except Exception:
-                    parsed_data['warnings'].append('Error while parsing forces.')
-
-            # TODO: adding the parsing support for the decomposition of the forces
-
-            elif 'Total force =' in line:
-                try: # note that I can't check the units: not written in output!
-                    value = float(line.split('=')[1].split('Total')[0])*ry_to_ev/bohr_to_ang
-                    try:
-                        trajectory_data['total_force'].append(value)
-                    except KeyError:
-                        trajectory_data['total_force'] = [value]
-                    parsed_data['total_force'+units_suffix] = default_force_units
-                except Exception:
-                    parsed_data['warnings'].append('Error while parsing total force.')
+    def _handle_fermi_energy(self, line):
+        try:
+            value = float(line.split('is')[1].split('ev')[0])
+            self._append('fermi_energy', value)
+            self.parsed_data['fermi_energy'+units_suffix] = default_energy_units
+        except Exception:
+            self._step_warning('Error while parsing Fermi energy from the output file.')
 
-            elif 'entering subroutine stress ...' in line:
-                try:
-                    stress = []
-                    for k in range (10+5*vdw_correction):
-                        if "P=" in data_step[count+k+1]:
-                            count2 = count+k+1
-                    if '(Ry/bohr**3)' not in data_step[count2]:
-                        raise QEOutputParsingError('Error while parsing stress: unexpected units.')
-                    for k in range(3):
-                        line2 = data_step[count2+k+1].split()
-                        vec = [ float(s)*10**(-9)*ry_si/(bohr_si)**3 for s in line2[0:3] ]
-                        stress.append(vec)
-                    try:
-                        trajectory_data['stress'].append(stress)
-                    except KeyError:
-                        trajectory_data['stress'] = [stress]
-                    parsed_data['stress'+units_suffix] = default_stress_units
-                except Exception:
-                    parsed_data['warnings'].append('Error while parsing stress tensor.')
+    def _handle_forces(self, line):
+        self._start(self._step_collectors, self._collect_forces())
 
-    return parsed_data, trajectory_data, critical_warnings.values()
+    def _collect_forces(self):
+        position = self.number_of_lines
+        try:
+            forces = []
+            while True:
+                line2 = yield
+                if 'atom ' in line2:
+                    line2 = line2.split('=')[1].split()
+                    # CONVERT FORCES IN eV/Ang
+                    vec = [ float(s)*ry_to_ev / \
+                           bohr_to_ang for s in line2 ]
+                    forces.append(vec)
+                if len(forces)==self.nat:
+                    break
+            self._append('forces', forces)
+            self.parsed_data['forces'+units_suffix] = default_force_units
+        except Exception:
+            self._step_warning('Error while parsing forces.', position)
+
+    # TODO: adding the parsing support for the decomposition of the forces
+
+    def _handle_total_force(self, line):
+        try: # note that I can't check the units: not written in output!
+            value = float(line.split('=')[1].split('Total')[0])*ry_to_ev/bohr_to_ang
+            self._append('total_force', value)
+            self.parsed_data['total_force'+units_suffix] = default_force_units
+        except Exception:
+            self._step_warning('Error while parsing total force.')
+
+    def _handle_stress(self, line):
+        self._start(self._step_collectors, self._collect_stress())
 
-def parse_QE_errors(lines,count,warnings):
+    def _collect_stress(self):
+        position = self.number_of_lines
+        try:
+            following = []
+            count2 = None
+            for k in range (10+5*self._vdw_correction):
+                following.append((yield))
+                if "P=" in following[k]:
+                    count2 = k
+            if count2 is None:
+                raise QEOutputParsingError('Error while parsing stress: pressure not found.')
+            if '(Ry/bohr**3)' not in following[count2]:
+                raise QEOutputParsingError('Error while parsing stress: unexpected units.')
+            while len(following) < count2+4:
+                following.append((yield))
+            stress = []
+            for k in range(3):
+                line2 = following[count2+k+1].split()
+                vec = [ float(s)*10**(-9)*ry_si/(bohr_si)**3 for s in line2[0:3] ]
+                stress.append(vec)
+            self._append('stress', stress)
+            self.parsed_data['stress'+units_suffix] = default_stress_units
+        except Exception:
+            self._step_warning('Error while parsing stress tensor.', position)
+
+# the sections that can be excluded from the parsing, see parse_raw_output
+pw_output_sections = ['bands'] + sorted(PwTextOutputParser._sections)
+
+def check_parser_options(parser_opts):
+    """
+    Check the values of the parser options of parse_raw_output that select
+    the parsing: the 'xml_backend' and the sections to 'exclude'.
+
+    :param parser_opts: dictionary of parser options
+    :raises QEOutputParsingError: if the backend or a section is unknown
+    """
+    xml_backend = parser_opts.get('xml_backend','minidom')
+    if xml_backend not in pw_xml_backends:
+        raise QEOutputParsingError("Unknown xml backend '{}', must be "
+            "among {}".format(xml_backend, ', '.join(pw_xml_backends)))
+
+    unknown_sections = set(parser_opts.get('exclude',[])) - set(pw_output_sections)
+    if unknown_sections:
+        raise QEOutputParsingError("Unknown sections to exclude: {}, must be "
+            "among {}".format(', '.join(sorted(unknown_sections)),
+                              ', '.join(pw_output_sections)))
+
+def index_pw_ionic_steps(filename, separator=PwTextOutputParser._step_separator):
     """
-    Parse QE errors messages (those appearing between some lines with
-    ``'%%%%%%%%'``)
-    :param lines: list of strings, the output text file as read by readlines()
-    or as obtained by data.split('\n') when data is the text file read by read()
-    :param count: the line at which we identified some ``'%%%%%%%%'``
-    :param warnings: the warnings already parsed in the file
-    :return messages: a list of QE error messages
+    Scan the text output of QE-PWscf for the ionic steps, without parsing it.
+
+    :param filename: the path of the output file
+    :param separator: the string starting each ionic step
+    :return step_starts: list with the byte offset of the line where each
+        ionic step starts
+    :return step_lines: list with the number of lines before each step
+    :return num_lines: the number of lines of the file
     """
+    import mmap
 
-#    PREVIOUS VERSION
-#    TODO: suppress it when we are sure the new one is working in all cases
-#    # find the indices of the lines with problems
-#    found_endpoint = False
-#    init_problem = count
-#    for count2,line2 in enumerate(lines[count+1:]):
-#        end_problem = count + count2 + 1
-#        if "%%%%%%%%%%%%" in line2:
-#            found_endpoint = True
-#            break
-#    if not found_endpoint:
-#        message = None
-#    else:
-#        # build a dictionary with the lines
-#        prob_list = lines[init_problem:end_problem+1]
-#        irred_list = list(set(prob_list))
-#        message = ""
-#        for v in prob_list:
-#            if v in irred_list:
-#                #irred_list.pop(v)
-#                message += irred_list.pop(irred_list.index(v)) + '\n'
-#    return [message]
-
-    # find the indices of the lines with problems
-    found_endpoint = False
-    init_problem = count
-    for count2,line2 in enumerate(lines[count+1:]):
-        end_problem = count + count2 + 1
-        if "%%%%%%%%%%%%" in line2:
-            found_endpoint = True
-            break
-    messages = []
-    if found_endpoint:
-        # build a dictionary with the lines
-        prob_list = lines[init_problem:end_problem+1]
-        irred_list = list(set(prob_list))
-        for v in prob_list:
-            if ( len(v)>0 and (v in irred_list and v not in warnings) ):
-                messages.append(irred_list.pop(irred_list.index(v)))
-
-    return messages
+    with open(filename, 'rb') as f:
+        f.seek(0, os.SEEK_END)
+        size = f.tell()
+        if size == 0:
+            return [], [], 0
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    try:
+        step_starts = []
+        step_lines = []
+        num_lines = 0
+        previous = 0
+        position = data.find(separator)
+        while position != -1:
+            start = data.rfind('\n', 0, position) + 1
+            # the steps starting on the same line are parsed together
+            if start != previous or not step_starts:
+                num_lines += data[previous:start].count('\n')
+                previous = start
+                step_starts.append(start)
+                step_lines.append(num_lines)
+            position = data.find(separator, position+len(separator))
+        num_lines += data[previous:].count('\n')
+        if data[size-1] != '\n':
+            num_lines += 1
+    finally:
+        data.close()
+
+    return step_starts, step_lines, num_lines
+
+def _parse_pw_text_block(task):
+    """
+    Parse a block of ionic steps of the text output of QE-PWscf, in a
+    worker process (see PwTextOutputParser.feed_file).
+
+    :param task: tuple with the path of the output file, the byte offsets
+        of the block (the end is None for the last one), the number of lines
+        before the block, and the attributes of the parser set by the header
+    :return: a dictionary with the results, for PwTextOutputParser._merge_block
+    """
+    filename, start, end, first_line, state = task
+    parser = PwTextOutputParser(input_dict=state['input_dict'],
+                                exclude=state['_exclude'])
+    parser.__dict__.update(state)
+    parser.number_of_lines = first_line
+    parser._basic_warnings = None
+    # None if not found in the block, so that the previous value is kept
+    parser._c_bands_error = None
+
+    with open(filename, 'r') as f:
+        f.seek(start)
+        if end is None:
+            lines = f.read().split('\n')
+        else:
+            lines = f.read(end-start).split('\n')
+        if not lines[-1]:
+            lines.pop()
+        parser.feed(lines)
+
+        # the text before the next step, on the line starting it, belongs
+        # to the last step of the block
+        line = f.readline()
+        if line:
+            line = line.rstrip('\n')
+            parser.number_of_lines += 1
+            if parser._global_collectors:
+                parser._global_collectors = parser._send(parser._global_collectors, line)
+            parser._feed_step(line.split(parser._step_separator)[0])
+        parser._close_step()
+
+        # the messages started in the block may continue in the next ones
+        for line in f:
+            if not parser._global_collectors:
+                break
+            parser._global_collectors = parser._send(parser._global_collectors,
+                                                     line.rstrip('\n'))
+        parser._throw_end(parser._global_collectors)
+
+    return {'trajectory_data': parser.trajectory_data,
+            'parsed_data': parser.parsed_data,
+            'warnings': parser._warnings,
+            'step_warnings': parser._step_warnings,
+            'c_bands_error': parser._c_bands_error,
+            'job_done': parser.job_done}
@@ -0,0 +1,463 @@
+# -*- coding: utf-8 -*-
+"""
+This module contains some functions to compute the phonon frequencies and
+eigenvectors from the dynamical matrix files written by ph.x, for all the
+q-points at once, as dynmat.x does for a single file.
+"""
+import numpy
+from aiida_quantumespresso.parsers import QEOutputParsingError, RetrievedFiles
+from aiida_quantumespresso.parsers.constants import amu_Ry, ry_to_cmm1
+from aiida_quantumespresso.parsers.raw_parser_ph import (parse_ph_dynmat,
+    decode_ph_dynmat_matrix)
+
+# the q-points closer than this to Gamma (in 2pi/lattice_parameter) are
+# those where the acoustic sum rule is imposed. It is also the tolerance on
+# the integer crystal coordinates of the reciprocal lattice vectors, where
+# the non-analytic term is added
+gamma_threshold = 1.e-8
+
+
+def read_dynamical_matrices(dynmat_files, files=None):
+    """
+    Reads the dynamical matrices of the q-points computed by ph.x (the first
+    q-point of each file), with the masses written in the header of the
+    files.
+
+    :param dynmat_files: the paths of the dynamical matrix files, all of
+        the same system. The files without a dynamical matrix (as the one
+        with the list of q-points) are skipped
+    :param files: the RetrievedFiles to read the files (optional)
+    :return: a dictionary with
+
+        * dynamical_matrices: complex (nq, 3N, 3N) array with the dynamical
+          matrices (Ry/bohr^2, not divided by the masses), with the
+          index 3*na+i for the direction i of the atom na
+        * q_points: (nq, 3) array with the q-points (2pi/lattice_parameter)
+        * masses: (N,) array with the mass of each atom (amu)
+        * atoms_labels: the list of the labels of the atoms
+
+    :raise QEOutputParsingError: if a file or its header cannot be parsed,
+        or if the files are not all of the same system
+    """
+    if files is None:
+        files = RetrievedFiles()
+
+    dynamical_matrices = []
+    q_points = []
+    header = None
+    for filename in dynmat_files:
+        text = files.read(filename)
+        if 'Dynamical matrix file' not in text.split('\n', 1)[0]:
+            continue
+        try:
+            matrix_start = text.index('Dynamical  Matrix in cartesian axes')
+            header_lines = text[:text.index('\n', matrix_start) + 1].splitlines(True)
+            this_header = parse_ph_dynmat(header_lines, parse_header=True)['header']
+            if this_header['warnings']:
+                raise ValueError("incomplete header")
+            num_atoms = len(this_header['atoms_labels'])
+            q_start = text.index('q = ', matrix_start)
+            q_line = text[q_start:text.index('\n', q_start)]
+            q_point = [float(_) for _ in q_line.split('(')[1].split(')')[0].split()]
+            matrix = decode_ph_dynmat_matrix(text, num_atoms)
+        except (ValueError, IndexError, KeyError) as e:
+            raise QEOutputParsingError("Error while reading the dynamical "
+                                       "matrix in {} ({})".format(filename, e))
+
+        if header is None:
+            header = this_header
+        elif (this_header['atoms_labels'] != header['atoms_labels'] or
+              this_header['masses'] != header['masses']):
+            raise QEOutputParsingError("The dynamical matrix in {} is of a "
+                                       "different system".format(filename))
+
+        # from D[na,nb,i,j] to D[3*na+i,3*nb+j]
+        dynamical_matrices.append(matrix.transpose(0, 2, 1, 3).reshape(
+            3 * num_atoms, 3 * num_atoms))
+        q_points.append(q_point)
+
+    if header is None:
+        raise QEOutputParsingError("No dynamical matrix found")
+
+    return {'dynamical_matrices': numpy.array(dynamical_matrices),
+            'q_points': numpy.array(q_points),
+            'masses': numpy.array([header['masses'][_]
+                                   for _ in header['atoms_labels']]),
+            'atoms_labels': header['atoms_labels'],
+            }
+
+def apply_acoustic_sum_rule(dynamical_matrices, q_points):
+    """
+    Imposes the acoustic sum rule on the dynamical matrices at Gamma, as
+    the 'simple' sum rule of dynmat.x: the sum over the second atom of each
+    block row is subtracted from its diagonal block.
+
+    :param dynamical_matrices: complex (nq, 3N, 3N) array with the
+        dynamical matrices, as returned by read_dynamical_matrices
+    :param q_points: (nq, 3) array with the q-points
+    :return: a copy of dynamical_matrices, corrected at Gamma
+    """
+    dynamical_matrices = numpy.array(dynamical_matrices, dtype=complex)
+    num_atoms = dynamical_matrices.shape[1] // 3
+    is_gamma = (numpy.abs(q_points) < gamma_threshold).all(axis=1)
+
+    # D[q,na,i,nb,j], summed over nb
+    blocks = dynamical_matrices[is_gamma].reshape(-1, num_atoms, 3, num_atoms, 3)
+    sums = blocks.sum(axis=3)
+    atoms = numpy.arange(num_atoms)
+    blocks[:,atoms,:,atoms,:] -= sums.transpose(1, 0, 2, 3)
+    dynamical_matrices[is_gamma] = blocks.reshape(-1, 3 * num_atoms, 3 * num_atoms)
+
+    return dynamical_matrices
+
+def diagonalize_dynamical_matrices(dynamical_matrices, masses,
+                                   also_eigenvectors=True):
+    """
+    Diagonalizes the dynamical matrices of all the q-points at once.
+    The matrices are divided by the square root of the masses of the two
+    atoms, and made hermitian, before the diagonalization.
+
+    :param dynamical_matrices: complex (nq, 3N, 3N) array with the
+        dynamical matrices (Ry/bohr^2), as returned by
+        read_dynamical_matrices
+    :param masses: (N,) array with the mass of each atom (amu)
+    :param also_eigenvectors: if True, return also the eigenvectors
+    :return: a (nq, 3N) array with the frequencies (cm-1), in ascending
+        order (negative for the unstable modes), and, if also_eigenvectors,
+        a complex (nq, 3N, N, 3) array with the normalized eigenvectors,
+        with the index of the mode first and then those of the atom and
+        of the direction (None otherwise)
+    """
+    dynamical_matrices = numpy.asarray(dynamical_matrices)
+    num_atoms = len(masses)
+    inv_sqrt_masses = numpy.repeat(
+        1. / numpy.sqrt(numpy.asarray(masses, dtype=float) * amu_Ry), 3)
+
+    scaled = (dynamical_matrices * inv_sqrt_masses[:,None] *
+              inv_sqrt_masses[None,:])
+    scaled = 0.5 * (scaled + scaled.conj().transpose(0, 2, 1))
+
+    if also_eigenvectors:
+        eigenvalues, eigenvectors = numpy.linalg.eigh(scaled)
+        # the eigenvectors are the columns
+        eigenvectors = eigenvectors.transpose(0, 2, 1).reshape(
+            len(scaled), 3 * num_atoms, num_atoms, 3)
+    else:
+        eigenvalues = numpy.linalg.eigvalsh(scaled)
+        eigenvectors = None
+
+    frequencies = (numpy.sign(eigenvalues) *
+                   numpy.sqrt(numpy.abs(eigenvalues)) * ry_to_cmm1)
+
+    return frequencies, eigenvectors
+
+def get_phonon_modes(dynmat_files, asr=False, also_eigenvectors=True,
+                     files=None):
+    """
+    Computes the phonon frequencies and eigenvectors from the dynamical
+    matrix files written by ph.x, without running dynmat.x.
+
+    :param dynmat_files: the paths of the dynamical matrix files
+    :param asr: if True, impose the acoustic sum rule at Gamma (see
+        apply_acoustic_sum_rule)
+    :param also_eigenvectors: if True, return also the eigenvectors
+    :param files: the RetrievedFiles to read the files (optional)
+    :return: a dictionary with the keys of stack_ph_dynmats (frequencies,
+        q_points and, if also_eigenvectors, eigenvectors) and the masses
+        (amu) and labels of the atoms
+    """
+    data = read_dynamical_matrices(dynmat_files, files)
+    dynamical_matrices = data.pop('dynamical_matrices')
+    if asr:
+        dynamical_matrices = apply_acoustic_sum_rule(dynamical_matrices,
+                                                     data['q_points'])
+
+    frequencies, eigenvectors = diagonalize_dynamical_matrices(
+        dynamical_matrices, data['masses'], also_eigenvectors)
+    data['frequencies'] = frequencies
+    if also_eigenvectors:
+        data['eigenvectors'] = eigenvectors
+
+    return data
+
+
+# e^2 in Rydberg atomic units
+e2 = 2.
+# the Ewald parameter of the long-range term of the dynamical matrices and
+# the maximum exponent of its G-space sum, as in rgd_blk of Quantum ESPRESSO
+ewald_alpha = 1.
+ewald_max_exponent = 14.
+# tolerance (in units of the lattice parameter squared) for the atoms on
+# the border of the Wigner-Seitz cell
+wigner_seitz_threshold = 1.e-6
+
+
+def get_wigner_seitz_weights(cell, positions, qpoints_mesh, chunk_size=1000):
+    """
+    Computes the weights of the lattice vectors in the Fourier interpolation
+    of the force constants, as matdyn.x does: the force constants between
+    the atoms na and nb at distance R + tau(na) - tau(nb) are taken with
+    weight 1 if it is inside the Wigner-Seitz cell of the supercell,
+    1/n if it is on its border (shared with n-1 other cells), 0 otherwise.
+
+    :param cell: (3, 3) array with the cell vectors (rows), in units of the
+        lattice parameter
+    :param positions: (N, 3) array with the cartesian positions of the
+        atoms, in units of the lattice parameter
+    :param qpoints_mesh: the q-points mesh (i.e. the supercell) of the
+        force constants
+    :param chunk_size: the number of lattice vectors whose distances from
+        the faces of the Wigner-Seitz cell are computed at once
+    :return: a (nR, 3) array with the integer coordinates n of the
+        lattice vectors R = n1*a1 + n2*a2 + n3*a3 with a non-zero weight for
+        some pair of atoms, and a (nR, N, N) array with the weights
+    :raise ValueError: if the weights of a pair of atoms do not add up to
+        the number of cells of the supercell
+    """
+    cell = numpy.asarray(cell, dtype=float)
+    positions = numpy.asarray(positions, dtype=float)
+    num_atoms = len(positions)
+    qpoints_mesh = numpy.asarray(qpoints_mesh)
+
+    # the vectors of the neighbouring supercells, that define the faces of
+    # the Wigner-Seitz cell
+    neighbours = numpy.indices((5, 5, 5)).reshape(3, -1).T - 2
+    neighbours = neighbours[(neighbours != 0).any(axis=1)]
+    neighbours = neighbours.dot(cell * qpoints_mesh[:,None])
+    half_norms = 0.5 * (neighbours ** 2).sum(axis=1)
+
+    # all the lattice vectors that can fall in the Wigner-Seitz cell
+    ranges = [numpy.arange(-2 * _, 2 * _ + 1) for _ in qpoints_mesh]
+    vectors = numpy.array(numpy.meshgrid(*ranges, indexing='ij')).reshape(3, -1).T
+    lattice_vectors = vectors.dot(cell)
+
+    weights = numpy.zeros((len(vectors), num_atoms, num_atoms))
+    for start in range(0, len(vectors), chunk_size):
+        for na in range(num_atoms):
+            # (nR, N, 3) distances R + tau(na) - tau(nb)
+            distances = (lattice_vectors[start:start+chunk_size,None,:] +
+                         positions[na] - positions[None,:,:])
+            projections = distances.dot(neighbours.T) - half_norms
+            is_inside = (projections <= wigner_seitz_threshold).all(axis=2)
+            num_equivalent = 1 + (numpy.abs(projections) <
+                                  wigner_seitz_threshold).sum(axis=2)
+            weights[start:start+chunk_size,na,:] = (
+                is_inside / num_equivalent.astype(float))
+
+    if not numpy.allclose(weights.sum(axis=0), qpoints_mesh.prod()):
+        raise ValueError("Wrong total weight of the Wigner-Seitz cell")
+
+    has_weight = (weights > 0).any(axis=(1, 2))
+    return vectors[has_weight], weights[has_weight]
+
+def get_rigid_ion_term(q_points, cell, positions, dielectric_tensor,
+                       effective_charges, lattice_parameter, qpoints_mesh):
+    """
+    Computes the long-range (rigid-ion) term of the dynamical matrices, as
+    rgd_blk of Quantum ESPRESSO: the term that q2r.x subtracts from the
+    force constants of polar materials, and that must be added back to the
+    interpolated dynamical matrices. As in Quantum ESPRESSO, only the
+    G-space sum of the Ewald term is computed.
+
+    :param q_points: (nq, 3) array with the cartesian q-points, in units of
+        2pi/lattice_parameter
+    :param cell: (3, 3) array with the cell vectors (rows), in units of the
+        lattice parameter
+    :param positions: (N, 3) array with the cartesian positions of the
+        atoms, in units of the lattice parameter
+    :param dielectric_tensor: the (3, 3) dielectric tensor
+    :param effective_charges: (N, 3, 3) array with the effective charges
+    :param lattice_parameter: the lattice parameter (bohr)
+    :param qpoints_mesh: the q-points mesh of the force constants (the
+        G-vectors are not summed along the directions with a single q-point)
+    :return: a complex (nq, 3N, 3N) array with the term (Ry/bohr^2)
+    """
+    cell = numpy.asarray(cell, dtype=float)
+    positions = numpy.asarray(positions, dtype=float)
+    dielectric_tensor = numpy.asarray(dielectric_tensor, dtype=float)
+    effective_charges = numpy.asarray(effective_charges, dtype=float)
+    q_points = numpy.asarray(q_points, dtype=float)
+    num_atoms = len(positions)
+    reciprocal_cell = numpy.linalg.inv(cell).T
+    volume = abs(numpy.linalg.det(cell)) * lattice_parameter ** 3
+    prefactor = e2 * 4. * numpy.pi / volume
+
+    # the G-vectors up to the cutoff of the exponential
+    max_norm = numpy.sqrt(4. * ewald_alpha * ewald_max_exponent)
+    ranges = [numpy.arange(-m, m + 1) if n > 1 else numpy.zeros(1, dtype=int)
+              for n, m in zip(qpoints_mesh, (max_norm / numpy.sqrt(
+                  (reciprocal_cell ** 2).sum(axis=1))).astype(int) + 1)]
+    g_vectors = numpy.array(numpy.meshgrid(*ranges, indexing='ij')).reshape(3, -1).T
+    g_vectors = g_vectors.dot(reciprocal_cell)
+
+    def get_factors(vectors):
+        # the Gaussian factors (zero outside the cutoff) of the vectors
+        norms = numpy.einsum('...i,ij,...j', vectors, dielectric_tensor, vectors)
+        is_included = ((norms > 0.) & (norms / ewald_alpha / 4. <
+                                       ewald_max_exponent))
+        norms = numpy.where(is_included, norms, 1.)
+        return numpy.where(is_included, prefactor * numpy.exp(
+            -norms / ewald_alpha / 4.) / norms, 0.)
+
+    # the q-independent term, on the diagonal blocks: for each G and atom,
+    # Z.G of the atom times the sum over the atoms of Z.G cos(G.(tau_a-tau_b))
+    factors = get_factors(g_vectors)
+    charges = numpy.einsum('gi,aij->gaj', g_vectors, effective_charges)
+    phases = 2. * numpy.pi * g_vectors.dot(positions.T)
+    cosines = numpy.cos(phases[:,:,None] - phases[:,None,:])
+    sums = numpy.einsum('gab,gbj->gaj', cosines, charges)
+    diagonal_term = numpy.einsum('g,gai,gaj->aij', factors, charges, sums)
+
+    rigid_ion_term = numpy.zeros((len(q_points), num_atoms, 3, num_atoms, 3),
+                                 dtype=complex)
+    atoms = numpy.arange(num_atoms)
+    rigid_ion_term[:,atoms,:,atoms,:] -= diagonal_term[:,None,:,:]
+
+    # the term of the vectors q+G
+    for iq, q_point in enumerate(q_points):
+        vectors = g_vectors + q_point
+        factors = get_factors(vectors)
+        is_included = factors != 0.
+        vectors = vectors[is_included]
+        charges = numpy.einsum('gi,aij->gaj', vectors, effective_charges)
+        charges = charges * numpy.exp(2.j * numpy.pi *
+                                      vectors.dot(positions.T))[:,:,None]
+        charges = charges.reshape(len(vectors), 3 * num_atoms)
+        rigid_ion_term[iq] += numpy.dot(
+            (factors[is_included][:,None] * charges).T,
+            charges.conj()).reshape(num_atoms, 3, num_atoms, 3)
+
+    return rigid_ion_term.reshape(len(q_points), 3 * num_atoms, 3 * num_atoms)
+
+def get_nonanalytic_term(directions, dielectric_tensor, effective_charges,
+                         volume):
+    """
+    Computes the non-analytic term of the dynamical matrices at q = 0, as
+    nonanal of Quantum ESPRESSO, for the given directions of approach to
+    q = 0.
+
+    :param directions: (nq, 3) array with the cartesian directions (of any
+        norm, they are normalized first). The term is zero for the
+        directions equal to zero
+    :param dielectric_tensor: the (3, 3) dielectric tensor
+    :param effective_charges: (N, 3, 3) array with the effective charges
+    :param volume: the volume of the cell (bohr^3)
+    :return: a (nq, 3N, 3N) array with the term (Ry/bohr^2)
+    """
+    directions = numpy.asarray(directions, dtype=float)
+    effective_charges = numpy.asarray(effective_charges, dtype=float)
+    num_atoms = len(effective_charges)
+    lengths = numpy.sqrt((directions ** 2).sum(axis=1))
+    directions = directions / numpy.where(lengths > 0., lengths, 1.)[:,None]
+    norms = numpy.einsum('qi,ij,qj->q', directions,
+                         numpy.asarray(dielectric_tensor, dtype=float), directions)
+    is_included = norms >= 1.e-8
+    factors = numpy.where(is_included, 4. * numpy.pi * e2 / volume /
+                          numpy.where(is_included, norms, 1.), 0.)
+    charges = numpy.einsum('qi,aij->qaj', directions,
+                           effective_charges).reshape(-1, 3 * num_atoms)
+    return factors[:,None,None] * charges[:,:,None] * charges[:,None,:]
+
+def apply_force_constants_sum_rule(force_constants, effective_charges=None):
+    """
+    Imposes the acoustic sum rule on the force constants and the sum rule
+    on the effective charges, as the 'simple' sum rule of matdyn.x.
+
+    :param force_constants: the force constants, with indices
+        C(m1,m2,m3,j1,j2,na1,na2) (see parse_q2r_force_constants_file)
+    :param effective_charges: (N, 3, 3) array with the effective charges
+        (optional)
+    :return: the corrected copies of force_constants and effective_charges
+        (None if not given)
+    """
+    force_constants = numpy.array(force_constants, dtype=float)
+    sums = force_constants.sum(axis=(0, 1, 2, 6))
+    atoms = numpy.arange(force_constants.shape[-1])
+    force_constants[0,0,0,:,:,atoms,atoms] -= sums.transpose(2, 0, 1)
+
+    if effective_charges is not None:
+        effective_charges = numpy.array(effective_charges, dtype=float)
+        effective_charges -= effective_charges.mean(axis=0)
+
+    return force_constants, effective_charges
+
+def interpolate_dynamical_matrices(q_points, force_constants, cell, positions,
+                                   lattice_parameter, dielectric_tensor=None,
+                                   effective_charges=None, chunk_size=1000):
+    """
+    Computes the dynamical matrices at any q-point by Fourier interpolation
+    of the real-space force constants of q2r.x, as matdyn.x does, for all
+    the q-points at once.
+    If the dielectric tensor and the effective charges are given, the
+    long-range term is added back (see get_rigid_ion_term), and, at the
+    q-points equal to a reciprocal lattice vector (as q = 0), the
+    non-analytic term along the direction from the neighbouring q-point in
+    the list (see get_nonanalytic_term).
+
+    :param q_points: (nq, 3) array with the q-points, in crystal
+        coordinates
+    :param force_constants: the force constants, with indices
+        C(m1,m2,m3,j1,j2,na1,na2) (see parse_q2r_force_constants_file)
+    :param cell: (3, 3) array with the cell vectors (rows), in units of the
+        lattice parameter
+    :param positions: (N, 3) array with the cartesian positions of the
+        atoms, in units of the lattice parameter
+    :param lattice_parameter: the lattice parameter (bohr)
+    :param dielectric_tensor: the (3, 3) dielectric tensor (optional)
+    :param effective_charges: (N, 3, 3) array with the effective charges
+        (optional)
+    :param chunk_size: the number of q-points whose phase factors are
+        computed at once
+    :return: a complex (nq, 3N, 3N) array with the dynamical matrices
+        (Ry/bohr^2, not divided by the masses), with the index 3*na+i
+        for the direction i of the atom na
+    """
+    q_points = numpy.asarray(q_points, dtype=float).reshape(-1, 3)
+    cell = numpy.asarray(cell, dtype=float)
+    qpoints_mesh = force_constants.shape[:3]
+    num_atoms = force_constants.shape[-1]
+    num_modes = 3 * num_atoms
+
+    # the force constants of each lattice vector, already multiplied by
+    # the weights, as (nR, 3N*3N) with indices (na,i,nb,j)
+    vectors, weights = get_wigner_seitz_weights(cell, positions, qpoints_mesh)
+    cells = vectors % qpoints_mesh
+    weighted = (force_constants[cells[:,0],cells[:,1],cells[:,2]].transpose(
+        0, 3, 1, 4, 2) * weights[:,:,None,:,None]).reshape(len(vectors), -1)
+
+    dynamical_matrices = numpy.empty((len(q_points), num_modes * num_modes),
+                                     dtype=complex)
+    for start in range(0, len(q_points), chunk_size):
+        phases = numpy.exp(-2.j * numpy.pi *
+                           q_points[start:start+chunk_size].dot(vectors.T))
+        dynamical_matrices[start:start+chunk_size] = phases.dot(weighted)
+    dynamical_matrices = dynamical_matrices.reshape(-1, num_modes, num_modes)
+
+    if dielectric_tensor is not None and effective_charges is not None:
+        cartesian_q_points = q_points.dot(numpy.linalg.inv(cell).T)
+        dynamical_matrices += get_rigid_ion_term(cartesian_q_points, cell,
+            positions, dielectric_tensor, effective_charges,
+            lattice_parameter, qpoints_mesh)
+
+        # the q-points equivalent to q = 0 are those with integer crystal
+        # coordinates, and the direction of approach is the one from the
+        # previous q-point (or the next one, if also the previous is the
+        # same reciprocal lattice vector)
+        is_gamma = (numpy.abs(q_points - numpy.round(q_points)) <
+                    gamma_threshold).all(axis=1)
+        if is_gamma.any():
+            directions = numpy.zeros((len(q_points), 3))
+            for iq in numpy.flatnonzero(is_gamma):
+                previous = (cartesian_q_points[iq] - cartesian_q_points[iq-1]
+                            if iq > 0 else numpy.zeros(3))
+                if (numpy.abs(previous) >= gamma_threshold).any():
+                    directions[iq] = previous
+                elif iq + 1 < len(q_points):
+                    directions[iq] = (cartesian_q_points[iq] -
+                                      cartesian_q_points[iq+1])
+            volume = abs(numpy.linalg.det(cell)) * lattice_parameter ** 3
+            dynamical_matrices[is_gamma] += get_nonanalytic_term(
+                directions[is_gamma], dielectric_tensor, effective_charges,
+                volume)
+
+    return dynamical_matrices
@@ -0,0 +1,315 @@
+# -*- coding: utf-8 -*-
+import os
+from aiida.orm import Code
+from aiida.orm.data.base import Bool, Int
+from aiida.orm.data.folder import FolderData
+from aiida.orm.data.parameter import ParameterData
+from aiida.orm.data.array.kpoints import KpointsData
+from aiida.work.run import submit
+from aiida.work.workchain import WorkChain, ToContext, while_
+from aiida_quantumespresso.calculations.matdyn import MatdynCalculation
+from aiida_quantumespresso.calculations.ph import PhCalculation
+from aiida_quantumespresso.calculations.pw import PwCalculation
+from aiida_quantumespresso.calculations.q2r import Q2rCalculation
+from aiida_quantumespresso.workflows.ph.base import PhBaseWorkChain
+
+def get_qpoint_chunks(num_qpoints, qpoints_per_chunk):
+    """
+    Split the q-points in chunks of consecutive points, each given by the first and the last index
+    (starting from 1, as the start_q and last_q flags of ph.x) of its q-points. The last chunk has
+    fewer q-points if num_qpoints is not a multiple of qpoints_per_chunk
+
+    :param num_qpoints: the number of irreducible q-points
+    :param qpoints_per_chunk: the maximum number of q-points of each chunk
+    :return: a list of tuples (start_q, last_q)
+    """
+    return [(start_q, min(start_q + qpoints_per_chunk - 1, num_qpoints))
+            for start_q in range(1, num_qpoints + 1, qpoints_per_chunk)]
+
+class PhParallelWorkChain(WorkChain):
+    """
+    Workchain to compute the phonon dispersion with the q-points of the grid distributed over
+    several ph.x calculations, followed by q2r.x and matdyn.x
+
+    The number of irreducible q-points is obtained from an initialization ph.x run. The q-points
+    are then split in chunks of consecutive points (with the start_q and last_q flags of ph.x),
+    each computed by a PhBaseWorkChain. The chunks are submitted in batches of max_concurrent
+    workchains, and the next batch is submitted only when all the workchains of the previous one
+    have terminated, so a slow chunk delays the following batch. The dynamical matrices of all
+    the chunks are gathered into a single folder, from which the force constants are computed by
+    a Q2rCalculation and the phonon bands by a MatdynCalculation.
+    Note that the irreducible representations of a q-point are not split over several runs, as
+    this would need a further ph.x run to collect them
+    """
+    def __init__(self, *args, **kwargs):
+        super(PhParallelWorkChain, self).__init__(*args, **kwargs)
+
+    @classmethod
+    def define(cls, spec):
+        super(PhParallelWorkChain, cls).define(spec)
+        spec.input('code', valid_type=Code)
+        spec.input('q2r_code', valid_type=Code)
+        spec.input('matdyn_code', valid_type=Code)
+        spec.input('parent_calc', valid_type=PwCalculation)
+        spec.input('qpoints', valid_type=KpointsData)
+        spec.input('kpoints', valid_type=KpointsData)
+        spec.input('parameters', valid_type=ParameterData)
+        spec.input('q2r_parameters', valid_type=ParameterData)
+        spec.input('matdyn_parameters', valid_type=ParameterData)
+        spec.input('settings', valid_type=ParameterData)
+        spec.input('options', valid_type=ParameterData)
+        spec.input('q2r_options', valid_type=ParameterData, required=False)
+        spec.input('matdyn_options', valid_type=ParameterData, required=False)
+        spec.input('qpoints_per_chunk', valid_type=Int, default=Int(1))
+        spec.input('max_concurrent', valid_type=Int, default=Int(4))
+        spec.input('clean_workdir', valid_type=Bool, default=Bool(False))
+        spec.input('max_iterations', valid_type=Int, default=Int(10))
+        spec.outline(
+            cls.setup,
+            cls.run_init,
+            cls.inspect_init,
+            while_(cls.should_run_chunks)(
+                cls.run_chunks,
+                cls.inspect_chunks,
+            ),
+            cls.run_gather,
+            cls.run_q2r,
+            cls.inspect_q2r,
+            cls.run_matdyn,
+            cls.run_results,
+        )
+        spec.dynamic_output()
+
+    def setup(self):
+        """
+        Initialize context variables
+        """
+        self.ctx.max_concurrent = self.inputs.max_concurrent.value
+        self.ctx.chunks = []
+        self.ctx.chunk_labels = []
+        self.ctx.batch_labels = []
+        self.ctx.num_submitted = 0
+
+        if self.ctx.max_concurrent < 1:
+            self.abort_nowait('max_concurrent should be at least 1, found {}'.format(
+                self.ctx.max_concurrent))
+        if self.inputs.qpoints_per_chunk.value < 1:
+            self.abort_nowait('qpoints_per_chunk should be at least 1, found {}'.format(
+                self.inputs.qpoints_per_chunk.value))
+
+        return
+
+    def run_init(self):
+        """
+        Run a PhCalculation that stops after the initialization, to get the number of irreducible
+        q-points of the grid
+        """
+        settings = self.inputs.settings.get_dict()
+        settings['ONLY_INITIALIZATION'] = True
+
+        inputs = {
+            'code': self.inputs.code,
+            'qpoints': self.inputs.qpoints,
+            'parameters': self.inputs.parameters,
+            'settings': ParameterData(dict=settings),
+            'parent_folder': self.inputs.parent_calc.out.remote_folder,
+            '_options': self.inputs.options.get_dict(),
+        }
+
+        process = PhCalculation.process()
+        running = submit(process, **inputs)
+
+        self.report('launching initialization PhCalculation<{}>'.format(running.pid))
+
+        return ToContext(calculation_init=running)
+
+    def inspect_init(self):
+        """
+        Verify that the initialization PhCalculation finished successfully, and split the
+        irreducible q-points it found in chunks of consecutive points (see get_qpoint_chunks)
+        """
+        calculation = self.ctx.calculation_init
+
+        if not calculation.has_finished_ok():
+            self.abort_nowait('the initialization PhCalculation<{}> failed'.format(calculation.pk))
+            return
+
+        try:
+            num_qpoints = calculation.out.output_parameters.get_dict()['number_of_qpoints']
+        except (AttributeError, KeyError):
+            self.abort_nowait('the number of q-points could not be found in the output of the '
+                'initialization PhCalculation<{}>'.format(calculation.pk))
+            return
+
+        self.ctx.chunks = get_qpoint_chunks(num_qpoints, self.inputs.qpoints_per_chunk.value)
+
+        self.report('{} q-points will be computed in {} chunks'.format(
+            num_qpoints, len(self.ctx.chunks)))
+
+        return
+
+    def should_run_chunks(self):
+        """
+        Return whether there are chunks of q-points that have not been submitted yet
+        """
+        return self.ctx.num_submitted < len(self.ctx.chunks)
+
+    def run_chunks(self):
+        """
+        Run a PhBaseWorkChain for each of the next max_concurrent chunks of q-points. The workchain
+        waits for all of them to terminate before the next batch is submitted
+        """
+        to_context = {}
+        self.ctx.batch_labels = []
+
+        first = self.ctx.num_submitted
+        for index in range(first, min(first + self.ctx.max_concurrent, len(self.ctx.chunks))):
+            start_q, last_q = self.ctx.chunks[index]
+
+            parameters = self.inputs.parameters.get_dict()
+            parameters['INPUTPH']['start_q'] = start_q
+            parameters['INPUTPH']['last_q'] = last_q
+
+            inputs = {
+                'code': self.inputs.code,
+                'parent_calc': self.inputs.parent_calc,
+                'qpoints': self.inputs.qpoints,
+                'parameters': ParameterData(dict=parameters),
+                'settings': self.inputs.settings,
+                'options': self.inputs.options,
+                'clean_workdir': self.inputs.clean_workdir,
+                'max_iterations': self.inputs.max_iterations,
+            }
+
+            running = submit(PhBaseWorkChain, **inputs)
+            label = 'workchain_chunk_{}'.format(index)
+            self.ctx.chunk_labels.append(label)
+            self.ctx.batch_labels.append(label)
+            to_context[label] = running
+
+            self.report('launching PhBaseWorkChain<{}> for the q-points from {} to {}'.format(
+                running.pid, start_q, last_q))
+
+        self.ctx.num_submitted += len(to_context)
+
+        return ToContext(**to_context)
+
+    def inspect_chunks(self):
+        """
+        Verify that the workchains of the last batch of chunks returned their retrieved folder,
+        with the dynamical matrices
+        """
+        for label in self.ctx.batch_labels:
+            workchain = self.ctx[label]
+            try:
+                workchain.out.retrieved
+            except AttributeError:
+                self.abort_nowait('PhBaseWorkChain<{}> did not return the dynamical '
+                    'matrices'.format(workchain.pk))
+                return
+
+        return
+
+    def run_gather(self):
+        """
+        Gather the dynamical matrices computed by all the chunks in a single FolderData, with
+        the folder structure of the retrieved folder of a PhCalculation. The file with the list of
+        q-points, written by every chunk, is taken from the first one
+        """
+        folder_dynamical_matrix = PhCalculation._FOLDER_DYNAMICAL_MATRIX
+
+        dynamical_matrices = FolderData()
+        dynamical_matrices._get_folder_pathsubfolder.get_subfolder(folder_dynamical_matrix,
+                                                                   create=True)
+        gathered = set()
+        for label in self.ctx.chunk_labels:
+            retrieved = self.ctx[label].out.retrieved
+            source = retrieved.get_abs_path(folder_dynamical_matrix)
+            for filename in sorted(os.listdir(source)):
+                if filename in gathered:
+                    continue
+                dynamical_matrices.add_path(os.path.join(source, filename),
+                                            os.path.join(folder_dynamical_matrix, filename))
+                gathered.add(filename)
+
+        self.ctx.dynamical_matrices = dynamical_matrices
+
+        self.report('gathered {} dynamical matrix files from {} chunks'.format(
+            len(gathered), len(self.ctx.chunk_labels)))
+
+        return
+
+    def run_q2r(self):
+        """
+        Run a Q2rCalculation on the gathered dynamical matrices
+        """
+        try:
+            options = self.inputs.q2r_options
+        except AttributeError:
+            options = self.inputs.options
+
+        inputs = {
+            'code': self.inputs.q2r_code,
+            'parameters': self.inputs.q2r_parameters,
+            'parent_folder': self.ctx.dynamical_matrices,
+            '_options': options.get_dict(),
+        }
+
+        process = Q2rCalculation.process()
+        running = submit(process, **inputs)
+
+        self.report('launching Q2rCalculation<{}>'.format(running.pid))
+
+        return ToContext(calculation_q2r=running)
+
+    def inspect_q2r(self):
+        """
+        Verify that the Q2rCalculation finished successfully
+        """
+        calculation = self.ctx.calculation_q2r
+
+        if not calculation.has_finished_ok():
+            self.abort_nowait('Q2rCalculation<{}> failed'.format(calculation.pk))
+
+        return
+
+    def run_matdyn(self):
+        """
+        Run a MatdynCalculation on the force constants computed by the Q2rCalculation
+        """
+        try:
+            options = self.inputs.matdyn_options
+        except AttributeError:
+            options = self.inputs.options
+
+        inputs = {
+            'code': self.inputs.matdyn_code,
+            'parameters': self.inputs.matdyn_parameters,
+            'kpoints': self.inputs.kpoints,
+            'parent_folder': self.ctx.calculation_q2r.out.force_constants,
+            '_options': options.get_dict(),
+        }
+
+        process = MatdynCalculation.process()
+        running = submit(process, **inputs)
+
+        self.report('launching MatdynCalculation<{}>'.format(running.pid))
+
+        return ToContext(calculation_matdyn=running)
+
+    def run_results(self):
+        """
+        Attach the gathered dynamical matrices, the force constants and the phonon bands to the
+        outputs
+        """
+        calculation = self.ctx.calculation_matdyn
+
+        if not calculation.has_finished_ok():
+            self.abort_nowait('MatdynCalculation<{}> failed'.format(calculation.pk))
+            return
+
+        self.report('workchain completed after {} chunks of q-points'.format(
+            len(self.ctx.chunk_labels)))
+        self.out('dynamical_matrices', self.ctx.dynamical_matrices)
+        self.out('force_constants', self.ctx.calculation_q2r.out.force_constants)
+        self.out('output_phonon_bands', calculation.out.output_phonon_bands)
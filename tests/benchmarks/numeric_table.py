@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Benchmark of read_numeric_table against numpy.genfromtxt and numpy.loadtxt on
+a synthetic table in the format of the dos files of QE. The three readers must
+return the same values.
+"""
+import argparse
+import time
+import numpy
+from aiida_quantumespresso.parsers import read_numeric_table
+
+def get_table_text(num_rows, num_columns, seed=0):
+    """
+    Return the text of a table of random numbers, with a commented header as in the dos files
+    """
+    values = numpy.random.RandomState(seed).uniform(-10., 10., (num_rows, num_columns))
+    header = '#  E (eV)   dos(E)     Int dos(E)\n'
+    row_format = ' '.join(['{:12.3E}'] * num_columns) + '\n'
+    return header + ''.join(row_format.format(*row) for row in values)
+
+
+def parser_setup():
+    """
+    Setup the parser of command line arguments and return it
+    """
+    parser = argparse.ArgumentParser(
+        description='Time read_numeric_table, numpy.genfromtxt and numpy.loadtxt on a table of numbers',
+    )
+    parser.add_argument(
+        '-n', type=int, default=1000000, dest='num_rows',
+        help='the number of rows of the table. (default: %(default)d)'
+    )
+    parser.add_argument(
+        '-c', type=int, default=4, dest='num_columns',
+        help='the number of columns of the table. (default: %(default)d)'
+    )
+    parser.add_argument(
+        '-r', type=int, default=3, dest='repeat',
+        help='the number of runs of each reader; the best time is reported. (default: %(default)d)'
+    )
+
+    return parser
+
+
+def execute(args):
+    """
+    Build the table, read it with each reader and print the best time of each
+    """
+    from StringIO import StringIO
+
+    text = get_table_text(args.num_rows, args.num_columns)
+    readers = [
+        ('read_numeric_table', lambda: read_numeric_table(text)),
+        ('numpy.genfromtxt', lambda: numpy.genfromtxt(StringIO(text))),
+        ('numpy.loadtxt', lambda: numpy.loadtxt(StringIO(text))),
+    ]
+
+    results = {}
+    for name, reader in readers:
+        times = []
+        for _ in range(args.repeat):
+            start = time.time()
+            results[name] = reader()
+            times.append(time.time() - start)
+        print '{:20s} {:8.2f} s'.format(name, min(times))
+
+    reference = results['read_numeric_table']
+    print 'same output: {}'.format(all(numpy.array_equal(reference, values) for values in results.values()))
+
+
+def main():
+    """
+    Setup the parser to retrieve the command line arguments and pass them to the main execution function.
+    """
+    parser = parser_setup()
+    args   = parser.parse_args()
+    result = execute(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,305 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Benchmark of the backends of parse_pw_xml_output ('minidom' and 'etree') on
+the data-file.xml files (with their eigenval.xml files) of the parser tests
+fixtures and, optionally, on a larger synthetic data-file.xml of QE 5. The
+two backends must return the same dictionaries.
+"""
+import argparse
+import glob
+import os
+import random
+import shutil
+import tempfile
+import time
+import numpy
+import aiida_quantumespresso
+from aiida_quantumespresso.parsers.raw_parser_pw import parse_pw_xml_output
+
+parser_tests_folder = os.path.join(os.path.dirname(aiida_quantumespresso.__file__),
+                                   'tests', 'backend', 'parser_tests')
+
+def get_fixture_data_files():
+    """
+    Return a list of tuples with the name of the test, the path of each data-file.xml of the
+    parser tests fixtures and the folder with its k-points subfolders (None if there is none,
+    as the PwParser and the NebParser do)
+    """
+    data_files = []
+    for filename in sorted(glob.glob(os.path.join(parser_tests_folder, '*', 'nodes', '*', '*', '*',
+                                                  'path', '*', '*', 'data-file.xml')) +
+                           glob.glob(os.path.join(parser_tests_folder, '*', 'nodes', '*', '*', '*',
+                                                  'path', 'data-file.xml'))):
+        parts = os.path.relpath(filename, parser_tests_folder).split(os.sep)
+        # the name of the test and, for the images of a neb calculation, of the image folder
+        test_name = os.path.join(parts[0], *parts[6:-2])
+        folder = os.path.dirname(filename)
+        dir_with_bands = folder if glob.glob(os.path.join(folder, 'K*[0-9]')) else None
+        data_files.append((test_name, filename, dir_with_bands))
+    return data_files
+
+def write_data_file(folder, nat, nsym, nk, nbnd=8, nspin=1, seed=0):
+    """
+    Write a synthetic data-file.xml of QE 5, with the eigenval.xml files of
+    its k-points, in folder and return its path
+    """
+    r = random.Random(seed)
+    L = []
+    a = L.append
+    a('<?xml version="1.0"?>\n<?iotk version="1.2.0"?>\n<?iotk file_version="1.0"?>\n<?iotk binary="F"?>\n<?iotk qe_syntax="F"?>\n<Root>')
+    a('  <HEADER>\n    <FORMAT NAME="QEXML" VERSION="1.4.0"/>\n    <CREATOR NAME="PWSCF" VERSION="5.1"/>\n  </HEADER>')
+    a('  <CONTROL>\n    <PP_CHECK_FLAG type="logical" size="1">\nT\n</PP_CHECK_FLAG>\n    <LKPOINT_DIR type="logical" size="1">\nT\n</LKPOINT_DIR>\n    <Q_REAL_SPACE type="logical" size="1">\nF\n</Q_REAL_SPACE>\n    <BETA_REAL_SPACE type="logical" size="1">\nF\n</BETA_REAL_SPACE>\n  </CONTROL>')
+    a('  <STATUS>\n    <STEP ITERATION="1" TYPE="SCF"/>\n  </STATUS>')
+    a('''  <CELL>
+    <NON-PERIODIC_CELL_CORRECTION type="character" size="1" len="4">
+None
+</NON-PERIODIC_CELL_CORRECTION>
+    <BRAVAIS_LATTICE type="character" size="1" len="11">
+free
+</BRAVAIS_LATTICE>
+    <LATTICE_PARAMETER type="real" size="1" UNITS="Bohr">
+ 1.020000000000000E+001
+</LATTICE_PARAMETER>
+    <CELL_DIMENSIONS type="real" size="6">
+ 1.020000000000000E+001
+ 0.000000000000000E+000
+ 0.000000000000000E+000
+ 0.000000000000000E+000
+ 0.000000000000000E+000
+ 0.000000000000000E+000
+</CELL_DIMENSIONS>
+    <DIRECT_LATTICE_VECTORS>
+      <UNITS_FOR_DIRECT_LATTICE_VECTORS UNITS="Bohr"/>
+      <a1 type="real" size="3" columns="3">
+-5.100000000000000E+000  0.000000000000000E+000  5.100000000000000E+000
+</a1>
+      <a2 type="real" size="3" columns="3">
+ 0.000000000000000E+000  5.100000000000000E+000  5.100000000000000E+000
+</a2>
+      <a3 type="real" size="3" columns="3">
+-5.100000000000000E+000  5.100000000000000E+000  0.000000000000000E+000
+</a3>
+    </DIRECT_LATTICE_VECTORS>
+    <RECIPROCAL_LATTICE_VECTORS>
+      <UNITS_FOR_RECIPROCAL_LATTICE_VECTORS UNITS="2 pi / a"/>
+      <b1 type="real" size="3" columns="3">
+-1.0 -1.0 1.0
+</b1>
+      <b2 type="real" size="3" columns="3">
+1.0 1.0 1.0
+</b2>
+      <b3 type="real" size="3" columns="3">
+-1.0 1.0 -1.0
+</b3>
+    </RECIPROCAL_LATTICE_VECTORS>
+  </CELL>''')
+    a('  <MOVING_CELL>\n    <CELL_FACTOR type="real" size="1">\n 0.0\n</CELL_FACTOR>\n  </MOVING_CELL>')
+    a('  <ELECTRIC_FIELD>\n    <HAS_ELECTRIC_FIELD type="logical" size="1">\nF\n</HAS_ELECTRIC_FIELD>\n    <HAS_DIPOLE_CORRECTION type="logical" size="1">\nF\n</HAS_DIPOLE_CORRECTION>\n  </ELECTRIC_FIELD>')
+    ions = ['  <IONS>', '    <NUMBER_OF_ATOMS type="integer" size="1">\n%d\n</NUMBER_OF_ATOMS>' % nat,
+            '    <NUMBER_OF_SPECIES type="integer" size="1">\n2\n</NUMBER_OF_SPECIES>',
+            '    <UNITS_FOR_ATOMIC_MASSES UNITS="a.m.u."/>']
+    for i, (t, m) in enumerate([('Si', 28.086), ('Ge1', 72.6)]):
+        ions.append('    <SPECIE.%d>\n      <ATOM_TYPE type="character" size="1" len="3">\n%s\n</ATOM_TYPE>\n      <MASS type="real" size="1">\n %f\n</MASS>\n      <PSEUDO type="character" size="1" len="80">\n%s.pbe.UPF\n</PSEUDO>\n    </SPECIE.%d>' % (i+1, t, m, t, i+1))
+    ions.append('    <PSEUDO_DIR type="character" size="1" len="2">\n./\n</PSEUDO_DIR>')
+    ions.append('    <UNITS_FOR_ATOMIC_POSITIONS UNITS="Bohr"/>')
+    for i in range(nat):
+        sp = ['Si', 'Ge1'][i % 2]
+        ions.append('    <ATOM.%d SPECIES="%s" INDEX="%d" tau="%f %f %f" if_pos="1 1 0"/>' % (i+1, sp, i%2+1, r.random(), r.random(), r.random()))
+    ions.append('  </IONS>')
+    a('\n'.join(ions))
+    sy = ['  <SYMMETRIES>', '    <NUMBER_OF_SYMMETRIES type="integer" size="1">\n%d\n</NUMBER_OF_SYMMETRIES>' % nsym,
+          '    <NUMBER_OF_BRAVAIS_SYMMETRIES type="integer" size="1">\n48\n</NUMBER_OF_BRAVAIS_SYMMETRIES>']
+    for t in ['INVERSION_SYMMETRY','DO_NOT_USE_TIME_REVERSAL','TIME_REVERSAL_FLAG','NO_TIME_REV_OPERATIONS']:
+        sy.append('    <%s type="logical" size="1">\nF\n</%s>' % (t, t))
+    sy.append('    <UNITS_FOR_SYMMETRIES UNITS="Crystal"/>')
+    for i in range(nsym):
+        sy.append('    <SYMM.%d>\n      <INFO NAME="sym %d" T_REV="0"/>\n      <ROTATION type="integer" size="9" columns="3">\n 1 0 0\n 0 1 0\n 0 0 1\n</ROTATION>\n      <FRACTIONAL_TRANSLATION type="real" size="3" columns="3">\n 0.0 0.0 0.%d\n</FRACTIONAL_TRANSLATION>\n      <EQUIVALENT_IONS type="integer" size="%d" columns="8">\n%s\n</EQUIVALENT_IONS>\n    </SYMM.%d>' % (i+1, i, i, nat, ' '.join(str(j+1) for j in range(nat)), i+1))
+    sy.append('  </SYMMETRIES>')
+    a('\n'.join(sy))
+    a('  <EXCHANGE_CORRELATION>\n    <DFT type="character" size="1" len="4">\nPBE\n</DFT>\n    <LDA_PLUS_U_CALCULATION type="logical" size="1">\nT\n</LDA_PLUS_U_CALCULATION>\n    <HUBBARD_L type="integer" size="2">\n2 0\n</HUBBARD_L>\n    <HUBBARD_U type="real" size="2">\n0.1\n0.0\n</HUBBARD_U>\n    <HUBBARD_ALPHA type="real" size="2">\n0.0\n0.0\n</HUBBARD_ALPHA>\n    <HUBBARD_BETA type="real" size="2">\n0.0\n0.0\n</HUBBARD_BETA>\n    <HUBBARD_J0 type="real" size="2">\n0.0\n0.0\n</HUBBARD_J0>\n    <NON_LOCAL_DF type="integer" size="1">\n0\n</NON_LOCAL_DF>\n  </EXCHANGE_CORRELATION>')
+    a('''  <PLANE_WAVES>
+    <UNITS_FOR_CUTOFF UNITS="Hartree"/>
+    <WFC_CUTOFF type="real" size="1">
+ 1.5E+001
+</WFC_CUTOFF>
+    <RHO_CUTOFF type="real" size="1">
+ 1.2E+002
+</RHO_CUTOFF>
+    <FFT_GRID nr1="45" nr2="45" nr3="45"/>
+    <SMOOTH_FFT_GRID nr1s="32" nr2s="32" nr3s="32"/>
+  </PLANE_WAVES>''')
+    a('  <SPIN>\n' + '\n'.join('    <%s type="logical" size="1">\n%s\n</%s>' % (t, 'T' if (t=='LSDA' and nspin==2) else 'F', t) for t in ['LSDA','NON-COLINEAR_CALCULATION','SPIN-ORBIT_CALCULATION','SPIN-ORBIT_DOMAG']) + '\n  </SPIN>')
+    mg = ['  <MAGNETIZATION_INIT>', '    <CONSTRAINT_MAG type="integer" size="1">\n0\n</CONSTRAINT_MAG>']
+    for i in range(2):
+        mg.append('    <SPECIE.%d>\n      <STARTING_MAGNETIZATION type="real" size="1">\n 0.%d\n</STARTING_MAGNETIZATION>\n      <ANGLE1 type="real" size="1">\n 0.0\n</ANGLE1>\n      <ANGLE2 type="real" size="1">\n 0.0\n</ANGLE2>\n    </SPECIE.%d>' % (i+1, i, i+1))
+    mg.append('  </MAGNETIZATION_INIT>')
+    a('\n'.join(mg))
+    a('  <OCCUPATIONS>\n' + '\n'.join('    <%s type="logical" size="1">\n%s\n</%s>' % (t, 'T' if t=='SMEARING_METHOD' else 'F', t) for t in ['SMEARING_METHOD','TETRAHEDRON_METHOD','FIXED_OCCUPATIONS']) + '\n  </OCCUPATIONS>')
+    bz = ['  <BRILLOUIN_ZONE>', '    <NUMBER_OF_K-POINTS type="integer" size="1">\n%d\n</NUMBER_OF_K-POINTS>' % nk,
+          '    <UNITS_FOR_K-POINTS UNITS="2 pi / a"/>', '    <MONKHORST_PACK_GRID nk1="4" nk2="4" nk3="4"/>', '    <MONKHORST_PACK_OFFSET k1="0" k2="0" k3="0"/>']
+    for i in range(nk):
+        bz.append('    <K-POINT.%d XYZ="%f %f %f" WEIGHT="%f"/>' % (i+1, r.random(), r.random(), r.random(), 1./nk))
+    bz.append('    <STARTING_K-POINTS type="integer" size="1">\n1\n</STARTING_K-POINTS>')
+    bz.append('  </BRILLOUIN_ZONE>')
+    a('\n'.join(bz))
+    a('  <PARALLELISM>\n    <GRANULARITY_OF_K-POINTS_DISTRIBUTION type="integer" size="1">\n1\n</GRANULARITY_OF_K-POINTS_DISTRIBUTION>\n  </PARALLELISM>')
+    a('  <CHARGE-DENSITY iotk_link="./charge-density.dat">\n  </CHARGE-DENSITY>')
+    a('''  <BAND_STRUCTURE_INFO>
+    <NUMBER_OF_SPIN_COMPONENTS type="integer" size="1">
+%d
+</NUMBER_OF_SPIN_COMPONENTS>
+    <NUMBER_OF_ATOMIC_WFC type="integer" size="1">
+8
+</NUMBER_OF_ATOMIC_WFC>
+    <NUMBER_OF_BANDS type="integer" size="1">
+%d
+</NUMBER_OF_BANDS>
+    <NON-COLINEAR_CALCULATION type="logical" size="1">
+F
+</NON-COLINEAR_CALCULATION>
+    <NUMBER_OF_ELECTRONS type="real" size="1">
+ 8.0
+</NUMBER_OF_ELECTRONS>
+    <UNITS_FOR_ENERGIES UNITS="Hartree"/>
+    <FERMI_ENERGY type="real" size="1">
+ 2.1E-001
+</FERMI_ENERGY>
+  </BAND_STRUCTURE_INFO>''' % (nspin, nbnd))
+    ev = ['  <EIGENVALUES>']
+    for i in range(nk):
+        if nspin == 1:
+            ev.append('    <K-POINT.%d>\n      <K-POINT_COORDS type="real" size="3">\n 0 0 0\n</K-POINT_COORDS>\n      <WEIGHT type="real" size="1">\n 1\n</WEIGHT>\n      <DATAFILE iotk_link="./K%05d/eigenval.xml">\n      </DATAFILE>\n    </K-POINT.%d>' % (i+1, i+1, i+1))
+        else:
+            ev.append('    <K-POINT.%d>\n      <DATAFILE.1 iotk_link="./K%05d/eigenval1.xml">\n      </DATAFILE.1>\n      <DATAFILE.2 iotk_link="./K%05d/eigenval2.xml">\n      </DATAFILE.2>\n    </K-POINT.%d>' % (i+1, i+1, i+1, i+1))
+    ev.append('  </EIGENVALUES>')
+    a('\n'.join(ev))
+    a('  <EIGENVECTORS>\n' + '\n'.join('    <K-POINT.%d>\n      <WFC iotk_link="./K%05d/evc.dat"/>\n    </K-POINT.%d>' % (i+1, i+1, i+1) for i in range(nk)) + '\n  </EIGENVECTORS>')
+    a('</Root>\n')
+    for i in range(nk):
+        d = os.path.join(folder, 'K%05d' % (i+1))
+        os.makedirs(d)
+        names = ['eigenval.xml'] if nspin == 1 else ['eigenval1.xml', 'eigenval2.xml']
+        for n in names:
+            with open(os.path.join(d, n), 'w') as f:
+                f.write(eigenval_file_text(nbnd, r))
+
+    filename = os.path.join(folder, 'data-file.xml')
+    with open(filename, 'w') as f:
+        f.write('\n'.join(L))
+    return filename
+
+def eigenval_file_text(nbnd, r):
+    """
+    Return the text of a synthetic eigenval.xml file
+    """
+    e = '\n'.join(' %.15E' % (r.random()-0.5) for _ in range(nbnd))
+    o = '\n'.join(' %.15E' % r.random() for _ in range(nbnd))
+    return ('<?xml version="1.0"?>\n<?iotk version="1.2.0"?>\n<?iotk file_version="1.0"?>\n<?iotk binary="F"?>\n<?iotk qe_syntax="F"?>\n<Root>\n'
+            '  <INFO nbnd="%d" ik="1" ik_eff="1" Units="Hartree"/>\n  <UNITS_FOR_ENERGIES UNITS="Hartree"/>\n'
+            '  <EIGENVALUES type="real" size="%d">\n%s\n</EIGENVALUES>\n  <OCCUPATIONS type="real" size="%d">\n%s\n</OCCUPATIONS>\n</Root>\n') % (nbnd, nbnd, e, nbnd, o)
+
+
+def is_same_output(first, second):
+    """
+    Compare two outputs of parse_pw_xml_output, that contain numpy arrays
+    """
+    if isinstance(first, (dict, list, tuple)) or isinstance(second, (dict, list, tuple)):
+        if type(first) != type(second) or len(first) != len(second):
+            return False
+        if isinstance(first, dict):
+            return (sorted(first.keys()) == sorted(second.keys()) and
+                    all(is_same_output(first[key], second[key]) for key in first))
+        return all(is_same_output(a, b) for a, b in zip(first, second))
+    if isinstance(first, numpy.ndarray) or isinstance(second, numpy.ndarray):
+        return numpy.array_equal(first, second)
+    return first == second
+
+
+def parser_setup():
+    """
+    Setup the parser of command line arguments and return it
+    """
+    parser = argparse.ArgumentParser(
+        description='Time the minidom and etree backends of parse_pw_xml_output',
+    )
+    parser.add_argument(
+        '-k', type=int, default=0, dest='nk',
+        help='the number of k-points of the synthetic data file; if zero, only the files of the '
+             'parser tests fixtures are parsed. (default: %(default)d)'
+    )
+    parser.add_argument(
+        '-a', type=int, default=64, dest='nat',
+        help='the number of atoms of the synthetic data file. (default: %(default)d)'
+    )
+    parser.add_argument(
+        '-s', type=int, default=48, dest='nsym',
+        help='the number of symmetries of the synthetic data file. (default: %(default)d)'
+    )
+    parser.add_argument(
+        '-r', type=int, default=5, dest='repeat',
+        help='the number of runs of each backend; the best time is reported. (default: %(default)d)'
+    )
+
+    return parser
+
+
+def time_backends(name, filename, dir_with_bands, repeat):
+    """
+    Parse the data file with both backends, print the best time of each and check that they
+    return the same output
+
+    :raise AssertionError: if the outputs of the two backends differ
+    """
+    results = {}
+    times = {}
+    for backend in ['minidom', 'etree']:
+        times[backend] = []
+        for _ in range(repeat):
+            start = time.time()
+            with open(filename) as handle:
+                # as in parse_raw_output, the minidom backend gets the whole text
+                source = handle.read() if backend == 'minidom' else handle
+                results[backend] = parse_pw_xml_output(source, dir_with_bands, backend=backend)
+            times[backend].append(time.time() - start)
+
+    print '{:45s} {:10.1f} ms {:10.1f} ms'.format(name, 1000 * min(times['minidom']),
+                                                 1000 * min(times['etree']))
+    if not is_same_output(results['minidom'], results['etree']):
+        raise AssertionError('The backends return different outputs for {}'.format(filename))
+
+
+def execute(args):
+    """
+    Parse the data files of the fixtures, and the synthetic one if requested, with both backends
+    and print the best time of each
+    """
+    print '{:45s} {:>13s} {:>13s}'.format('data file', 'minidom', 'etree')
+    for test_name, filename, dir_with_bands in get_fixture_data_files():
+        name = '{} ({})'.format(test_name.replace('test_quantumespresso_', ''),
+                                'with bands' if dir_with_bands else 'no bands')
+        time_backends(name, filename, dir_with_bands, args.repeat)
+
+    if args.nk > 0:
+        folder = tempfile.mkdtemp()
+        try:
+            filename = write_data_file(folder, args.nat, args.nsym, args.nk)
+            name = 'synthetic ({} atoms, {} k-points)'.format(args.nat, args.nk)
+            time_backends(name, filename, folder, args.repeat)
+        finally:
+            shutil.rmtree(folder)
+
+    print 'the backends return the same output for all the data files'
+
+
+def main():
+    """
+    Setup the parser to retrieve the command line arguments and pass them to the main execution function.
+    """
+    parser = parser_setup()
+    args   = parser.parse_args()
+    result = execute(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,220 @@
+#!/usr/bin/env runaiida
+# -*- coding: utf-8 -*-
+"""
+Tests that the cards of the pw/cp input files, formatted with one operation per card, are byte-identical
+to those written one row at a time
+"""
+import random
+import unittest
+import numpy
+from aiida_quantumespresso.calculations import BasePwCpInputGenerator, get_card_rows_text, iter_card_rows_text
+
+
+class Generator(BasePwCpInputGenerator):
+    _blocked_keywords = []
+    _use_kpoints = True
+    _automatic_namelists = {'scf': ['CONTROL', 'SYSTEM', 'ELECTRONS']}
+
+
+class Parameters(object):
+
+    def __init__(self, dictionary):
+        self.dictionary = dictionary
+
+    def get_dict(self):
+        return dict((key, dict(value)) for key, value in self.dictionary.items())
+
+
+class Pseudo(object):
+
+    def __init__(self, pk):
+        self.pk = pk
+        self.filename = 'pseudo_{}.UPF'.format(pk)
+
+    def get_file_abs_path(self):
+        return '/pseudos/' + self.filename
+
+
+class Kind(object):
+
+    def __init__(self, name, mass):
+        self.name = name
+        self.mass = mass
+
+    def is_alloy(self):
+        return False
+
+    def has_vacancies(self):
+        return False
+
+
+class Site(object):
+
+    def __init__(self, kind_name, position):
+        self.kind_name = kind_name
+        self.position = position
+
+
+class Structure(object):
+
+    cell = [[5.43, 0., 0.], [0., 5.43, 0.], [0., 0., 10.86]]
+
+    def __init__(self, kinds, sites):
+        self.kinds = kinds
+        self._sites = sites
+
+    @property
+    def sites(self):
+        return list(self._sites)
+
+
+class KpointsList(object):
+
+    def __init__(self, kpoints, weights=None):
+        self.kpoints = kpoints
+        self.weights = weights
+
+    def get_kpoints_mesh(self, print_list=False):
+        raise AttributeError
+
+    def get_kpoints(self, also_weights=False):
+        if also_weights:
+            if self.weights is None:
+                raise AttributeError
+            return self.kpoints, self.weights
+        return self.kpoints
+
+
+class KpointsMesh(object):
+
+    def get_kpoints_mesh(self, print_list=False):
+        if print_list:
+            return numpy.array([[0., 0., 0.], [0., 0., 0.5], [0., 0.5, 0.], [0., 0.5, 0.5]])
+        return [1, 2, 2], [0., 0.5, 0.]
+
+
+def get_cards_by_row(structure, settings, kpoints):
+    """
+    Write the ATOMIC_POSITIONS, ATOMIC_VELOCITIES, K_POINTS and CELL_PARAMETERS cards one row at a
+    time, with the code of _generate_PWCPinputdata before the cards were formatted in one operation
+    """
+    fixed_coords = settings.get('FIXED_COORDS', None)
+    if fixed_coords is None:
+        fixed_coords_strings = [''] * len(structure.sites)
+    else:
+        fixed_coords_strings = ['  {:d} {:d} {:d}'.format(*[0 if _ else 1 for _ in this_atom_fix])
+                                for this_atom_fix in fixed_coords]
+    cards = ['ATOMIC_POSITIONS angstrom\n']
+    for site, fixed_coords_string in zip(structure.sites, fixed_coords_strings):
+        cards.append('{0} {1:18.10f} {2:18.10f} {3:18.10f} {4}\n'.format(
+            site.kind_name.ljust(6), site.position[0], site.position[1], site.position[2], fixed_coords_string))
+
+    atomic_velocities = settings.get('ATOMIC_VELOCITIES', None)
+    if atomic_velocities is not None:
+        cards.append('ATOMIC_VELOCITIES\n')
+        for site, vel in zip(structure.sites, atomic_velocities):
+            cards.append('{0} {1:18.10f} {2:18.10f} {3:18.10f}\n'.format(
+                site.kind_name.ljust(6), vel[0], vel[1], vel[2]))
+
+    try:
+        mesh, offset = kpoints.get_kpoints_mesh()
+        if settings.get('FORCE_KPOINTS_LIST', False):
+            kpoints_list = kpoints.get_kpoints_mesh(print_list=True)
+            weights = [1.] * len(kpoints_list)
+        else:
+            kpoints_list = None
+    except AttributeError:
+        kpoints_list = kpoints.get_kpoints()
+        try:
+            _, weights = kpoints.get_kpoints(also_weights=True)
+        except AttributeError:
+            weights = [1.] * len(kpoints_list)
+    if kpoints_list is None:
+        cards.append('K_POINTS automatic\n')
+        cards.append('{:d} {:d} {:d} {:d} {:d} {:d}\n'.format(*(list(mesh) + [0 if i == 0. else 1 for i in offset])))
+    else:
+        cards.append('K_POINTS crystal\n')
+        cards.append('{:d}\n'.format(len(kpoints_list)))
+        for kpoint, weight in zip(kpoints_list, weights):
+            cards.append('  {:18.10f} {:18.10f} {:18.10f} {:18.10f}\n'.format(
+                kpoint[0], kpoint[1], kpoint[2], weight))
+
+    cards.append('CELL_PARAMETERS angstrom\n')
+    for vector in structure.cell:
+        cards.append('{0:18.10f} {1:18.10f} {2:18.10f}\n'.format(*vector))
+    return ''.join(cards)
+
+
+class TestCards(unittest.TestCase):
+
+    def get_random_value(self, r):
+        """
+        Return a number of one of the kinds found in the positions and k-points: large and small
+        floats, integers, negative zero and single precision numpy floats
+        """
+        return r.choice([r.uniform(-1.e3, 1.e3), r.randint(-5, 5), numpy.float32(r.random()), 1.e-12, -0.,
+                         123456.123456789012, -0.00000000004])
+
+    def get_input_cards(self, structure, settings, kpoints):
+        pseudos = dict((kind.name, Pseudo(index % 2)) for index, kind in enumerate(structure.kinds))
+        parameters = Parameters({'control': {'calculation': 'scf'}, 'system': {'ecutwfc': 30.}})
+        inputfile, _ = Generator()._generate_PWCPinputdata(parameters, dict(settings), pseudos, structure, kpoints)
+        return inputfile[inputfile.index('ATOMIC_POSITIONS'):]
+
+    def test_cards(self):
+        r = random.Random(0)
+        numpy_random = numpy.random.RandomState(0)
+        for trial in range(200):
+            kinds = [Kind(name, r.uniform(1., 100.)) for name in r.sample(['Si', 'O', 'Fe1', 'H%', 'Ga'], r.randint(1, 3))]
+            num_sites = r.randint(1, 12)
+            sites = [Site(r.choice(kinds).name, tuple(self.get_random_value(r) for _ in range(3)))
+                     for _ in range(num_sites)]
+            structure = Structure(kinds, sites)
+
+            settings = {}
+            if r.random() < 0.5:
+                settings['FIXED_COORDS'] = [[r.choice([True, False]) for _ in range(3)] for _ in range(num_sites)]
+            if r.random() < 0.4:
+                settings['ATOMIC_VELOCITIES'] = [[self.get_random_value(r) for _ in range(3)]
+                                                 for _ in range(num_sites)]
+
+            choice = r.random()
+            if choice < 0.2:
+                kpoints = KpointsMesh()
+            elif choice < 0.3:
+                kpoints = KpointsMesh()
+                settings['FORCE_KPOINTS_LIST'] = True
+            else:
+                num_kpoints = r.randint(1, 20)
+                if r.random() < 0.5:
+                    kpoints_list = numpy_random.rand(num_kpoints, 3) * 2 - 1
+                else:
+                    kpoints_list = [[self.get_random_value(r) for _ in range(3)] for _ in range(num_kpoints)]
+                weights = None if r.random() < 0.3 else list(numpy_random.rand(num_kpoints))
+                kpoints = KpointsList(kpoints_list, weights)
+
+            self.assertEqual(self.get_input_cards(structure, settings, kpoints),
+                             get_cards_by_row(structure, settings, kpoints))
+
+    def test_get_card_rows_text(self):
+        values = [[1.5, -0.25, 1.e-12], [123456.123456789, -0., 3]]
+        labels = ['H%    ', 'Si    ']
+        expected = ''.join('{}  {:18.10f} {:18.10f} {:18.10f}\n'.format(label, *row)
+                           for label, row in zip(labels, values))
+        self.assertEqual(get_card_rows_text('  %18.10f %18.10f %18.10f', values, labels), expected)
+        self.assertEqual(get_card_rows_text('%d %d', [[1, 2], [3, 4]]), '1 2\n3 4\n')
+        self.assertEqual(get_card_rows_text('%d', numpy.zeros((0, 1))), '')
+        with self.assertRaises(ValueError):
+            get_card_rows_text('%d', [[1], [2]], ['a'])
+
+    def test_iter_card_rows_text(self):
+        values = numpy.random.RandomState(0).rand(25, 3)
+        labels = ['Si{}'.format(i) for i in range(25)]
+        expected = get_card_rows_text(' %18.10f %18.10f %18.10f', values, labels)
+        chunks = list(iter_card_rows_text(' %18.10f %18.10f %18.10f', values, labels, chunk_size=10))
+        self.assertEqual(len(chunks), 3)
+        self.assertEqual(''.join(chunks), expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,170 @@
+#!/usr/bin/env runaiida
+# -*- coding: utf-8 -*-
+"""
+Tests of the parser of the q2r.x force constants file and of ForceconstantsData
+"""
+import os
+import random
+import shutil
+import tempfile
+import unittest
+import numpy
+from aiida_quantumespresso.data.forceconstants import ForceconstantsData, parse_q2r_force_constants_file
+from aiida_quantumespresso.parsers.constants import bohr_to_ang
+
+
+def get_force_constants_lines(nat, qpoints_mesh, electric_field=False, seed=0):
+    """
+    Return the lines of a q2r.x force constants file with random positions and force constants
+    """
+    r = random.Random(seed)
+    lines = ['  2 {:3d}  0  10.2000000  0.0000000  0.0000000  0.0000000  0.0000000  0.0000000'.format(nat)]
+    lines += ['  0.5000000  0.5000000  0.0000000', '  0.0000000  0.5000000  0.5000000',
+              '  0.5000000  0.0000000  0.5000000']
+    lines += ["           1  'Si  '    25598.367", "           2  'Ge  '    66137.921"]
+    for na in range(nat):
+        lines.append('  {:3d} {:3d}  {:.10f} {:.10f} {:.10f}'.format(
+            na + 1, na % 2 + 1, r.random(), r.random(), r.random()))
+    if electric_field:
+        lines.append(' T')
+        lines += ['  {:.7f} {:.7f} {:.7f}'.format(*[r.uniform(10, 12) for _ in range(3)]) for _ in range(3)]
+        for na in range(nat):
+            lines.append('  {:3d}'.format(na + 1))
+            lines += ['  {:.7f} {:.7f} {:.7f}'.format(*[r.uniform(-2, 2) for _ in range(3)]) for _ in range(3)]
+    else:
+        lines.append(' F')
+    lines.append('  {} {} {}'.format(*qpoints_mesh))
+    for j1 in range(3):
+        for j2 in range(3):
+            for na1 in range(nat):
+                for na2 in range(nat):
+                    lines.append('  {}  {}  {}  {}'.format(j1 + 1, j2 + 1, na1 + 1, na2 + 1))
+                    for m3 in range(qpoints_mesh[2]):
+                        for m2 in range(qpoints_mesh[1]):
+                            for m1 in range(qpoints_mesh[0]):
+                                lines.append('{:4d}{:4d}{:4d}  {:18.11E}'.format(
+                                    m1 + 1, m2 + 1, m3 + 1, r.uniform(-1, 1)))
+    return [line + '\n' for line in lines]
+
+
+def read_force_constants_by_line(lines, nat, qpoints_mesh):
+    """
+    Read the force constants section (the last 9*nat*nat blocks of lines) one line at a time,
+    as parse_q2r_force_constants_file used to do, to compare with the bulk decoding
+    """
+    num_cells = qpoints_mesh[0] * qpoints_mesh[1] * qpoints_mesh[2]
+    current_line = len(lines) - 9 * nat * nat * (num_cells + 1)
+    force_constants = numpy.zeros(qpoints_mesh + (3, 3, nat, nat), dtype=float)
+    for j1 in range(3):
+        for j2 in range(3):
+            for na1 in range(nat):
+                for na2 in range(nat):
+                    indices = tuple([int(c) for c in lines[current_line].split()])
+                    assert indices == (j1 + 1, j2 + 1, na1 + 1, na2 + 1)
+                    current_line += 1
+                    for m3 in range(qpoints_mesh[2]):
+                        for m2 in range(qpoints_mesh[1]):
+                            for m1 in range(qpoints_mesh[0]):
+                                line = lines[current_line].split()
+                                assert tuple(int(c) for c in line[:3]) == (m1 + 1, m2 + 1, m3 + 1)
+                                force_constants[m1, m2, m3, j1, j2, na1, na2] = float(line[3])
+                                current_line += 1
+    return force_constants
+
+
+class TestParseQ2rForceConstantsFile(unittest.TestCase):
+
+    def test_force_constants(self):
+        """
+        The bulk decoding must give the same array as the line by line reader, for a mesh with
+        different sizes along the three directions, to catch a wrong order of the axes
+        """
+        for nat, qpoints_mesh in [(1, (1, 1, 1)), (2, (2, 3, 4)), (3, (4, 1, 2))]:
+            lines = get_force_constants_lines(nat, qpoints_mesh)
+            parsed_data, force_constants, warnings = parse_q2r_force_constants_file(lines, also_force_constants=True)
+            expected = read_force_constants_by_line(lines, nat, qpoints_mesh)
+
+            self.assertEqual(force_constants.shape, qpoints_mesh + (3, 3, nat, nat))
+            self.assertTrue(force_constants.flags['C_CONTIGUOUS'])
+            self.assertTrue(numpy.array_equal(force_constants, expected))
+            self.assertEqual(parsed_data['qpoints_mesh'], qpoints_mesh)
+            self.assertEqual(warnings, [])
+
+    def test_header(self):
+        """
+        Check the attributes read from the header, with the dielectric tensor and the effective charges
+        """
+        lines = get_force_constants_lines(2, (2, 2, 2), electric_field=True)
+        parsed_data, force_constants, _ = parse_q2r_force_constants_file(lines, also_force_constants=True)
+
+        self.assertEqual(parsed_data['number_of_species'], 2)
+        self.assertEqual(parsed_data['number_of_atoms'], 2)
+        self.assertAlmostEqual(parsed_data['lattice_parameter'], 10.2 * bohr_to_ang)
+        self.assertAlmostEqual(parsed_data['cell'][0][0], 5.1 * bohr_to_ang)
+        self.assertEqual([atom[:2] for atom in parsed_data['atom_list']], [('Si', 25598.367), ('Ge', 66137.921)])
+        self.assertTrue(parsed_data['has_done_electric_field'])
+        self.assertEqual(len(parsed_data['effective_charges_eu']), 2)
+        self.assertEqual(force_constants.shape, (2, 2, 2, 3, 3, 2, 2))
+
+    def test_without_force_constants(self):
+        lines = get_force_constants_lines(2, (2, 2, 2))
+        _, force_constants, _ = parse_q2r_force_constants_file(lines)
+        self.assertEqual(force_constants, ())
+
+    def test_wrong_indices(self):
+        lines = get_force_constants_lines(2, (2, 2, 2))
+        lines[-1] = '   1   2   2   1.00000000000E+00\n'
+        with self.assertRaises(ValueError):
+            parse_q2r_force_constants_file(lines, also_force_constants=True)
+
+    def test_missing_lines(self):
+        lines = get_force_constants_lines(2, (2, 2, 2))
+        with self.assertRaises(ValueError):
+            parse_q2r_force_constants_file(lines[:-1], also_force_constants=True)
+
+
+class TestForceconstantsData(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.nat = 2
+        self.qpoints_mesh = (2, 3, 1)
+        self.lines = get_force_constants_lines(self.nat, self.qpoints_mesh)
+        self.filename = os.path.join(self.folder, 'real_space_force_constants.dat')
+        with open(self.filename, 'w') as handle:
+            handle.writelines(self.lines)
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_force_constants(self):
+        """
+        The force constants read back from the memory-mapped .npy file, as for a node loaded from
+        the database, must be the ones of the text file
+        """
+        expected = read_force_constants_by_line(self.lines, self.nat, self.qpoints_mesh)
+        node = ForceconstantsData(file=self.filename)
+
+        self.assertTrue(numpy.array_equal(node.force_constants, expected))
+        self.assertIn(node._get_force_constants_filename(), node.get_folder_list())
+
+        # drop the array cached by set_file, to read it back from the .npy file
+        del node._force_constants
+        force_constants = node.force_constants
+        self.assertIsInstance(force_constants, numpy.memmap)
+        self.assertTrue(numpy.array_equal(force_constants, expected))
+        self.assertIs(node.force_constants, force_constants)
+
+        # without the .npy file, the force constants are parsed from the text file
+        del node._force_constants
+        os.remove(node.get_abs_path(node._get_force_constants_filename()))
+        self.assertTrue(numpy.array_equal(node.force_constants, expected))
+
+    def test_lattice_parameter(self):
+        node = ForceconstantsData(file=self.filename)
+        self.assertAlmostEqual(node.lattice_parameter, 10.2 * bohr_to_ang)
+        self.assertEqual(node.qpoints_mesh, self.qpoints_mesh)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,50 @@
+#!/usr/bin/env runaiida
+# -*- coding: utf-8 -*-
+"""
+Tests of read_numeric_table, the reader of the dos, pdos and evp tables
+"""
+import unittest
+import numpy
+from aiida_quantumespresso.parsers import QEOutputParsingError, read_numeric_table, get_table_row_lengths
+
+
+class TestReadNumericTable(unittest.TestCase):
+
+    def test_table(self):
+        text = '#  E (eV)   dos(E)     Int dos(E)\n -5.0  0.1  0.0\n\n -4.9  0.2 1.E-02 # comment\n   \n'
+        values = read_numeric_table(text)
+        self.assertTrue(numpy.array_equal(values, [[-5.0, 0.1, 0.0], [-4.9, 0.2, 0.01]]))
+        self.assertTrue(numpy.array_equal(read_numeric_table(text, usecols=1), [0.1, 0.2]))
+        self.assertTrue(numpy.array_equal(read_numeric_table(text, num_columns=3, usecols=[0, 2]),
+                                          [[-5.0, 0.0], [-4.9, 0.01]]))
+
+    def test_empty(self):
+        for text in ['', '# header only\n', '  \n\n']:
+            self.assertEqual(read_numeric_table(text).shape, (0, 0))
+
+    def test_ragged_rows(self):
+        """
+        Rows of different lengths are an error, also when the total number of values is a multiple
+        of the number of columns
+        """
+        for text, line in [('1 2 3\n4 5 6 7\n8 9\n', 2), ('1 2 3\n4 5\n6 7 8 9\n', 2), ('1 2\n3 4\n\n5\n', 4)]:
+            with self.assertRaises(QEOutputParsingError) as context:
+                read_numeric_table(text)
+            self.assertIn('line {}'.format(line), str(context.exception))
+
+    def test_wrong_number_of_columns(self):
+        with self.assertRaises(QEOutputParsingError):
+            read_numeric_table('1 2 3\n4 5 6\n', num_columns=2)
+
+    def test_non_numeric(self):
+        for text in ['1 2\n3 x\n', '1 2\n3 nan\n']:
+            with self.assertRaises(QEOutputParsingError):
+                read_numeric_table(text)
+
+    def test_row_lengths(self):
+        self.assertEqual(list(get_table_row_lengths('1 2\n\n\t3  4 5 \r\n6')), [2, 0, 3, 1])
+        self.assertEqual(list(get_table_row_lengths('')), [0])
+
+
+if __name__ == '__main__':
+    unittest.main()
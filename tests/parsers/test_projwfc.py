@@ -0,0 +1,215 @@
+#!/usr/bin/env runaiida
+# -*- coding: utf-8 -*-
+"""
+Tests of the parser of the projwfc.x standard output
+"""
+import os
+import shutil
+import tempfile
+import unittest
+import numpy
+from aiida_quantumespresso.parsers import QEOutputParsingError
+from aiida_quantumespresso.parsers.projwfc import (parse_projwfc_stdout, _grow_kpoint_arrays, PdosAtmFiles,
+                                                   spin_dependent_pdos_subparcer)
+
+fixtures_folder = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'projwfc')
+
+# the values given by the parser before the single pass rewrite, on the fixture aiida.out
+# (with the k-points separated by spaces, that it did not split)
+expected_k_vect = numpy.array([[0., 0., 0.], [-0.25, -0.25, 0.25]])
+expected_bands = numpy.array([[-5.66371, 6.25445, 6.25446], [-4.80120, 1.98204, 4.83521]])
+expected_projections = numpy.array([
+    [[0.497, 0., 0., 0., 0.497],
+     [0., 0.331, 0.331, 0.331, 0.],
+     [0.021, 0.312, 0.309, 0.305, 0.019]],
+    [[0.451, 0.052, 0., 0., 0.449],
+     [0.206, 0., 0.402, 0.150, 0.201],
+     [0., 0.473, 0., 0.478, 0.]],
+])
+
+
+def get_stdout_lines(filename='aiida.out'):
+    with open(os.path.join(fixtures_folder, filename), 'r') as handle:
+        return handle.readlines()
+
+
+def split_kpoint_blocks(lines):
+    """
+    Split the lines of the standard output in the lines before the first k-point, the lines of each
+    k-point and the lines after the last one
+    """
+    kpoint_lines = [index for index, line in enumerate(lines) if 'k =' in line]
+    end = [index for index, line in enumerate(lines) if 'Lowdin Charges' in line][0]
+    blocks = [lines[start:stop] for start, stop in zip(kpoint_lines, kpoint_lines[1:] + [end])]
+    return lines[:kpoint_lines[0]], blocks, lines[end:]
+
+
+class TestParseProjwfcStdout(unittest.TestCase):
+
+    def test_fixture(self):
+        parsed = parse_projwfc_stdout(get_stdout_lines())
+
+        self.assertEqual(len(parsed['state_lines']), 5)
+        self.assertIn('state #   5: atom   2 (Si ), wfc  1 (l=0 m= 1)', parsed['state_lines'][-1])
+        self.assertTrue(any('JOB DONE' in line for line in parsed['other_lines']))
+        self.assertFalse(any('psi' in line for line in parsed['other_lines']))
+        self.assertTrue(numpy.array_equal(parsed['k_vect'], expected_k_vect))
+        self.assertTrue(numpy.array_equal(parsed['bands'], expected_bands))
+        self.assertTrue(numpy.array_equal(parsed['projections'], expected_projections))
+
+    def test_many_kpoints(self):
+        """
+        Repeat the k-points of the fixture to go beyond the initial size of the arrays, that are
+        then grown while reading
+        """
+        header, blocks, footer = split_kpoint_blocks(get_stdout_lines())
+        num_repeats = 20
+        parsed = parse_projwfc_stdout(header + sum(blocks * num_repeats, []) + footer)
+
+        self.assertTrue(numpy.array_equal(parsed['k_vect'], numpy.tile(expected_k_vect, (num_repeats, 1))))
+        self.assertTrue(numpy.array_equal(parsed['bands'], numpy.tile(expected_bands, (num_repeats, 1))))
+        self.assertTrue(numpy.array_equal(parsed['projections'],
+                                          numpy.tile(expected_projections, (num_repeats, 1, 1))))
+
+    def test_single_kpoint(self):
+        header, blocks, footer = split_kpoint_blocks(get_stdout_lines())
+        parsed = parse_projwfc_stdout(header + blocks[1] + footer)
+
+        self.assertTrue(numpy.array_equal(parsed['k_vect'], expected_k_vect[1:]))
+        self.assertTrue(numpy.array_equal(parsed['bands'], expected_bands[1:]))
+        self.assertTrue(numpy.array_equal(parsed['projections'], expected_projections[1:]))
+
+    def test_continuation_line(self):
+        """
+        The terms of the composition of a state can continue on the next lines
+        """
+        header, blocks, footer = split_kpoint_blocks(get_stdout_lines())
+        block = list(blocks[0])
+        index = [i for i, line in enumerate(block) if '0.019*[#   5]+' in line][0]
+        block[index] = '     psi = 0.312*[#   2]+0.309*[#   3]+0.305*[#   4]+0.019*[#   5]+\n'
+        block.insert(index + 1, '           0.021*[#   1]+\n')
+        parsed = parse_projwfc_stdout(header + block + blocks[1] + footer)
+
+        self.assertTrue(numpy.array_equal(parsed['projections'], expected_projections))
+
+    def test_wrong_number_of_bands(self):
+        header, blocks, footer = split_kpoint_blocks(get_stdout_lines())
+        block = blocks[1][:-4]
+        with self.assertRaises(QEOutputParsingError):
+            parse_projwfc_stdout(header + blocks[0] + block + footer)
+
+    def test_no_kpoints(self):
+        header, _, footer = split_kpoint_blocks(get_stdout_lines())
+        with self.assertRaises(QEOutputParsingError):
+            parse_projwfc_stdout(header + footer)
+
+    def test_grow_kpoint_arrays(self):
+        k_vect, bands, projections = _grow_kpoint_arrays(None, 2, 3, 5)
+        self.assertEqual((k_vect.shape, bands.shape, projections.shape), ((2, 3), (2, 3), (2, 3, 5)))
+
+        k_vect[:], bands[:], projections[:] = expected_k_vect, expected_bands, expected_projections
+        k_vect, bands, projections = _grow_kpoint_arrays((k_vect, bands, projections), 4, 3, 5)
+        self.assertEqual((k_vect.shape, bands.shape, projections.shape), ((4, 3), (4, 3), (4, 3, 5)))
+        self.assertTrue(numpy.array_equal(projections[:2], expected_projections))
+        self.assertFalse(projections[2:].any())
+
+
+class TestPdosAtmFiles(unittest.TestCase):
+
+    # (atom, kind, wfc, spdf) of the pdos_atm files, with atom 10 to check the numerical sorting
+    files = [(1, 'Si', 1, 's'), (1, 'Si', 2, 'p'), (2, 'Si', 1, 's'), (10, 'O', 1, 's'), (10, 'O', 2, 'd')]
+    num_energies = 11
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def write_files(self, nspin):
+        """
+        Write the pdos_atm files, where the pdos of the state (atom, wfc, l, m) and spin is
+        100*atom + 10*wfc + m + spin/2. at every energy, and return their paths and the expected pdos
+        """
+        energy = numpy.linspace(-5., 5., self.num_energies)
+        filepaths = []
+        expected = {}
+        for atom, kind, wfc, spdf in self.files:
+            l = 'spdf'.index(spdf)
+            columns = [energy] + [energy * 0.] * nspin
+            for m in range(1, 2 * l + 2):
+                for spin in range(nspin):
+                    columns.append(energy * 0. + 100 * atom + 10 * wfc + m + spin / 2.)
+                    expected[(atom, wfc, l, m, spin)] = columns[-1]
+            filepath = os.path.join(self.folder, 'aiida.pdos_atm#{}({})_wfc#{}({})'.format(atom, kind, wfc, spdf))
+            numpy.savetxt(filepath, numpy.array(columns).T, header='E (eV) ldos(E) pdos(E)', fmt='%9.3f')
+            filepaths.append(filepath)
+        return filepaths, expected
+
+    def test_keys(self):
+        filepaths, _ = self.write_files(1)
+        pdos_atm = PdosAtmFiles(filepaths)
+        self.assertEqual(pdos_atm.keys, [(1, 1, 0, 1), (1, 2, 1, 1), (1, 2, 1, 2), (1, 2, 1, 3), (2, 1, 0, 1),
+                                         (10, 1, 0, 1)] + [(10, 2, 2, m) for m in range(1, 6)])
+
+    def test_pdos(self):
+        for nspin in [1, 2]:
+            filepaths, expected = self.write_files(nspin)
+            for num_threads in [None, 1, 3]:
+                pdos_atm = PdosAtmFiles(filepaths, num_threads=num_threads)
+                pdos = pdos_atm.pdos
+                self.assertEqual(pdos.shape, (nspin, len(pdos_atm.keys), self.num_energies))
+                for spin in range(nspin):
+                    for index, key in enumerate(pdos_atm.keys):
+                        self.assertTrue(numpy.array_equal(pdos[spin, index], expected[key + (spin,)]))
+                self.assertTrue(numpy.allclose(pdos_atm.energy, numpy.linspace(-5., 5., self.num_energies)))
+
+    def test_lazy_loading(self):
+        """
+        Only the files of the requested states are read, with one or more threads
+        """
+        filepaths, expected = self.write_files(2)
+        for num_threads in [None, 3]:
+            pdos_atm = PdosAtmFiles(filepaths, num_threads=num_threads)
+            keys = [(10, 2, 2, 4), (1, 2, 1, 2), (10, 1, 0, 1)]
+            pdos = pdos_atm.get_pdos(keys, spin=1)
+            self.assertEqual(sorted(pdos_atm._arrays), [(1, 2), (10, 1), (10, 2)])
+            for key, array in zip(keys, pdos):
+                self.assertTrue(numpy.array_equal(array, expected[key + (1,)]))
+
+        # a file that is not needed is never opened
+        os.remove(filepaths[0])
+        pdos_atm = PdosAtmFiles(filepaths, num_threads=2)
+        pdos_atm.get_pdos([(2, 1, 0, 1)])
+        with self.assertRaises(IOError):
+            pdos_atm.get_pdos([(1, 1, 0, 1)])
+
+    def test_spin_dependent_pdos_subparcer(self):
+        filepaths, expected = self.write_files(2)
+        state_lines = ['     state #   1: atom   1 (Si ), wfc  2 (l=1 m= 3)\n',
+                       '     state #   2: atom  10 (O  ), wfc  1 (l=0 m= 1)\n']
+        out_info_dict = {'state_lines': state_lines, 'pdos_atm': PdosAtmFiles(filepaths, num_threads=2)}
+        for spin_down in [False, True]:
+            out_info_dict['spin_down'] = spin_down
+            pdos = spin_dependent_pdos_subparcer(out_info_dict)
+            self.assertTrue(numpy.array_equal(pdos[0], expected[(1, 2, 1, 3, int(spin_down))]))
+            self.assertTrue(numpy.array_equal(pdos[1], expected[(10, 1, 0, 1, int(spin_down))]))
+
+    def test_errors(self):
+        filepaths, _ = self.write_files(1)
+        pdos_atm = PdosAtmFiles(filepaths)
+        with self.assertRaises(QEOutputParsingError):
+            pdos_atm.get_pdos([(3, 1, 0, 1)])
+        with self.assertRaises(QEOutputParsingError):
+            pdos_atm.get_pdos([(1, 2, 1, 4)])
+        with self.assertRaises(QEOutputParsingError):
+            pdos_atm.get_pdos([(1, 1, 0, 1)], spin=1)
+
+        filepath = os.path.join(self.folder, 'aiida.pdos_atm#1(Si)_wfc#3(x)')
+        with self.assertRaises(QEOutputParsingError) as context:
+            PdosAtmFiles(filepaths + [filepath])
+        self.assertIn(filepath, str(context.exception))
+
+
+if __name__ == '__main__':
+    unittest.main()
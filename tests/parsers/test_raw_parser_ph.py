@@ -0,0 +1,145 @@
+#!/usr/bin/env runaiida
+# -*- coding: utf-8 -*-
+"""
+Tests of the parsing of the dynamical matrix files of ph.x, stacked in arrays
+"""
+import os
+import shutil
+import tempfile
+import unittest
+import numpy
+from aiida_quantumespresso.parsers.raw_parser_ph import (parse_raw_ph_output, parse_ph_dynmat,
+                                                         parse_ph_dynmat_files, stack_ph_dynmats)
+
+
+def get_dynmat_text(num_atoms, q_point, seed=0, overflow=False):
+    """
+    Return the text of a dynamical matrix file with random matrix and modes. With overflow, a frequency
+    and an eigenvector component are written as asterisks, as Fortran does for values that do not fit
+    """
+    random = numpy.random.RandomState(seed)
+    lines = ['Dynamical matrix file', '',
+             '  1    {}  2  10.2000000   0.0000000   0.0000000   0.0000000   0.0000000   0.0000000'.format(num_atoms),
+             "           1  'Si  '    25598.3633740000"]
+    for atom in range(num_atoms):
+        lines.append('    {}    1      {:.10f}      {:.10f}      {:.10f}'.format(atom + 1, *[atom * 0.25] * 3))
+    lines += ['', '     Dynamical  Matrix in cartesian axes', '',
+              '     q = (    {:.9f}   {:.9f}   {:.9f} ) '.format(*q_point), '']
+    for atom_a in range(num_atoms):
+        for atom_b in range(num_atoms):
+            lines.append('    {}    {}'.format(atom_a + 1, atom_b + 1))
+            for _ in range(3):
+                lines.append('  ' + '  '.join('{:.8f} {:.8f}'.format(*random.rand(2)) for _ in range(3)))
+    lines += ['', '     Diagonalizing the dynamical matrix', '',
+              '     q = (    {:.9f}   {:.9f}   {:.9f} ) '.format(*q_point), '', ' ' + '*' * 74]
+    for mode in range(3 * num_atoms):
+        frequency = random.rand() * 500
+        if overflow and mode == 1:
+            lines.append('     freq ({:5d}) = ********** [THz] = ********** [cm-1]'.format(mode + 1))
+        else:
+            lines.append('     freq ({:5d}) = {:15.6f} [THz] = {:15.6f} [cm-1]'.format(
+                mode + 1, frequency / 33.356, frequency))
+        for atom in range(num_atoms):
+            values = random.rand(6) - 0.5
+            if overflow and mode == 2 and atom == 0:
+                lines.append(' ( ********* {:9.6f} {:9.6f} {:9.6f} {:9.6f} {:9.6f} ) '.format(*values[1:]))
+            else:
+                lines.append(' ( {:9.6f} {:9.6f} {:9.6f} {:9.6f} {:9.6f} {:9.6f} ) '.format(*values))
+    lines.append(' ' + '*' * 74)
+    return '\n'.join(lines) + '\n'
+
+
+def to_float(values):
+    """
+    Convert the values returned by parse_ph_dynmat to a float array, with NaN for the values that could not be parsed
+    """
+    return numpy.array(values, dtype=float)
+
+
+class TestDynamicalMatrices(unittest.TestCase):
+
+    num_atoms = 2
+    q_points = [[0., 0., 0.], [0.1, 0., -0.5], [-0.25, 0.25, 0.125]]
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        # the first file, with the list of q-points, has no dynamical matrix
+        self.dynmat_files = [os.path.join(self.folder, 'dynamical-matrix-0')]
+        with open(self.dynmat_files[0], 'w') as handle:
+            handle.write('   4   4   4\n   3\n')
+        for index, q_point in enumerate(self.q_points):
+            filename = os.path.join(self.folder, 'dynamical-matrix-{}'.format(index + 1))
+            with open(filename, 'w') as handle:
+                handle.write(get_dynmat_text(self.num_atoms, q_point, seed=index, overflow=(index == 2)))
+            self.dynmat_files.append(filename)
+
+        # the matrices parsed one file at a time
+        self.expected = []
+        for filename in self.dynmat_files[1:]:
+            with open(filename) as handle:
+                self.expected.append(parse_ph_dynmat(handle.readlines(), also_eigenvectors=True))
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def check_arrays(self, arrays, also_eigenvectors):
+        num_modes = 3 * self.num_atoms
+        num_q = len(self.q_points)
+        self.assertEqual(sorted(arrays.keys()),
+                         ['eigenvectors', 'frequencies', 'q_points'] if also_eigenvectors else ['frequencies', 'q_points'])
+        self.assertEqual(arrays['frequencies'].shape, (num_q, num_modes))
+        self.assertEqual(arrays['q_points'].shape, (num_q, 3))
+
+        for index, expected in enumerate(self.expected):
+            self.assertTrue(numpy.allclose(arrays['q_points'][index], expected['q_point']))
+            self.assertTrue(numpy.allclose(arrays['frequencies'][index], to_float(expected['frequencies']),
+                                           equal_nan=True))
+        # the overflows of the last file are NaN
+        self.assertEqual(numpy.isnan(arrays['frequencies']).sum(), 1)
+
+        if also_eigenvectors:
+            eigenvectors = arrays['eigenvectors']
+            self.assertEqual(eigenvectors.shape, (num_q, num_modes, self.num_atoms, 3))
+            self.assertEqual(eigenvectors.dtype, complex)
+            for index, expected in enumerate(self.expected):
+                expected_eigenvectors = to_float(expected['eigenvectors'])
+                expected_eigenvectors = expected_eigenvectors[..., 0] + 1j * expected_eigenvectors[..., 1]
+                self.assertTrue(numpy.allclose(eigenvectors[index], expected_eigenvectors, equal_nan=True))
+            self.assertEqual(numpy.isnan(eigenvectors[2]).sum(), 3)
+            self.assertFalse(numpy.isnan(eigenvectors[:2]).any())
+
+    def test_stack(self):
+        for also_eigenvectors in [False, True]:
+            for num_workers in [None, 2]:
+                dynmat_list = parse_ph_dynmat_files(self.dynmat_files, num_workers,
+                                                    also_eigenvectors=also_eigenvectors)
+                self.assertIsNone(dynmat_list[0])
+                for dynmat_data in dynmat_list[1:]:
+                    self.assertEqual('eigenvectors' in dynmat_data, also_eigenvectors)
+                self.check_arrays(stack_ph_dynmats(dynmat_list[1:], also_eigenvectors), also_eigenvectors)
+
+    def test_parse_raw_ph_output(self):
+        out_file = os.path.join(self.folder, 'aiida.out')
+        with open(out_file, 'w') as handle:
+            handle.write('     Program PHONON v.6.1 starts on\n'
+                         '     PHONON       :      1.00s CPU      1.20s WALL\n\n   JOB DONE.\n')
+
+        for also_eigenvectors in [False, True]:
+            out_dict, arrays, successful = parse_raw_ph_output(out_file, dynmat_files=self.dynmat_files,
+                                                               also_eigenvectors=also_eigenvectors)
+            self.assertTrue(successful)
+            self.assertEqual(out_dict['number_of_dynamical_matrices'], len(self.q_points))
+            self.check_arrays(arrays, also_eigenvectors)
+
+    def test_different_sizes(self):
+        filename = os.path.join(self.folder, 'dynamical-matrix-4')
+        with open(filename, 'w') as handle:
+            handle.write(get_dynmat_text(self.num_atoms + 1, [0., 0., 0.5]))
+        dynmat_list = parse_ph_dynmat_files(self.dynmat_files[1:] + [filename], also_eigenvectors=True)
+        for also_eigenvectors in [False, True]:
+            with self.assertRaises(Exception):
+                stack_ph_dynmats(dynmat_list, also_eigenvectors)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,266 @@
+#!/usr/bin/env runaiida
+# -*- coding: utf-8 -*-
+"""
+Tests of the parser of the pw.x output on the files of the parser tests fixtures
+"""
+import glob
+import os
+import random
+import shutil
+import tempfile
+import unittest
+import numpy
+import aiida_quantumespresso
+from aiida_quantumespresso.parsers import QEOutputParsingError
+from aiida_quantumespresso.parsers.raw_parser_pw import (PwTextOutputParser, TrajectoryBuffer,
+                                                         check_parser_options, index_pw_ionic_steps,
+                                                         parse_pw_xml_output, parse_raw_output,
+                                                         pw_output_sections)
+from aiida_quantumespresso.tools.qeinputparser import parse_namelists
+
+parser_tests_folder = os.path.join(os.path.dirname(aiida_quantumespresso.__file__),
+                                   'tests', 'backend', 'parser_tests')
+
+pw_fixtures = ['pw_basic', 'pw_test1', 'pw_vanderwaals', 'pw_pointgroup_D4h', 'pw_bands_without_labels']
+
+
+def get_fixture_files(name):
+    """
+    Return the paths of the stdout and of the data-file.xml of a pw fixture, the folder with its
+    k-points subfolders (None if there is none) and the dictionary of its input parameters
+    """
+    nodes = os.path.join(parser_tests_folder, 'test_quantumespresso_{}'.format(name), 'nodes', '*', '*', '*')
+    out_file = glob.glob(os.path.join(nodes, 'path', 'aiida.out'))[0]
+    folder = os.path.dirname(out_file)
+    dir_with_bands = folder if glob.glob(os.path.join(folder, 'K*[0-9]')) else None
+    with open(glob.glob(os.path.join(nodes, 'raw_input', 'aiida.in'))[0]) as handle:
+        input_dict = parse_namelists(handle.read())
+    return out_file, os.path.join(folder, 'data-file.xml'), dir_with_bands, input_dict
+
+
+def get_text_parser(name):
+    """
+    Return a new PwTextOutputParser for the stdout of a pw fixture, with the data of its xml file
+    """
+    out_file, xml_file, dir_with_bands, input_dict = get_fixture_files(name)
+    with open(xml_file) as handle:
+        xml_data, structure_data, _ = parse_pw_xml_output(handle.read(), dir_with_bands)
+    return PwTextOutputParser(xml_data, structure_data, input_dict)
+
+
+def is_same_output(first, second):
+    """
+    Compare two outputs of the parser, that contain numpy arrays and TrajectoryBuffers
+    """
+    if isinstance(first, TrajectoryBuffer) or isinstance(second, TrajectoryBuffer):
+        first = numpy.asarray(first)
+        second = numpy.asarray(second)
+    if isinstance(first, (dict, list, tuple)) or isinstance(second, (dict, list, tuple)):
+        if type(first) != type(second) or len(first) != len(second):
+            return False
+        if isinstance(first, dict):
+            return (sorted(first.keys()) == sorted(second.keys()) and
+                    all(is_same_output(first[key], second[key]) for key in first))
+        return all(is_same_output(a, b) for a, b in zip(first, second))
+    if isinstance(first, numpy.ndarray) or isinstance(second, numpy.ndarray):
+        return numpy.array_equal(first, second)
+    return first == second
+
+
+def get_chunks(text, seed, max_size=5000):
+    """
+    Split the text in chunks of random sizes, that break the lines anywhere
+    """
+    rng = random.Random(seed)
+    chunks = []
+    start = 0
+    while start < len(text):
+        size = rng.choice([1, 7, 80, rng.randint(1, max_size)])
+        chunks.append(text[start:start + size])
+        start += size
+    return chunks
+
+
+class TestResumableParsing(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.expected = {}
+        for name in pw_fixtures:
+            parser = get_text_parser(name)
+            parser.feed_file(get_fixture_files(name)[0])
+            self.expected[name] = parser.close()
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_feed_data(self):
+        for name in pw_fixtures:
+            with open(get_fixture_files(name)[0], 'rb') as handle:
+                text = handle.read()
+
+            for seed in range(3):
+                parser = get_text_parser(name)
+                for chunk in get_chunks(text, seed):
+                    parser.feed_data(chunk)
+                    self.assertIsInstance(parser.current_warnings(), list)
+                self.assertEqual(parser.offset, len(text))
+
+                result = parser.close()
+                self.assertTrue(is_same_output(result, self.expected[name]), name)
+                self.assertEqual(parser.current_warnings(), self.expected[name][0]['warnings'])
+
+    def test_update(self):
+        for name in pw_fixtures:
+            with open(get_fixture_files(name)[0], 'rb') as handle:
+                text = handle.read()
+
+            filename = os.path.join(self.folder, '{}.out'.format(name))
+            open(filename, 'wb').close()
+            parser = get_text_parser(name)
+            self.assertEqual(parser.update(filename), 0)
+
+            # the file of a running calculation, that grows between the updates
+            num_bytes = 0
+            for chunk in get_chunks(text, seed=10, max_size=50000):
+                with open(filename, 'ab') as handle:
+                    handle.write(chunk)
+                num_bytes += parser.update(filename)
+                self.assertEqual(num_bytes, parser.offset)
+            self.assertEqual(num_bytes, len(text))
+            self.assertEqual(parser.update(filename), 0)
+
+            # the warnings of the running calculation are the same found by the one-shot parsing of
+            # the whole file, before it is closed
+            one_shot = get_text_parser(name)
+            with open(filename) as handle:
+                one_shot.feed(handle)
+            self.assertEqual(parser.current_warnings(), one_shot.current_warnings())
+
+            self.assertTrue(is_same_output(parser.close(), self.expected[name]), name)
+
+    def test_update_shorter_file(self):
+        with open(get_fixture_files('pw_basic')[0], 'rb') as handle:
+            text = handle.read()
+        filename = os.path.join(self.folder, 'aiida.out')
+        with open(filename, 'wb') as handle:
+            handle.write(text[:len(text) // 2])
+
+        parser = get_text_parser('pw_basic')
+        parser.update(filename)
+        with open(filename, 'wb') as handle:
+            handle.write(text[:len(text) // 4])
+        with self.assertRaises(QEOutputParsingError):
+            parser.update(filename)
+
+
+class TestParallelParsing(unittest.TestCase):
+
+    fixtures = ['pw_basic', 'pw_vanderwaals']
+
+    def test_text_workers(self):
+        for name in self.fixtures:
+            out_file, xml_file, dir_with_bands, input_dict = get_fixture_files(name)
+            # the steps are parsed in parallel only if there are at least two of them
+            step_starts = index_pw_ionic_steps(out_file, PwTextOutputParser._step_separator)[0]
+            self.assertTrue(len(step_starts) > 1)
+
+            expected = parse_raw_output(out_file, input_dict, None, xml_file, dir_with_bands)
+            for text_workers in [2, 3]:
+                result = parse_raw_output(out_file, input_dict, {'text_workers': text_workers},
+                                          xml_file, dir_with_bands)
+                self.assertTrue(is_same_output(result, expected), name)
+
+    def test_feed_file(self):
+        for name in self.fixtures:
+            out_file = get_fixture_files(name)[0]
+            parser = get_text_parser(name)
+            parser.feed_file(out_file)
+            expected_lines = parser.number_of_lines
+            expected = parser.close()
+
+            parser = get_text_parser(name)
+            parser.feed_file(out_file, num_workers=2)
+            self.assertEqual(parser.number_of_lines, expected_lines)
+            self.assertTrue(is_same_output(parser.close(), expected), name)
+
+
+class TestParserOptions(unittest.TestCase):
+
+    # the keys of the outputs of parse_raw_output that each excluded section may remove
+    section_keys = {
+        'bands': ['bands', 'bands_units', 'occupations'],
+        'dipole': ['dipole', 'dipole_units'],
+        'forces': ['forces', 'forces_units', 'total_force', 'total_force_units'],
+        'magnetic_moments': ['atomic_charges', 'atomic_charges_units', 'atomic_magnetic_moments',
+                             'atomic_magnetic_moments_units'],
+        'polarization': ['ionic_phase', 'ionic_phase_units', 'electronic_phase', 'electronic_phase_units',
+                         'total_phase', 'total_phase_units', 'polarization', 'polarization_units',
+                         'polarization_module', 'polarization_direction'],
+        'stress': ['stress', 'stress_units'],
+        'symmetries': ['symmetries', 'symmetries_units', 'number_of_symmetries',
+                       'number_of_bravais_symmetries', 'inversion_symmetry', 'do_not_use_time_reversal',
+                       'time_reversal_flag', 'no_time_rev_operations', 'pointgroup_international',
+                       'pointgroup_schoenflies'],
+        }
+    # the text of the warnings that each excluded section may remove
+    section_warnings = {
+        'stress': 'stress tensor',
+        'polarization': 'polarization',
+        }
+
+    def test_exclude(self):
+        self.assertEqual(sorted(self.section_keys), sorted(pw_output_sections))
+
+        removed = dict((section, set()) for section in pw_output_sections)
+        for name in pw_fixtures:
+            out_file, xml_file, dir_with_bands, input_dict = get_fixture_files(name)
+            expected = parse_raw_output(out_file, input_dict, None, xml_file, dir_with_bands)
+            for section in pw_output_sections:
+                result = parse_raw_output(out_file, input_dict, {'exclude': [section]}, xml_file,
+                                          dir_with_bands)
+                self.assertEqual(result[4], expected[4])
+
+                # out_dict, trajectory_data, structure_data and bands_data
+                for data, expected_data in zip(result[:4], expected[:4]):
+                    self.assertTrue(set(data) <= set(expected_data))
+                    missing = set(expected_data) - set(data)
+                    self.assertTrue(missing <= set(self.section_keys[section]),
+                                    '{} {}: {}'.format(name, section, sorted(missing)))
+                    removed[section] |= missing
+
+                    for key in data:
+                        if key == 'warnings':
+                            missing_warnings = [warning for warning in expected_data[key]
+                                                if warning not in data[key]]
+                            self.assertEqual(data[key], [warning for warning in expected_data[key]
+                                                         if warning not in missing_warnings])
+                            for warning in missing_warnings:
+                                self.assertIn(self.section_warnings.get(section, section), warning)
+                        else:
+                            self.assertTrue(is_same_output(data[key], expected_data[key]),
+                                            '{} {}: {}'.format(name, section, key))
+
+        # the sections found in the fixtures are removed
+        for section in ['bands', 'forces', 'magnetic_moments', 'stress', 'symmetries']:
+            self.assertTrue(removed[section], section)
+
+    def test_unknown_names(self):
+        out_file, xml_file, dir_with_bands, input_dict = get_fixture_files('pw_basic')
+        for parser_opts in [{'exclude': ['forces', 'force']}, {'xml_backend': 'sax'},
+                            {'exclude': 'bands'}]:
+            with self.assertRaises(QEOutputParsingError):
+                check_parser_options(parser_opts)
+            with self.assertRaises(QEOutputParsingError):
+                parse_raw_output(out_file, input_dict, parser_opts, xml_file, dir_with_bands)
+
+        with open(xml_file) as handle:
+            with self.assertRaises(QEOutputParsingError):
+                parse_pw_xml_output(handle.read(), backend='sax')
+
+        check_parser_options({})
+        check_parser_options({'xml_backend': 'etree', 'exclude': pw_output_sections})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,161 @@
+#!/usr/bin/env runaiida
+# -*- coding: utf-8 -*-
+"""
+Tests of the Fourier interpolation of the force constants of q2r.x
+"""
+import itertools
+import unittest
+import numpy
+from aiida_quantumespresso.tools.phonon_tools import (get_wigner_seitz_weights, get_nonanalytic_term,
+                                                      apply_force_constants_sum_rule, diagonalize_dynamical_matrices,
+                                                      interpolate_dynamical_matrices)
+
+cell = numpy.array([[-0.5, 0., 0.5], [0., 0.5, 0.5], [-0.5, 0.5, 0.]])
+positions = numpy.array([[0., 0., 0.], [0.25, 0.25, 0.25]])
+masses = numpy.array([69.723, 74.922])
+lattice_parameter = 10.2
+dielectric_tensor = numpy.array([[12., 0.3, 0.], [0.3, 11., 0.1], [0., 0.1, 13.]])
+effective_charges = numpy.array([numpy.diag([2.1, 2.0, 2.2]), -numpy.diag([2.1, 2.0, 2.2])])
+
+
+def get_mesh(qpoints_mesh):
+    """
+    Return the (nq, 3) array with the crystal coordinates of the q-points of the mesh, and the (nq, 3) array
+    with the integer coordinates of the cells of the supercell
+    """
+    cells = numpy.array(list(itertools.product(*[range(_) for _ in qpoints_mesh])))
+    return cells / numpy.array(qpoints_mesh, dtype=float), cells
+
+
+def get_spring_force_constants(qpoints_mesh, seed=0):
+    """
+    Return the force constants C(m1,m2,m3,j1,j2,na1,na2) of random springs between each atom and the atoms of
+    the neighbouring cells, that satisfy the acoustic sum rule
+    """
+    random = numpy.random.RandomState(seed)
+    num_atoms = len(positions)
+    force_constants = numpy.zeros(tuple(qpoints_mesh) + (3, 3, num_atoms, num_atoms))
+    for na, nb in itertools.product(range(num_atoms), repeat=2):
+        for vector in itertools.product([-1, 0, 1], repeat=3):
+            if na == nb and not any(vector):
+                continue
+            distance = numpy.dot(vector, cell) + positions[nb] - positions[na]
+            direction = distance / numpy.sqrt((distance ** 2).sum())
+            spring = random.rand() * 0.01 * numpy.outer(direction, direction)
+            # the spring between na in the cell 0 and nb in the cell R, and between nb in 0 and na in -R
+            m1, m2, m3 = numpy.array(vector) % qpoints_mesh
+            force_constants[m1,m2,m3,:,:,na,nb] -= spring
+            force_constants[0,0,0,:,:,na,na] += spring
+            m1, m2, m3 = -numpy.array(vector) % qpoints_mesh
+            force_constants[m1,m2,m3,:,:,nb,na] -= spring
+            force_constants[0,0,0,:,:,nb,nb] += spring
+    return force_constants
+
+
+class TestWignerSeitzWeights(unittest.TestCase):
+
+    def test_total_weight(self):
+        for qpoints_mesh in [(1, 1, 1), (2, 2, 2), (3, 3, 2), (4, 1, 2)]:
+            for this_cell in [cell, numpy.eye(3)]:
+                vectors, weights = get_wigner_seitz_weights(this_cell, positions, qpoints_mesh)
+                self.assertEqual(weights.shape, (len(vectors), 2, 2))
+                self.assertTrue(numpy.allclose(weights.sum(axis=0), numpy.prod(qpoints_mesh)))
+                # the weights of the lattice vectors of each cell of the supercell add up to one
+                cells = vectors % qpoints_mesh
+                for this in numpy.unique(cells.dot([10000, 100, 1])):
+                    is_this = cells.dot([10000, 100, 1]) == this
+                    self.assertTrue(numpy.allclose(weights[is_this].sum(axis=0), 1.))
+
+    def test_border(self):
+        # in the cubic cell, the atoms at the same position have vectors on the faces, edges and corners of the
+        # Wigner-Seitz cell of the supercell
+        vectors, weights = get_wigner_seitz_weights(numpy.eye(3), numpy.zeros((1, 3)), (2, 2, 2))
+        self.assertEqual(len(vectors), 27)
+        self.assertEqual(sorted(set(weights.ravel())), [0.125, 0.25, 0.5, 1.])
+
+    def test_chunks(self):
+        expected = get_wigner_seitz_weights(cell, positions, (3, 3, 2))
+        for chunk_size in [1, 7, 100000]:
+            vectors, weights = get_wigner_seitz_weights(cell, positions, (3, 3, 2), chunk_size=chunk_size)
+            self.assertTrue(numpy.array_equal(vectors, expected[0]))
+            self.assertTrue(numpy.array_equal(weights, expected[1]))
+
+
+class TestInterpolation(unittest.TestCase):
+
+    def test_on_mesh(self):
+        random = numpy.random.RandomState(1)
+        for qpoints_mesh in [(1, 1, 1), (2, 2, 2), (3, 3, 2), (4, 1, 2)]:
+            force_constants = random.rand(*(qpoints_mesh + (3, 3, 2, 2))) - 0.5
+            q_points, cells = get_mesh(qpoints_mesh)
+
+            # the dynamical matrices of the q-points of the mesh, as computed by ph.x
+            phases = numpy.exp(-2.j * numpy.pi * q_points.dot(cells.T))
+            expected = numpy.einsum('qm,mijab->qaibj', phases, force_constants.reshape((-1, 3, 3, 2, 2)))
+            expected = expected.reshape(len(q_points), 6, 6)
+
+            for chunk_size in [1, 1000]:
+                dynamical_matrices = interpolate_dynamical_matrices(q_points, force_constants, cell, positions,
+                                                                    lattice_parameter, chunk_size=chunk_size)
+                self.assertEqual(dynamical_matrices.shape, (len(q_points), 6, 6))
+                self.assertTrue(numpy.allclose(dynamical_matrices, expected))
+
+            # the same at the q-points shifted by a reciprocal lattice vector
+            dynamical_matrices = interpolate_dynamical_matrices(q_points + [1, -2, 0], force_constants, cell,
+                                                                positions, lattice_parameter)
+            self.assertTrue(numpy.allclose(dynamical_matrices, expected))
+
+    def test_acoustic_sum_rule(self):
+        qpoints_mesh = (2, 2, 2)
+        force_constants = get_spring_force_constants(qpoints_mesh)
+
+        # break the sum rule with a symmetric on-site term
+        broken = force_constants.copy()
+        broken[0,0,0,:,:,0,0] += 0.002 * numpy.array([[1., 0.2, 0.], [0.2, 1.5, 0.], [0., 0., 0.8]])
+        broken[0,0,0,:,:,1,1] += 0.001 * numpy.eye(3)
+
+        gamma = numpy.zeros((1, 3))
+        for this, is_acoustic in [(force_constants, True), (broken, False),
+                                  (apply_force_constants_sum_rule(broken)[0], True)]:
+            dynamical_matrices = interpolate_dynamical_matrices(gamma, this, cell, positions, lattice_parameter)
+            frequencies = diagonalize_dynamical_matrices(dynamical_matrices, masses, False)[0][0]
+            self.assertEqual(numpy.all(numpy.abs(frequencies[:3]) < 1.e-3), is_acoustic)
+            self.assertTrue(numpy.all(frequencies[3:] > 10.))
+
+        # the sum rule does not change force constants that already satisfy it
+        self.assertTrue(numpy.allclose(apply_force_constants_sum_rule(force_constants)[0], force_constants))
+
+    def test_nonanalytic_term(self):
+        force_constants = get_spring_force_constants((2, 2, 2))
+        volume = abs(numpy.linalg.det(cell)) * lattice_parameter ** 3
+        reciprocal_cell = numpy.linalg.inv(cell).T
+
+        # the term does not depend on the norm of the directions, and is zero for the zero direction
+        directions = numpy.array([[0.1, 0., 0.], [2., 0., 0.], [1.e-6, 2.e-6, 0.], [1., 2., 0.], [0., 0., 0.]])
+        terms = get_nonanalytic_term(directions, dielectric_tensor, effective_charges, volume)
+        self.assertTrue(numpy.allclose(terms[0], terms[1]))
+        self.assertTrue(numpy.allclose(terms[2], terms[3]))
+        self.assertFalse(numpy.allclose(terms[0], terms[3]))
+        self.assertTrue(terms[:4].any(axis=(1, 2)).all())
+        self.assertFalse(terms[4].any())
+
+        # the term is added at q = 0 and at the other reciprocal lattice vectors, along the direction from the
+        # previous q-point, or from the next one for the first q-point
+        for q_points in [[[0.9, 0., 0.], [1., 0., 0.]], [[0., 0., 0.], [0., 0.2, 0.]],
+                         [[0.3, 0.1, 0.], [0., 0., 0.]], [[-1.1, 1., 1.], [-1., 1., 1.]]]:
+            q_points = numpy.array(q_points)
+            index = 0 if abs(q_points[0] - numpy.round(q_points[0])).max() < 1.e-8 else 1
+            dynamical_matrices = interpolate_dynamical_matrices(q_points, force_constants, cell, positions,
+                lattice_parameter, dielectric_tensor, effective_charges)
+            # with a single q-point the direction of approach is not defined, and the term is not added
+            analytic = interpolate_dynamical_matrices(q_points[index:index+1], force_constants, cell,
+                positions, lattice_parameter, dielectric_tensor, effective_charges)[0]
+            cartesian_q_points = q_points.dot(reciprocal_cell)
+            direction = cartesian_q_points[index] - cartesian_q_points[1 - index]
+            expected = get_nonanalytic_term([direction], dielectric_tensor, effective_charges, volume)[0]
+            self.assertTrue(expected.any())
+            self.assertTrue(numpy.allclose(dynamical_matrices[index], analytic + expected))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,36 @@
+#!/usr/bin/env runaiida
+# -*- coding: utf-8 -*-
+"""
+Tests of the split of the q-points in chunks of the PhParallelWorkChain
+"""
+import unittest
+from aiida_quantumespresso.workflows.ph.parallel import get_qpoint_chunks
+
+
+class TestQpointChunks(unittest.TestCase):
+
+    def test_cover(self):
+        for num_qpoints in range(1, 30):
+            for qpoints_per_chunk in range(1, 35):
+                chunks = get_qpoint_chunks(num_qpoints, qpoints_per_chunk)
+                self.assertEqual(len(chunks), -(-num_qpoints // qpoints_per_chunk))
+                # consecutive ranges from 1 to num_qpoints, without gaps or overlaps
+                self.assertEqual(chunks[0][0], 1)
+                self.assertEqual(chunks[-1][1], num_qpoints)
+                for (start_q, last_q), (next_start_q, _) in zip(chunks, chunks[1:]):
+                    self.assertEqual(next_start_q, last_q + 1)
+                covered = sum([range(start_q, last_q + 1) for start_q, last_q in chunks], [])
+                self.assertEqual(covered, range(1, num_qpoints + 1))
+                for start_q, last_q in chunks:
+                    self.assertTrue(1 <= last_q - start_q + 1 <= qpoints_per_chunk)
+
+    def test_examples(self):
+        self.assertEqual(get_qpoint_chunks(8, 3), [(1, 3), (4, 6), (7, 8)])
+        self.assertEqual(get_qpoint_chunks(8, 4), [(1, 4), (5, 8)])
+        self.assertEqual(get_qpoint_chunks(8, 1), [(_, _) for _ in range(1, 9)])
+        self.assertEqual(get_qpoint_chunks(3, 10), [(1, 3)])
+        self.assertEqual(get_qpoint_chunks(0, 2), [])
+
+
+if __name__ == '__main__':
+    unittest.main()